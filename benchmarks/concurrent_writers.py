@@ -0,0 +1,104 @@
+"""
+Measures how write throughput to a shared SQLite database changes with the number of concurrent writer processes,
+with SQLite's default settings and with the engine profile from personal_diary/engine.py.
+
+Every worker process creates entries with Diary.create_entry for --duration seconds, the way separate gunicorn
+workers would. Writes that fail, such as with "database is locked", are counted as errors.
+
+Usage:
+    python -m benchmarks.concurrent_writers [--workers 1 2 4 8] [--duration 5] [--json results.json]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+
+
+def write_entries(database_uri: str, profile: str, worker: int, duration: float, start, results) -> None:
+    """
+    Creates entries until duration seconds after the start event is set, then reports the number of entries
+    created and the number of failed writes.
+    """
+    from sqlalchemy.exc import OperationalError
+
+    from personal_diary import db
+    from personal_diary.app import flask_app
+    from personal_diary.diary import Diary
+    from personal_diary.engine import EngineProfile
+
+    flask_app.config['SQLALCHEMY_DATABASE_URI'] = database_uri
+    flask_app.config['SQLALCHEMY_ENGINE_OPTIONS'] = \
+        EngineProfile.engine_options(database_uri) if profile == "tuned" else {}
+
+    writes = errors = 0
+    with flask_app.app_context():
+        db.create_all()
+        start.wait()
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            try:
+                Diary.create_entry({"title": "Load test", "body": "<p>Concurrent writer</p>",
+                                    "user_id": f"writer-{worker}", "tags": ["load", f"writer-{worker}"],
+                                    "mood": "&#128512"})
+                writes += 1
+            except OperationalError:
+                db.session.rollback()
+                errors += 1
+        db.session.remove()
+        db.engine.dispose()
+    results.put((writes, errors))
+
+
+def run(profile: str, worker_count: int, duration: float, directory: str) -> dict:
+    """
+    Runs worker_count writer processes against a fresh database.
+    """
+    database_uri = "sqlite:///" + os.path.join(directory, f"{profile}-{worker_count}.db")
+    context = multiprocessing.get_context("spawn")
+    start = context.Event()
+    results = context.Queue()
+    workers = [context.Process(target=write_entries, args=(database_uri, profile, worker, duration, start, results))
+               for worker in range(worker_count)]
+
+    # the first worker creates the tables before the others connect
+    workers[0].start()
+    time.sleep(3)
+    for worker in workers[1:]:
+        worker.start()
+    time.sleep(3)
+    start.set()
+
+    counts = [results.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+
+    writes = sum(count[0] for count in counts)
+    return {"writes": writes, "errors": sum(count[1] for count in counts), "writes_per_second": writes / duration}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--duration", type=float, default=5)
+    parser.add_argument("--json", help="file to write the results to as JSON")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for profile in ("default", "tuned"):
+            results[profile] = {}
+            for worker_count in args.workers:
+                result = run(profile, worker_count, args.duration, directory)
+                results[profile][str(worker_count)] = result
+                print(f"{profile:>7} {worker_count:>2} workers: {result['writes_per_second']:8.1f} writes/s, "
+                      f"{result['errors']} errors")
+
+    if args.json:
+        with open(args.json, "w") as results_file:
+            json.dump(results, results_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Seeded synthetic data for the benchmarks. The same arguments always produce the same users, entries and tags, so
+results from different commits are measured against identical databases.
+"""
+import random
+from datetime import datetime, timedelta
+
+from werkzeug.security import generate_password_hash
+
+from personal_diary import db
+from personal_diary.forms import MOOD_CHOICES
+from personal_diary.models import Entry, Tag, User, tags
+from personal_diary.search_index import SearchIndex
+
+"""
+The words entry titles and bodies are made of. Searches for any of them match a predictable share of entries.
+"""
+WORDS = ["today", "class", "walk", "coffee", "friends", "rain", "sunny", "dinner", "project", "music", "garden",
+         "train", "letter", "movie", "beach", "tired", "happy", "exam", "family", "morning", "quiet", "library",
+         "market", "bread", "river", "winter", "summer", "sleep", "lunch", "holiday"]
+
+"""
+The password of every synthetic user
+"""
+PASSWORD = "benchmark password"
+
+SEED_CHUNK_SIZE = 10000
+
+
+def user_id(number: int) -> str:
+    return f"user-{number}"
+
+
+def tag_name(number: int) -> str:
+    return f"tag-{number}"
+
+
+def seed_database(entry_count: int, user_count: int = 100, tag_count: int = 500, seed: int = 0,
+                  start: datetime = datetime(2020, 1, 1)) -> None:
+    """
+    Recreates the app's database and fills it with synthetic users, entries and tags. Entries are spread randomly
+    over the users and over the two years after start, and each has up to three random tags.
+
+    Args:
+        entry_count: the number of entries to create
+        user_count: the number of users the entries are spread over
+        tag_count: the number of distinct tags
+        seed: the seed of the random generator
+        start: the earliest created datetime of an entry
+    """
+    db.session.remove()
+    db.drop_all()
+    db.create_all()
+
+    rng = random.Random(seed)
+    moods = [value for value, _ in MOOD_CHOICES]
+    password = generate_password_hash(PASSWORD)
+    with db.engine.begin() as connection:
+        connection.execute(User.__table__.insert(), [
+            {"id": user_id(number), "username": f"user{number}", "name": f"User {number}", "password": password}
+            for number in range(user_count)])
+        connection.execute(Tag.__table__.insert(), [{"id": number + 1, "name": tag_name(number)}
+                                                    for number in range(tag_count)])
+
+    for chunk_start in range(0, entry_count, SEED_CHUNK_SIZE):
+        entries, entry_tags = [], []
+        for entry_number in range(chunk_start, min(chunk_start + SEED_CHUNK_SIZE, entry_count)):
+            created = start + timedelta(seconds=rng.randrange(60 * 60 * 24 * 365 * 2))
+            entry_id = f"entry-{entry_number}"
+            entries.append({"id": entry_id,
+                            "title": " ".join(rng.choices(WORDS, k=3)).capitalize(),
+                            "body": "<p>" + " ".join(rng.choices(WORDS, k=40)) + "</p>",
+                            "created": created,
+                            "modified": created + timedelta(minutes=rng.randrange(60 * 24 * 7)),
+                            "user_id": user_id(rng.randrange(user_count)),
+                            "mood": rng.choice(moods)})
+            for tag_id in rng.sample(range(1, tag_count + 1), rng.randint(0, min(3, tag_count))):
+                entry_tags.append({"tag_id": tag_id, "entry_id": entry_id})
+
+        with db.engine.begin() as connection:
+            with SearchIndex.deferred_indexing(connection):
+                connection.execute(Entry.__table__.insert(), entries)
+                if entry_tags:
+                    connection.execute(tags.insert(), entry_tags)
+
+    with db.engine.begin() as connection:
+        if connection.dialect.name == "sqlite":
+            connection.exec_driver_sql("ANALYZE")
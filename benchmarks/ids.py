@@ -0,0 +1,95 @@
+"""
+Compares random UUIDv4 ids stored as text with time-ordered UUIDv7 ids stored as 16 bytes, the way the ids of
+entries were stored before and after TimeOrderedIds.
+
+For each kind of id, entries are inserted --chunk-size at a time into a fresh SQLite database with the primary key
+and the user_id, created, id index of DiaryEntries, one transaction per chunk. The insert rate over every entry and
+over the last chunk is printed, since random ids slow down as the primary key index outgrows the page cache, along
+with the size of the table and of each index as counted by SQLite's dbstat virtual table.
+
+Usage:
+    python -m benchmarks.ids [--entries 1000000] [--chunk-size 10000] [--cache-kib 2000] [--json results.json]
+"""
+import argparse
+import json
+import os
+import sqlite3
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from personal_diary.ids import TimeOrderedIds
+
+"""
+Maps each kind of id to the declared type of its columns and a function making a new id as it is stored
+"""
+ID_KINDS = {
+    "uuid4_text": ("VARCHAR", lambda: str(uuid.uuid4())),
+    "uuid7_blob": ("BLOB", lambda: TimeOrderedIds.new_uuid().bytes)
+}
+
+
+def run(path: str, column_type: str, new_id, entry_count: int, chunk_size: int, cache_kib: int) -> dict:
+    """
+    Inserts entries with one kind of id into a new database.
+
+    Returns:
+        a dictionary of the insert rates and the size in bytes of the table and of each index
+    """
+    connection = sqlite3.connect(path, isolation_level=None)
+    connection.execute(f"PRAGMA cache_size = -{cache_kib}")
+    connection.execute("PRAGMA journal_mode = WAL")
+    connection.execute(f'CREATE TABLE "DiaryEntries" (id {column_type} NOT NULL, title VARCHAR NOT NULL, '
+                       f'created DATETIME NOT NULL, user_id {column_type} NOT NULL, mood SMALLINT NOT NULL, '
+                       f'PRIMARY KEY (id))')
+    connection.execute('CREATE INDEX "ix_DiaryEntries_user_id_created" ON "DiaryEntries" (user_id, created, id)')
+
+    user_id = new_id()
+    start = datetime(2020, 1, 1)
+    inserted = 0
+    total_seconds = 0.0
+    last_chunk_seconds = 0.0
+    while inserted < entry_count:
+        rows = [(new_id(), f"Title {number}", (start + timedelta(minutes=number)).isoformat(" "), user_id, 2)
+                for number in range(inserted, min(inserted + chunk_size, entry_count))]
+        chunk_start = time.perf_counter()
+        connection.execute("BEGIN")
+        connection.executemany('INSERT INTO "DiaryEntries" VALUES (?, ?, ?, ?, ?)', rows)
+        connection.execute("COMMIT")
+        last_chunk_seconds = time.perf_counter() - chunk_start
+        total_seconds += last_chunk_seconds
+        inserted += len(rows)
+
+    sizes = dict(connection.execute("SELECT name, SUM(pgsize) FROM dbstat GROUP BY name").fetchall())
+    connection.close()
+    return {"entries_per_second": inserted / total_seconds,
+            "last_chunk_entries_per_second": len(rows) / last_chunk_seconds,
+            "sizes": sizes}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=1000000)
+    parser.add_argument("--chunk-size", type=int, default=10000)
+    parser.add_argument("--cache-kib", type=int, default=2000)
+    parser.add_argument("--json", help="file to write the results to as JSON")
+    args = parser.parse_args()
+
+    results = {"entries": args.entries, "chunk_size": args.chunk_size, "cache_kib": args.cache_kib}
+    with tempfile.TemporaryDirectory() as directory:
+        for kind, (column_type, new_id) in ID_KINDS.items():
+            result = results[kind] = run(os.path.join(directory, f"{kind}.db"), column_type, new_id, args.entries,
+                                         args.chunk_size, args.cache_kib)
+            print(f"{kind}: {result['entries_per_second']:,.0f} entries/s overall, "
+                  f"{result['last_chunk_entries_per_second']:,.0f} entries/s for the last chunk")
+            for name, size in sorted(result["sizes"].items()):
+                print(f"    {name}: {size / 1024 / 1024:.1f} MiB")
+
+    if args.json:
+        with open(args.json, "w") as results_file:
+            json.dump(results, results_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Shows how the indexes added by the add_query_indexes migration change the query plans and latency of the home page
+queries and tag lookups.
+
+A database is seeded with synthetic entries under the schema from before the migration, the hot queries are
+explained and timed, the database is upgraded in place with Migrations.upgrade, and the queries are explained and
+timed again.
+
+Usage:
+    python -m benchmarks.query_plans [--entries 100000] [--users 100] [--json results.json]
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, text
+
+from personal_diary import db
+from personal_diary.app import flask_app
+from personal_diary.diary import Diary
+from personal_diary.migrations import Migrations, MIGRATIONS, add_query_indexes
+from personal_diary.models import Entry, Tag, tags
+
+MIGRATION_INDEXES = ["ix_DiaryEntries_user_id_created", "ix_DiaryEntries_user_id_modified",
+                     "ix_DiaryEntries_user_id_mood_created", "ix_EntryTags_name", "ix_tags_entry_id"]
+
+
+def create_pre_migration_database(entry_count: int, user_count: int, tag_count: int, seed: int) -> None:
+    """
+    Creates the schema as it was before the add_query_indexes migration and fills it with synthetic entries.
+    """
+    db.drop_all()
+    db.create_all()
+    with db.engine.begin() as connection:
+        for index in MIGRATION_INDEXES:
+            connection.execute(text(f"DROP INDEX {index}"))
+        Migrations.stamp(connection, MIGRATIONS.index(add_query_indexes))
+
+        rng = random.Random(seed)
+        start = datetime(2020, 1, 1)
+        connection.execute(Tag.__table__.insert(), [{"id": tag_id, "name": f"tag-{tag_id}"}
+                                                    for tag_id in range(1, tag_count + 1)])
+        entries, entry_tags = [], []
+        for entry_number in range(entry_count):
+            created = start + timedelta(minutes=rng.randrange(60 * 24 * 365 * 2))
+            entries.append({"id": f"entry-{entry_number}", "title": f"Title {entry_number}", "body": "Body " * 20,
+                            "created": created, "modified": created + timedelta(hours=rng.randrange(48)),
+                            "user_id": f"user-{rng.randrange(user_count)}", "mood": "&#128512"})
+            for tag_id in rng.sample(range(1, tag_count + 1), rng.randint(0, 3)):
+                entry_tags.append({"tag_id": tag_id, "entry_id": f"entry-{entry_number}"})
+        connection.execute(Entry.__table__.insert(), entries)
+        connection.execute(tags.insert(), entry_tags)
+        connection.execute(text("ANALYZE"))
+
+
+def hot_queries() -> dict:
+    """
+    Builds the queries run by the home page and by tag lookups, using the same code paths as the app.
+    """
+    user_id = "user-1"
+    return {
+        "page created_desc": Diary.sort_entries(Diary.filter_entries(user_id, "", None), "created_desc").limit(21),
+        "page modified_desc": Diary.sort_entries(Diary.filter_entries(user_id, "", None), "modified_desc").limit(21),
+        "page count": Diary.filter_entries(user_id, "", None).with_entities(func.count(Entry.id)),
+        "page with tag": Diary.sort_entries(Diary.filter_entries(user_id, "", "tag-7"), "created_desc").limit(21),
+        "tag by name": Tag.query.filter_by(name="tag-7"),
+        "tags of entry": db.session.query(tags).filter(tags.c.entry_id == "entry-42")
+    }
+
+
+def measure(repeat: int) -> dict:
+    """
+    Explains and times every hot query.
+    """
+    results = {}
+    for name, query in hot_queries().items():
+        compiled = query.statement.compile(db.engine)
+        parameters = tuple(compiled.params[key] for key in compiled.positiontup)
+        with db.engine.connect() as connection:
+            plan = [row[-1] for row in connection.exec_driver_sql("EXPLAIN QUERY PLAN " + str(compiled), parameters)]
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                connection.exec_driver_sql(str(compiled), parameters).fetchall()
+                timings.append(time.perf_counter() - start)
+        results[name] = {"plan": plan, "median_ms": statistics.median(timings) * 1000}
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=100000)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--tags", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="file to write the results to as JSON")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        flask_app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(directory, "benchmark.db")
+        with flask_app.app_context():
+            create_pre_migration_database(args.entries, args.users, args.tags, args.seed)
+            before = measure(args.repeat)
+            Migrations.upgrade()
+            db.session.execute(text("ANALYZE"))
+            after = measure(args.repeat)
+            db.session.remove()
+            db.engine.dispose()
+
+    print(f"{args.entries} entries across {args.users} users")
+    for name in before:
+        print(f"\n{name}: {before[name]['median_ms']:.3f} ms -> {after[name]['median_ms']:.3f} ms")
+        print("  before: " + " | ".join(before[name]["plan"]))
+        print("  after:  " + " | ".join(after[name]["plan"]))
+
+    if args.json:
+        with open(args.json, "w") as results_file:
+            json.dump({"entries": args.entries, "users": args.users, "before": before, "after": after},
+                      results_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
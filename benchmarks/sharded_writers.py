@@ -0,0 +1,117 @@
+"""
+Compares the write throughput of concurrent writer processes, each writing the entries of a different user, when
+every user shares one SQLite database and when each user has their own shard as set up by personal_diary/shards.py.
+
+Every worker process creates entries with Diary.create_entry for --duration seconds, the way separate gunicorn
+workers serving different users would. Both layouts use the engine profile from personal_diary/engine.py. Writes that
+fail, such as with "database is locked", are counted as errors.
+
+Usage:
+    python -m benchmarks.sharded_writers [--workers 1 2 4 8] [--duration 5] [--json results.json]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+from typing import Optional
+
+
+def write_entries(database_uri: str, shard_directory: Optional[str], worker: int, duration: float, start,
+                  results) -> None:
+    """
+    Creates entries of the worker's user until duration seconds after the start event is set, then reports the
+    number of entries created and the number of failed writes.
+    """
+    from sqlalchemy.exc import OperationalError
+
+    from personal_diary import db
+    from personal_diary.app import flask_app
+    from personal_diary.diary import Diary
+    from personal_diary.engine import EngineProfile
+    from personal_diary.shards import ShardRouter
+
+    flask_app.config['SQLALCHEMY_DATABASE_URI'] = database_uri
+    flask_app.config['SQLALCHEMY_ENGINE_OPTIONS'] = EngineProfile.engine_options(database_uri)
+    flask_app.config['SHARD_DIRECTORY'] = shard_directory
+
+    user_id = f"writer-{worker}"
+    writes = errors = 0
+    with flask_app.app_context(), ShardRouter.routed(user_id):
+        db.create_all()
+        if shard_directory:
+            # creates the user's shard before the timing starts
+            ShardRouter.engine(user_id)
+        start.wait()
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            try:
+                Diary.create_entry({"title": "Load test", "body": "<p>Sharded writer</p>", "user_id": user_id,
+                                    "tags": ["load", user_id], "mood": "&#128512"})
+                writes += 1
+            except OperationalError:
+                db.session.rollback()
+                errors += 1
+        db.session.remove()
+        db.engine.dispose()
+    results.put((writes, errors))
+
+
+def run(layout: str, worker_count: int, duration: float, directory: str) -> dict:
+    """
+    Runs worker_count writer processes against a fresh database, with a fresh shard directory for the sharded
+    layout.
+    """
+    name = f"{layout}-{worker_count}"
+    database_uri = "sqlite:///" + os.path.join(directory, f"{name}.db")
+    shard_directory = os.path.join(directory, name) if layout == "sharded" else None
+    if shard_directory:
+        os.makedirs(shard_directory)
+    context = multiprocessing.get_context("spawn")
+    start = context.Event()
+    results = context.Queue()
+    workers = [context.Process(target=write_entries,
+                               args=(database_uri, shard_directory, worker, duration, start, results))
+               for worker in range(worker_count)]
+
+    # the first worker creates the tables before the others connect
+    workers[0].start()
+    time.sleep(3)
+    for worker in workers[1:]:
+        worker.start()
+    time.sleep(3)
+    start.set()
+
+    counts = [results.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+
+    writes = sum(count[0] for count in counts)
+    return {"writes": writes, "errors": sum(count[1] for count in counts), "writes_per_second": writes / duration}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--duration", type=float, default=5)
+    parser.add_argument("--json", help="file to write the results to as JSON")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for layout in ("single", "sharded"):
+            results[layout] = {}
+            for worker_count in args.workers:
+                result = run(layout, worker_count, args.duration, directory)
+                results[layout][str(worker_count)] = result
+                print(f"{layout:>7} {worker_count:>2} workers: {result['writes_per_second']:8.1f} writes/s, "
+                      f"{result['errors']} errors")
+
+    if args.json:
+        with open(args.json, "w") as results_file:
+            json.dump(results, results_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Measures how long a new app process takes to start, the way a gunicorn worker or a freshly scaled container does.
+
+Every run starts a new Python process, which imports personal_diary.app, creates the app with create_app and serves
+its first requests through the Flask test client against a database created with init-db beforehand. The import
+time, app creation time, time to the first response of the login page, time to the first response of a login attempt
+(which opens the first database connection) and the whole lifetime of the process are reported as the median over
+--repeat runs.
+
+Usage:
+    python -m benchmarks.startup [--repeat 10] [--json results.json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+"""
+The code each process runs. It prints the timings of its startup in milliseconds as JSON.
+"""
+CHILD = """
+import json, sys, time
+start = time.perf_counter()
+from personal_diary.app import create_app
+imported = time.perf_counter()
+app = create_app({"SQLALCHEMY_DATABASE_URI": sys.argv[1], "WTF_CSRF_ENABLED": False})
+created = time.perf_counter()
+client = app.test_client()
+client.get("/login")
+first_response = time.perf_counter()
+# an unknown username is rejected after one query, without the cost of checking a password hash
+client.post("/login", data={"username": "unknown", "password": "unknown"})
+first_query = time.perf_counter()
+print(json.dumps({"import_ms": (imported - start) * 1000,
+                  "create_app_ms": (created - imported) * 1000,
+                  "first_request_ms": (first_response - start) * 1000,
+                  "first_database_request_ms": (first_query - start) * 1000}))
+"""
+
+
+def prepare_database(database_uri: str) -> None:
+    """
+    Creates the schema with the init-db command.
+    """
+    from personal_diary.app import create_app
+
+    create_app({"SQLALCHEMY_DATABASE_URI": database_uri}).test_cli_runner().invoke(args=["init-db"])
+
+
+def run_process(database_uri: str) -> dict:
+    """
+    Starts one process and returns its timings, together with its total lifetime as seen from this process.
+    """
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, "-c", CHILD, database_uri], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout
+    timings = json.loads(output.strip().splitlines()[-1])
+    timings["process_ms"] = (time.perf_counter() - start) * 1000
+    return timings
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--json", help="file to write the results to as JSON")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        database_uri = "sqlite:///" + os.path.join(directory, "startup.db")
+        prepare_database(database_uri)
+        runs = [run_process(database_uri) for _ in range(args.repeat)]
+
+    results = {name: statistics.median(run[name] for run in runs) for name in runs[0]}
+    for name, median in results.items():
+        print(f"{name:<28} median {median:8.1f} ms")
+
+    if args.json:
+        with open(args.json, "w") as results_file:
+            json.dump({"repeat": args.repeat, "median": results, "runs": runs}, results_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""
+Times the hot paths of Diary and DiaryUser against seeded synthetic databases of increasing size.
+
+For every size, a fresh SQLite database is seeded with benchmarks.data.seed_database and each case is run --repeat
+times. The cases cover creating entries and users, searching with one to five keywords, every sort type, tag
+filtering, checking for today's entry, and rendering the home page through the Flask test client. The median, 95th
+percentile and minimum of each case are printed and can be written to JSON, and a previous JSON file can be passed
+to --compare to show the change of every median.
+
+Usage:
+    python -m benchmarks.suite [--sizes 1000 10000 100000] [--repeat 20] [--json results.json]
+                               [--compare baseline.json]
+
+Pass --sizes 1000000 for the largest database. Seeding it takes a few minutes.
+"""
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+from typing import Callable, Optional
+
+from personal_diary import db
+from personal_diary.app import flask_app
+from personal_diary.diary import Diary, LATEST_ENTRY_CACHE, SORT_TYPES, DEFAULT_PAGE_SIZE
+from personal_diary.diary_user import DiaryUser
+from benchmarks.data import WORDS, PASSWORD, seed_database, tag_name, user_id
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+
+"""
+The user every per-user case runs as
+"""
+BENCHMARK_USER = user_id(0)
+
+
+def time_case(run: Callable[[int], object], repeat: int, prepare: Optional[Callable[[], None]] = None) -> dict:
+    """
+    Times repeated calls of a case. The session is reset between calls so no call benefits from objects loaded by
+    the previous one.
+
+    Args:
+        run: the case, called with the number of the iteration
+        repeat: the number of times to call the case
+        prepare: called before every iteration, outside of the timing
+
+    Returns:
+        a dictionary with the median, 95th percentile and minimum duration in milliseconds
+    """
+    timings = []
+    for iteration in range(repeat):
+        if prepare:
+            prepare()
+        start = time.perf_counter()
+        run(iteration)
+        timings.append((time.perf_counter() - start) * 1000)
+        db.session.remove()
+    timings.sort()
+    return {"median_ms": statistics.median(timings),
+            "p95_ms": timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+            "min_ms": timings[0],
+            "repeat": repeat}
+
+
+def page_entries(search_query: str = "", tag: Optional[str] = None, sort_type: str = "created_desc") -> None:
+    Diary.read_entries_page(BENCHMARK_USER, search_query, tag, sort_type, None, DEFAULT_PAGE_SIZE)
+
+
+def run_cases(repeat: int) -> dict:
+    """
+    Runs every case against the app's current database.
+    """
+    results = {}
+
+    for keyword_count in range(1, 6):
+        search_query = " ".join(WORDS[:keyword_count])
+        results[f"search_entries {keyword_count} keywords"] = time_case(
+            lambda _: Diary.search_entries(search_query, BENCHMARK_USER, None), repeat)
+        results[f"search page {keyword_count} keywords"] = time_case(lambda _: page_entries(search_query), repeat)
+
+    for sort_type in SORT_TYPES:
+        results[f"sort_entries {sort_type}"] = time_case(
+            lambda _: Diary.sort_entries(Diary.filter_entries(BENCHMARK_USER, "", None), sort_type)
+            .limit(DEFAULT_PAGE_SIZE).all(), repeat)
+
+    results["tag filter page"] = time_case(lambda iteration: page_entries(tag=tag_name(iteration % 20)), repeat)
+    results["check_entry_for_today"] = time_case(lambda _: Diary.check_entry_for_today(BENCHMARK_USER), repeat,
+                                                 prepare=LATEST_ENTRY_CACHE.clear)
+
+    client = flask_app.test_client()
+    client.post("/login", data={"username": "user0", "password": PASSWORD})
+    results["read_entries page render"] = time_case(lambda _: client.get("/"), repeat)
+    results["read_entries search render"] = time_case(lambda _: client.get("/?search=today+walk"), repeat)
+    results["read_entries tag render"] = time_case(lambda _: client.get("/" + tag_name(7)), repeat)
+
+    # writes run last so they do not change the data the reads see
+    results["create_entry"] = time_case(lambda iteration: Diary.create_entry({
+        "title": "Benchmark entry", "body": "<p>" + " ".join(WORDS) + "</p>", "user_id": BENCHMARK_USER,
+        "tags": [tag_name(iteration % 20), f"new-tag-{iteration}"], "mood": "&#128512"}), repeat)
+    results["create_user"] = time_case(lambda iteration: DiaryUser.create_user({
+        "username": f"new-user-{iteration}", "full_name": "New User", "password": "hash"}), repeat)
+    return results
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline: dict, results: dict) -> None:
+    """
+    Prints the change of every median between a baseline run and the current run.
+    """
+    print("\nchange of median against baseline " + str(baseline["metadata"].get("commit")))
+    for size, cases in results.items():
+        for name, result in cases.items():
+            before = baseline["results"].get(size, {}).get(name)
+            if before:
+                change = (result["median_ms"] / before["median_ms"] - 1) * 100
+                print(f"  {size:>8} {name:<36} {before['median_ms']:9.3f} -> {result['median_ms']:9.3f} ms "
+                      f"({change:+.1f}%)")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--tags", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="file to write the results to as JSON")
+    parser.add_argument("--compare", help="JSON results of a previous run to compare against")
+    args = parser.parse_args()
+
+    flask_app.config['WTF_CSRF_ENABLED'] = False
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.sizes:
+            flask_app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(directory, f"{size}.db")
+            with flask_app.app_context():
+                seed_database(size, args.users, args.tags, args.seed)
+                LATEST_ENTRY_CACHE.clear()
+                results[str(size)] = run_cases(args.repeat)
+                db.session.remove()
+                db.engine.dispose()
+
+            print(f"\n{size} entries across {args.users} users")
+            for name, result in results[str(size)].items():
+                print(f"  {name:<36} median {result['median_ms']:9.3f} ms  p95 {result['p95_ms']:9.3f} ms")
+
+    output = {"metadata": {"commit": git_commit(), "timestamp": datetime.now().isoformat(),
+                           "python": platform.python_version(), "sqlite": sqlite3.sqlite_version,
+                           "users": args.users, "tags": args.tags, "seed": args.seed},
+              "results": results}
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            compare(json.load(baseline_file), results)
+    if args.json:
+        with open(args.json, "w") as results_file:
+            json.dump(output, results_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,3 @@
-from flask_sqlalchemy import SQLAlchemy
+from personal_diary.shards import ShardedSQLAlchemy
 
-db = SQLAlchemy()
+db = ShardedSQLAlchemy()
@@ -0,0 +1,399 @@
+import json
+from datetime import date, timedelta
+from typing import Iterable, Iterator, Optional, Union
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from flask import Blueprint, Response, abort, jsonify, request, stream_with_context
+from flask_login import current_user, login_required
+from werkzeug.exceptions import HTTPException
+
+from personal_diary.diary import Diary, EntrySummary, DEFAULT_PAGE_SIZE, DEFAULT_SORT_TYPE, MAX_PAGE_SIZE
+from personal_diary.diary_user import DiaryUser
+from personal_diary.models import Entry
+from personal_diary.mood_rollups import MoodRollups
+from personal_diary.transfer import DiaryTransfer
+
+"""
+The fields of an entry the API can return, in the order they are returned in
+"""
+ENTRY_FIELDS = ("id", "title", "body", "mood", "created", "modified", "tags")
+
+"""
+The fields returned by listings when no fields are asked for. The body is left out, like on the home page, so a
+listing only reads the bodies when they are asked for.
+"""
+SUMMARY_FIELDS = ("id", "title", "mood", "created", "modified", "tags")
+
+"""
+The fields of an entry that can be changed with an update
+"""
+UPDATABLE_FIELDS = ("title", "body", "mood", "tags")
+
+"""
+The maximum number of entries read, created, updated or deleted by one batch request
+"""
+MAX_BATCH_SIZE = MAX_PAGE_SIZE
+
+"""
+Encodes JSON without the optional whitespace
+"""
+ENCODER = json.JSONEncoder(separators=(",", ":"))
+
+api = Blueprint("api", __name__, url_prefix="/api/v1")
+
+
+class DiaryApi:
+    """
+    A class containing helper functions for the JSON API, which parse requests and serialize entries.
+    """
+
+    @staticmethod
+    def read_fields(default: tuple) -> tuple:
+        """
+        Reads the fields of each entry to return from the comma separated fields query parameter. The id is
+        always returned.
+
+        Args:
+            default: the fields to return when the parameter is not given
+
+        Returns:
+            a tuple of the field names in the order of ENTRY_FIELDS
+        """
+        fields = request.args.get("fields")
+        if not fields:
+            return default
+        requested = {field.strip() for field in fields.split(",") if field.strip()}
+        unknown = requested.difference(ENTRY_FIELDS)
+        if unknown:
+            abort(400, f"Unknown fields: {', '.join(sorted(unknown))}")
+        return tuple(field for field in ENTRY_FIELDS if field in requested or field == "id")
+
+    @staticmethod
+    def read_json_list(key: str) -> list:
+        """
+        Reads a list from the JSON object in the request body. Requiring a JSON body also keeps other sites from
+        submitting requests with the user's cookies, since browsers only send it cross-site after a CORS preflight.
+
+        Args:
+            key: the key of the list in the object
+
+        Returns:
+            the list, which holds between 1 and MAX_BATCH_SIZE items
+        """
+        body = request.get_json()
+        items = body.get(key) if isinstance(body, dict) else None
+        if not isinstance(items, list) or not 1 <= len(items) <= MAX_BATCH_SIZE:
+            abort(400, f"The request body must be an object with a list of 1 to {MAX_BATCH_SIZE} {key}")
+        return items
+
+    @staticmethod
+    def serialize_entry(entry: Union[Entry, EntrySummary], fields: tuple, body: Optional[str] = None) -> dict:
+        """
+        Turns an entry into a dictionary that can be encoded as JSON.
+
+        Args:
+            entry: an Entry, or an EntrySummary from a listing
+            fields: the fields to include
+            body: the body text of an EntrySummary, which does not hold it
+
+        Returns:
+            a dictionary with the requested fields, where datetimes are ISO 8601 strings and tags are a list of
+            tag names
+        """
+        values = {}
+        for field in fields:
+            if field == "tags":
+                values[field] = list(entry.tags) if isinstance(entry, EntrySummary) \
+                    else [tag.name for tag in entry.tags]
+            elif field == "body":
+                values[field] = body if isinstance(entry, EntrySummary) else entry.body
+            elif field in ("created", "modified"):
+                value = getattr(entry, field)
+                values[field] = value.isoformat() if value else None
+            else:
+                values[field] = getattr(entry, field)
+        return values
+
+    @staticmethod
+    def read_date(name: str, default: date) -> date:
+        """
+        Reads an ISO 8601 date from a query parameter, aborting with 400 Bad Request if it is not one.
+
+        Args:
+            name: the name of the query parameter
+            default: the date to return when the parameter is not given
+
+        Returns:
+            the date
+        """
+        value = request.args.get(name)
+        if not value:
+            return default
+        try:
+            return date.fromisoformat(value)
+        except ValueError:
+            abort(400, f"{name} must be an ISO 8601 date")
+
+    @staticmethod
+    def stream_json(items_key: str, items: Iterable[dict], **fields) -> Response:
+        """
+        Streams a JSON object holding a list of items, encoding one item at a time instead of building the whole
+        document in memory first.
+
+        Args:
+            items_key: the key of the list of items
+            items: the items, which are encoded as they are read
+            fields: any other keys of the object and their values
+
+        Returns:
+            the streamed response
+        """
+        def generate() -> Iterator[str]:
+            yield ENCODER.encode(fields)[:-1] + ("," if fields else "") + ENCODER.encode(items_key) + ":["
+            for number, item in enumerate(items):
+                yield ("," if number else "") + ENCODER.encode(item)
+            yield "]}"
+
+        return Response(stream_with_context(generate()), mimetype="application/json")
+
+
+@api.errorhandler(HTTPException)
+def handle_http_exception(error: HTTPException) -> tuple:
+    """
+    Responds to errors in the API, including 401 Unauthorized and 404 Not Found, with JSON instead of HTML.
+    """
+    return jsonify(error=error.description), error.code
+
+
+@api.route("/entries", methods=["GET"])
+@login_required
+def list_entries() -> Response:
+    """
+    Lists one page of the current user's entries. Takes the same search, fuzzy, tag, sort_type, cursor and page_size
+    query parameters as the home page, and a comma separated list of fields.
+
+    Returns:
+        response: a JSON object with the entries under "entries", the number of matching entries under "count", and
+        the cursors of the next and previous pages under "next_cursor" and "prev_cursor"
+    """
+    fields = DiaryApi.read_fields(SUMMARY_FIELDS)
+    page = Diary.read_entries_page(current_user.id,
+                                   request.args.get("search", ""),
+                                   request.args.get("tag") or None,
+                                   request.args.get("sort_type", DEFAULT_SORT_TYPE),
+                                   request.args.get("cursor"),
+                                   request.args.get("page_size", DEFAULT_PAGE_SIZE, type=int),
+                                   fuzzy=request.args.get("fuzzy", type=int) == 1)
+    entries = page["entries"]
+    bodies = Diary.read_entry_bodies(list(entries)) if "body" in fields else {}
+    return DiaryApi.stream_json("entries",
+                                (DiaryApi.serialize_entry(entry, fields, bodies.get(entry_id))
+                                 for entry_id, entry in entries.items()),
+                                count=page["count"], next_cursor=page["next_cursor"], prev_cursor=page["prev_cursor"])
+
+
+@api.route("/entries/export", methods=["GET"])
+@login_required
+def export_entries() -> Response:
+    """
+    Streams all of the current user's entries, in the order they were created, as JSON Lines in the format read by
+    the import-entries command.
+
+    Returns:
+        response: the streamed JSON Lines
+    """
+    entries = DiaryTransfer.read_entries(current_user.id)
+    return Response(stream_with_context(DiaryTransfer.write_jsonl(entries)), mimetype="application/x-ndjson")
+
+
+@api.route("/entries/batch", methods=["GET"])
+@login_required
+def read_entries_batch() -> Response:
+    """
+    Reads several of the current user's entries by id, with the ids given as a comma separated ids query parameter.
+    Responds with 404 Not Found if any of the entries does not exist or belongs to another user.
+
+    Returns:
+        response: a JSON object with the entries under "entries", in the order of the ids
+    """
+    entry_ids = [entry_id for entry_id in request.args.get("ids", "").split(",") if entry_id]
+    if not 1 <= len(entry_ids) <= MAX_BATCH_SIZE:
+        abort(400, f"Between 1 and {MAX_BATCH_SIZE} ids must be given")
+    fields = DiaryApi.read_fields(ENTRY_FIELDS)
+    entries = Diary.read_owned_entries(entry_ids, current_user.id)
+    return DiaryApi.stream_json("entries", (DiaryApi.serialize_entry(entry, fields) for entry in entries))
+
+
+@api.route("/entries/<entry_id>", methods=["GET"])
+@login_required
+def read_entry(entry_id: str) -> Response:
+    """
+    Reads one of the current user's entries.
+
+    Args:
+        entry_id: the id of the entry
+
+    Returns:
+        response: the entry as a JSON object
+    """
+    entry = Diary.read_owned_entry(entry_id, current_user.id)
+    return jsonify(DiaryApi.serialize_entry(entry, DiaryApi.read_fields(ENTRY_FIELDS)))
+
+
+@api.route("/entries", methods=["POST"])
+@login_required
+def create_entries() -> tuple:
+    """
+    Creates a batch of entries for the current user in a single transaction. The request body is an object with a
+    list of entries under "entries", each with a title, body, and optional mood, list of tags, and ISO 8601 created
+    and modified datetimes. If any entry is invalid, none are created.
+
+    Returns:
+        response: a JSON object with the ids of the new entries under "ids", in the order they were given
+    """
+    entries, errors = [], []
+    for index, row in enumerate(DiaryApi.read_json_list("entries")):
+        try:
+            entries.append(DiaryTransfer.validate_row(row))
+        except ValueError as error:
+            errors.append({"index": index, "error": str(error)})
+    if errors:
+        return jsonify(error="Invalid entries", errors=errors), 400
+
+    return jsonify(ids=DiaryTransfer.insert_entries(current_user.id, entries)), 201
+
+
+@api.route("/entries", methods=["PATCH"])
+@login_required
+def update_entries() -> Response:
+    """
+    Updates a batch of the current user's entries in a single transaction. The request body is an object with a
+    list of entries under "entries", each with the id of the entry and any of its title, body, mood and list of
+    tags to change. If any entry is invalid, does not exist or belongs to another user, none are updated.
+
+    Returns:
+        response: a JSON object with the updated entries under "entries"
+    """
+    rows = DiaryApi.read_json_list("entries")
+    if not all(isinstance(row, dict) and isinstance(row.get("id"), str) for row in rows):
+        abort(400, "Every entry must have an id")
+    entries = {entry.id: entry for entry in Diary.read_owned_entries([row["id"] for row in rows], current_user.id)}
+
+    update_requests, errors = [], []
+    for index, row in enumerate(rows):
+        entry = entries[row["id"]]
+        changed_entry = {"title": entry.title, "body": entry.body, "mood": entry.mood,
+                         "tags": [tag.name for tag in entry.tags]}
+        changed_entry.update((field, row[field]) for field in UPDATABLE_FIELDS if field in row)
+        try:
+            valid_entry = DiaryTransfer.validate_row(changed_entry)
+        except ValueError as error:
+            errors.append({"index": index, "error": str(error)})
+            continue
+        update_requests.append({"entry_id": entry.id, "title": valid_entry["title"], "body": valid_entry["body"],
+                                "mood": valid_entry["mood"], "tags": valid_entry["tags"],
+                                "user_id": current_user.id})
+    if errors:
+        return jsonify(error="Invalid entries", errors=errors), 400
+
+    updated_entries = Diary.update_entries(update_requests)
+    return DiaryApi.stream_json("entries", [DiaryApi.serialize_entry(entry, ENTRY_FIELDS)
+                                            for entry in updated_entries.values()])
+
+
+@api.route("/entries", methods=["DELETE"])
+@login_required
+def delete_entries() -> Response:
+    """
+    Deletes a batch of the current user's entries in a single transaction. The request body is an object with a
+    list of entry ids under "ids". If any entry does not exist or belongs to another user, none are deleted.
+
+    Returns:
+        response: a JSON object with the ids of the deleted entries under "ids"
+    """
+    entry_ids = DiaryApi.read_json_list("ids")
+    if not all(isinstance(entry_id, str) for entry_id in entry_ids):
+        abort(400, "Ids must be strings")
+    entries = Diary.read_owned_entries(entry_ids, current_user.id)
+    return jsonify(ids=Diary.delete_entries(entries))
+
+
+@api.route("/tags", methods=["GET"])
+@login_required
+def list_tags() -> Response:
+    """
+    Lists the tags the current user has attached to their entries, read from the maintained tag usage counts
+    instead of the entries. Takes an optional limit query parameter.
+
+    Returns:
+        response: a JSON object with a list of tags under "tags", each with its name, number of entries and the
+        ISO 8601 created datetime of the latest entry it was attached to, with the most used tags first
+    """
+    limit = request.args.get("limit", type=int)
+    return DiaryApi.stream_json("tags", ({"name": tag.name, "count": tag.entry_count,
+                                          "last_used": tag.last_used.isoformat() if tag.last_used else None}
+                                         for tag in Diary.read_tag_usage(current_user.id, limit)))
+
+
+@api.route("/moods", methods=["GET"])
+@login_required
+def read_mood_series() -> Response:
+    """
+    Returns how often the current user chose each mood over time, read from the mood rollups instead of the entries.
+    Takes the optional start and end ISO 8601 dates of the range, which default to the year up to today, and an
+    optional bucket of day, week, month, quarter or year, which defaults to the finest bucket that keeps the series
+    within MAX_SERIES_POINTS points.
+
+    Returns:
+        response: a JSON object with the bucket, the first day of every bucket under "periods", and the counts per
+        bucket of every mood chosen in the range under "moods"
+    """
+    end = DiaryApi.read_date("end", date.today())
+    start = DiaryApi.read_date("start", end - timedelta(days=364))
+    try:
+        series = MoodRollups.read_series(current_user.id, start, end, request.args.get("bucket"))
+    except ValueError as error:
+        abort(400, str(error))
+    return jsonify(bucket=series["bucket"], periods=[period.isoformat() for period in series["periods"]],
+                   moods=series["moods"])
+
+
+@api.route("/user", methods=["GET"])
+@login_required
+def read_user() -> Response:
+    """
+    Returns:
+        response: the current user's id, username, full name and timezone as a JSON object
+    """
+    return jsonify(id=current_user.id, username=current_user.username, full_name=current_user.name,
+                   timezone=current_user.timezone)
+
+
+@api.route("/user", methods=["PATCH"])
+@login_required
+def update_user() -> Response:
+    """
+    Updates the current user's full name or timezone, with the same limits as the settings page. The request body
+    is an object with either or both of "full_name" and "timezone", where an empty timezone means the user's days
+    follow the server's timezone.
+
+    Returns:
+        response: the updated user as a JSON object
+    """
+    body = request.get_json()
+    if not isinstance(body, dict):
+        abort(400, "The request body must be an object")
+    full_name = body.get("full_name", current_user.name)
+    timezone = body.get("timezone", current_user.timezone) or ""
+    if not isinstance(full_name, str) or not 1 <= len(full_name.strip()) <= 30:
+        abort(400, "Full name must be between 1 and 30 characters long")
+    if not isinstance(timezone, str) or len(timezone) > 64:
+        abort(400, "Unknown timezone")
+    if timezone.strip():
+        try:
+            ZoneInfo(timezone.strip())
+        except (ZoneInfoNotFoundError, ValueError):
+            abort(400, "Unknown timezone")
+
+    DiaryUser.update_user({"user_id": current_user.id, "full_name": full_name, "timezone": timezone})
+    return read_user()
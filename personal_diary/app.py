@@ -1,58 +1,125 @@
+import hashlib
 import os
-from typing import Union
+import time
+from datetime import datetime
+from typing import Callable, Optional, Union
 
-from flask import Flask, Markup, render_template, url_for, redirect, flash, abort, request
+import click
+from flask import Blueprint, Flask, Markup, current_app, render_template, url_for, redirect, flash, abort, \
+    request, session, make_response
+from flask_ckeditor import CKEditor
 from flask_login import LoginManager, login_user, current_user, login_required, logout_user
 from werkzeug import Response
 
-from personal_diary.diary import Diary
+from personal_diary.api import api
+from personal_diary.assets import StaticAssets
+from personal_diary.diary import Diary, EntrySummary, DEFAULT_PAGE_SIZE, TAG_SIDEBAR_SIZE
 from personal_diary import db
-from personal_diary.forms import CreateEntryForm, UpdateEntryForm, SignupForm, SearchEntryForm, LoginForm
-from personal_diary.models import User, Entry
-from personal_diary.diary_user import DiaryUser
+from personal_diary.engine import EngineProfile
+from personal_diary.fragment_cache import ENTRY_CARD_CACHE
+from personal_diary.fuzzy_index import FuzzyIndex, REBUILD_CHUNK_SIZE as FUZZY_REBUILD_CHUNK_SIZE
+from personal_diary.forms import CreateEntryForm, UpdateEntryForm, SignupForm, SearchEntryForm, LoginForm, \
+    SettingsForm
+from personal_diary.models import MOODS, User
+from personal_diary.diary_user import DiaryUser, PURGE_CHUNK_SIZE
+from personal_diary.migrations import Migrations, UnsupportedDatabaseError
+from personal_diary.mood_rollups import MoodRollups, REBUILD_CHUNK_SIZE
+from personal_diary.replicas import ReplicaRouter, STICKY_SECONDS
+from personal_diary.search_index import SearchIndex
+from personal_diary.shards import ShardRouter
+from personal_diary.transfer import DiaryTransfer, DEFAULT_CHUNK_SIZE
 from werkzeug.security import generate_password_hash, check_password_hash
-from flask_ckeditor import CKEditor
-
-# set up app config
-flask_app = Flask(__name__)
-CKEditor(flask_app)
 
 basedir = os.path.abspath(os.path.dirname(__file__))
 
-flask_app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(basedir, "database.db")
-flask_app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-flask_app.config['SECRET_KEY'] = 'super secret key'
+"""
+The pages of the diary and its maintenance commands, which are registered at the top level of the flask command
+"""
+views = Blueprint("diary", __name__, cli_group=None)
 
 login_manager = LoginManager()
-login_manager.login_view = 'login'
-login_manager.init_app(flask_app)
+login_manager.login_view = 'diary.login'
+# the JSON API responds to unauthenticated requests with 401 Unauthorized instead of redirecting to the login page
+login_manager.blueprint_login_views = {api.name: None}
 
 
-@login_manager.user_loader
-def load_user(user_id: str) -> str:
+def create_app(config: Optional[dict] = None) -> Flask:
     """
-    Determines what the currently logged-in user is.
+    Creates and configures an instance of the Flask app. Creating the app does not connect to the database, so the
+    schema is created with the init-db command instead.
+
+    Args:
+        config: configuration values that override the defaults, such as SQLALCHEMY_DATABASE_URI or TESTING
 
     Returns:
-        user_id: the id of the currently logged-in user
+        the configured app
+    """
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = EngineProfile.database_uri(
+        'sqlite:///' + os.path.join(basedir, "database.db"))
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SECRET_KEY'] = 'super secret key'
+    # set DIARY_INSTRUMENTATION=1 to record per-route SQL, template and latency timings, served from /metrics
+    app.config['INSTRUMENTATION_ENABLED'] = os.environ.get('DIARY_INSTRUMENTATION') == '1'
+    # set DIARY_USER_IDENTITY_IN_SESSION=1 to keep the logged-in user's name and timezone in the signed session cookie
+    app.config['USER_IDENTITY_IN_SESSION'] = os.environ.get('DIARY_USER_IDENTITY_IN_SESSION') == '1'
+    # set DIARY_SHARD_DIRECTORY to store each user's entries in their own SQLite file within that directory
+    app.config['SHARD_DIRECTORY'] = os.environ.get('DIARY_SHARD_DIRECTORY') or None
+    # set DIARY_REPLICA_DATABASE_URI to send the queries of read-only methods to a read replica of the database
+    app.config['REPLICA_DATABASE_URI'] = os.environ.get('DIARY_REPLICA_DATABASE_URI') or None
+    app.config['REPLICA_STICKY_SECONDS'] = float(os.environ.get('DIARY_REPLICA_STICKY_SECONDS', STICKY_SECONDS))
+    app.config.update(config or {})
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS',
+                          EngineProfile.engine_options(app.config['SQLALCHEMY_DATABASE_URI']))
+
+    CKEditor(app)
+    db.init_app(app)
+    login_manager.init_app(app)
+    app.register_blueprint(views)
+    app.register_blueprint(api)
+    StaticAssets.init_app(app)
+
+    if app.config['INSTRUMENTATION_ENABLED']:
+        # only imported when enabled, since it hooks into every SQL statement and template of the process
+        from personal_diary.instrumentation import Instrumentation
+        Instrumentation.init_app(app)
+
+    return app
+
+
+def __getattr__(name: str) -> Flask:
     """
-    return User.query.get(user_id)
+    Creates the shared flask_app the first time it is imported, for the modules, scripts and servers that use a
+    single app instead of calling create_app, such as gunicorn personal_diary.app:flask_app.
+    """
+    if name == "flask_app":
+        globals()["flask_app"] = create_app()
+        return globals()["flask_app"]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
-# create db tables
-db.init_app(flask_app)
-with flask_app.app_context():
-    db.create_all()
+@login_manager.user_loader
+def load_user(user_id: str) -> Optional[User]:
+    """
+    Determines what the currently logged-in user is. The user's identity is cached, so most requests do not query
+    the Users table.
 
+    Returns:
+        user: the currently logged-in user, or None if the user no longer exists
+    """
+    return DiaryUser.load_user(user_id, use_session=current_app.config['USER_IDENTITY_IN_SESSION'])
 
-@flask_app.route("/", methods=['GET'], defaults={'tag_name': None})
-@flask_app.route("/<tag_name>", methods=['GET', 'POST'])
+
+@views.route("/", methods=['GET'], defaults={'tag_name': None})
+@views.route("/<tag_name>", methods=['GET', 'POST'])
 @login_required
 def read_entries(tag_name: str) -> str:
     """
     Renders the home page, which shows a list of the current entries or entries matching the user's search query.
-    These entries can be sorted based on date.
-    If a tag is specified, the entries will be further filtered by the tag name.
+    These entries can be sorted based on date, and are shown one page at a time.
+    If a tag is specified, the entries will be further filtered by the tag name, and if the mood query parameter
+    holds the code of a mood, by that mood. With the fuzzy query parameter set to 1, the search also finds entries
+    whose title or tags hold misspelled versions of its keywords.
     The page also displays a reminder if no entry has been made for the current day.
 
     Args:
@@ -63,20 +130,69 @@ def read_entries(tag_name: str) -> str:
     """
     sort_type = request.args.get('sort_type', default="created_desc")
     search_query = request.args.get('search', default="")
-
-    if not Diary.check_entry_for_today(user_id=current_user.id):
+    cursor = request.args.get('cursor')
+    page_size = request.args.get('page_size', default=DEFAULT_PAGE_SIZE, type=int)
+    mood = request.args.get('mood', type=int)
+    mood = mood if mood in MOODS else None
+    fuzzy = 1 if request.args.get('fuzzy', type=int) == 1 else None
+
+    latest_modified, entry_count = Diary.read_entries_version(current_user.id)
+    today = Diary.day_bounds(current_user.timezone)[0].date()
+    # deleting an older entry, a new day or a new name change the page without changing the latest modified
+    # datetime, so the page is only validated by its ETag
+    return validated_response((request.full_path, current_user.id, current_user.name, today, latest_modified,
+                               entry_count), None,
+                              lambda: render_entries_page(tag_name, sort_type, search_query, cursor, page_size, mood,
+                                                                  fuzzy))
+
+
+def render_entries_page(tag_name: str, sort_type: str, search_query: str, cursor: Optional[str],
+                        page_size: int, mood: Optional[int], fuzzy: Optional[int]) -> str:
+    """
+    Renders the home page for read_entries once it is known that the browser's copy is out of date.
+    """
+    if not Diary.check_entry_for_today(user_id=current_user.id, timezone=current_user.timezone):
         flash(Markup('You have no entry for today. <a href="/create" class="alert-link"> Create</a>'
                      ' a new entry to reflect on your day!'), 'alert-warning')
 
+    page = Diary.read_entries_page(current_user.id, search_query, tag_name, sort_type, cursor, page_size,
+                                   MOODS.get(mood), fuzzy=bool(fuzzy))
+    entry_cards = {entry_id: render_entry_card(entry) for entry_id, entry in page["entries"].items()}
+
     return render_template("index.html",
-                           entries=Diary.search_entries(search_query, current_user.id, tag_name, sort_type),
+                           entries=page["entries"],
+                           entry_cards=entry_cards,
+                           entry_count=page["count"],
+                           next_cursor=page["next_cursor"],
+                           prev_cursor=page["prev_cursor"],
+                           page_size=page_size,
                            form=SearchEntryForm(),
                            search_query=search_query,
                            sort_type=sort_type,
-                           tag_name=tag_name)
+                           tag_name=tag_name,
+                           mood=mood,
+                           moods=MOODS,
+                           fuzzy=fuzzy,
+                           tag_usage=Diary.read_tag_usage(current_user.id, TAG_SIDEBAR_SIZE))
+
+
+def render_entry_card(entry: EntrySummary) -> Markup:
+    """
+    Renders the card for an entry on the home page, reusing the cached card while the entry's modified date and tags
+    are unchanged.
+
+    Args:
+        entry: the summary of the entry to render
+
+    Returns:
+        the HTML of the card
+    """
+    version = [entry.modified.isoformat() if entry.modified else None, sorted(entry.tags)]
+    return Markup(ENTRY_CARD_CACHE.get_or_render(entry.id, version,
+                                                 lambda: render_template("entry_card.html", entry=entry)))
 
 
-@flask_app.route("/entry/<entry_id>", methods=['GET'])
+@views.route("/entry/<entry_id>", methods=['GET'])
 @login_required
 def read_single_entry(entry_id: str) -> str:
     """
@@ -89,19 +205,55 @@ def read_single_entry(entry_id: str) -> str:
     Returns:
         response: the HTML to display the page with the entry's contents
     """
+    version = Diary.read_entry_version(entry_id)
+    if version is None or version.user_id != current_user.id:
+        abort(404)
+
     read_request = {
         "entry_id": entry_id,
         "user_id": current_user.id
     }
-    entry = Diary.read_single_entry(read_request)["entry"]
+    return validated_response((entry_id, current_user.name, version.modified), version.modified,
+                              lambda: render_template("read_single_entry.html",
+                                                      entry=Diary.read_single_entry(read_request)["entry"]))
 
-    if entry.user_id != current_user.id:
-        abort(404)
 
-    return render_template("read_single_entry.html", entry=entry)
+def validated_response(etag_parts: tuple, last_modified: Optional[datetime], render: Callable[[], str]) -> Response:
+    """
+    Answers a request for a page with 304 Not Modified, without rendering the page, when the browser's cached copy
+    is still current according to its If-None-Match or If-Modified-Since header. Otherwise, the page is rendered
+    and sent with its validators. Pages are marked private, so shared caches never store them, and no-cache, so the
+    browser checks with the server before reusing its copy. Pages with pending flash messages are always rendered.
+
+    Args:
+        etag_parts: every value the content of the page depends on, besides the build of the static assets
+        last_modified: the naive, server local datetime the content last changed, or None if it is unknown
+        render: called to render the page if the browser's copy is out of date
+
+    Returns:
+        response: the 304 Not Modified response or the rendered page
+    """
+    # the page links to the fingerprinted assets of the running build, which a new build deletes
+    etag = hashlib.sha1(repr((StaticAssets.version(), etag_parts)).encode()).hexdigest()
+
+    def add_validators(response: Response) -> Response:
+        response.set_etag(etag, weak=True)
+        if last_modified:
+            response.last_modified = last_modified.astimezone().replace(microsecond=0)
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response
+
+    if not session.get("_flashes"):
+        response = add_validators(Response())
+        response.make_conditional(request)
+        if response.status_code == 304:
+            return response
+
+    return add_validators(make_response(render()))
 
 
-@flask_app.route("/create", methods=['GET', 'POST'])
+@views.route("/create", methods=['GET', 'POST'])
 @login_required
 def create_entry() -> Union[Response, str]:
     """
@@ -127,12 +279,12 @@ def create_entry() -> Union[Response, str]:
 
         Diary.create_entry(create_request)
         flash("Entry created!", "alert-success")
-        return redirect(url_for("read_entries"))
+        return redirect(url_for("diary.read_entries"))
 
     return render_template("create_entry.html", form=create_form)
 
 
-@flask_app.route("/edit/<entry_id>", methods=["GET", "POST"])
+@views.route("/edit/<entry_id>", methods=["GET", "POST"])
 @login_required
 def update_entry(entry_id: str) -> Union[Response, str]:
     """
@@ -146,9 +298,7 @@ def update_entry(entry_id: str) -> Union[Response, str]:
         response: the HTML for the page with the fields or the redirect to the read_single_entry page upon
         submission of the form
     """
-    entry = Entry.query.get_or_404(entry_id)
-    if entry.user_id != current_user.id:
-        abort(404)
+    entry = Diary.read_owned_entry(entry_id, current_user.id)
 
     update_form = UpdateEntryForm()
     if update_form.validate_on_submit():
@@ -165,7 +315,7 @@ def update_entry(entry_id: str) -> Union[Response, str]:
 
         Diary.update_entry(update_request)
         flash("Entry updated!", "alert-success")
-        return redirect(url_for("read_single_entry", entry_id=entry.id))
+        return redirect(url_for("diary.read_single_entry", entry_id=entry.id))
 
     update_form.title.data = entry.title
     update_form.body.data = entry.body
@@ -177,7 +327,7 @@ def update_entry(entry_id: str) -> Union[Response, str]:
     return render_template("update_entry.html", form=update_form, entry=entry)
 
 
-@flask_app.route("/delete/<entry_id>", methods=['GET'])
+@views.route("/delete/<entry_id>", methods=['GET'])
 @login_required
 def delete_entry(entry_id: str) -> Response:
     """
@@ -190,16 +340,13 @@ def delete_entry(entry_id: str) -> Response:
     Returns:
         response: the redirect back to the home page
     """
-    entry = Entry.query.get_or_404(entry_id)
-    if entry.user_id != current_user.id:
-        abort(404)
-
-    Diary.delete_entry({"entry_id": entry_id})
+    # the entry read to check its owner is deleted as is, without reading it again
+    Diary.delete_entries([Diary.read_owned_entry(entry_id, current_user.id)])
     flash("Entry deleted!", "alert-success")
-    return redirect(url_for("read_entries"))
+    return redirect(url_for("diary.read_entries"))
 
 
-@flask_app.route("/signup", methods=["GET", "POST"])
+@views.route("/signup", methods=["GET", "POST"])
 def signup() -> Union[Response, str]:
     """
     Renders signup form allowing user to enter their username, full name, and password.
@@ -220,16 +367,16 @@ def signup() -> Union[Response, str]:
         # verify username does not already exist
         if User.query.filter_by(username=create_request["username"]).first():
             flash("Username already exists", 'alert-danger')
-            return redirect(url_for('signup'))
+            return redirect(url_for('diary.signup'))
 
         DiaryUser.create_user(create_request)
         flash("Signup success!", "alert-success")
-        return redirect(url_for("login"))
+        return redirect(url_for("diary.login"))
 
     return render_template("signup.html", form=signup_form)
 
 
-@flask_app.route("/login", methods=["GET", "POST"])
+@views.route("/login", methods=["GET", "POST"])
 def login() -> Union[Response, str]:
     """
     Renders login form allowing user to access their account and diary.
@@ -247,24 +394,24 @@ def login() -> Union[Response, str]:
             "password": login_form.password.data
         }
 
-        user = User.query.filter_by(username=get_request["username"]).first()
+        user = User.query.filter_by(username=get_request["username"], deleted_at=None).first()
 
         # verify username exists and password is correct
         if not user or not check_password_hash(user.password, get_request["password"]):
             flash(Markup('Your credentials could not be verified, please try again. Or, if you do not currently '
                          'have an account, please <a href="/signup" class="alert-link">sign up for an '
                          'account.</a>'), "alert-danger")
-            return redirect(url_for('login'))
+            return redirect(url_for('diary.login'))
 
         # if success display success message and redirect to home page
         flash("Login success!", "alert-success")
         login_user(user)
-        return redirect(url_for("read_entries"))
+        return redirect(url_for("diary.read_entries"))
 
     return render_template("login.html", form=login_form)
 
 
-@flask_app.route('/logout')
+@views.route('/logout')
 @login_required
 def logout() -> Response:
     """
@@ -273,23 +420,236 @@ def logout() -> Response:
     Returns:
         response: the redirect back to the login page
     """
+    DiaryUser.forget_identity(current_user.id)
     logout_user()
-    return redirect(url_for('login'))
+    return redirect(url_for('diary.login'))
 
 
-@flask_app.route("/delete-user", methods=['GET'])
+@views.route("/settings", methods=["GET", "POST"])
+@login_required
+def settings() -> Union[Response, str]:
+    """
+    Renders the settings form allowing the user to update their full name and the timezone their days follow.
+    After saving, it redirects back to the home page.
+
+    Returns:
+        response: the HTML for the settings page or the redirect to the home page
+    """
+    settings_form = SettingsForm()
+    if settings_form.validate_on_submit():
+        update_request = {
+            "user_id": current_user.id,
+            "full_name": settings_form.full_name.data,
+            "timezone": settings_form.timezone.data or ""
+        }
+        DiaryUser.update_user(update_request)
+        flash("Settings saved!", "alert-success")
+        return redirect(url_for("diary.read_entries"))
+
+    if request.method == "GET":
+        settings_form.full_name.data = current_user.name
+        settings_form.timezone.data = current_user.timezone or ""
+
+    return render_template("settings.html", form=settings_form)
+
+
+@views.route("/delete-user", methods=['GET'])
 @login_required
 def delete_user() -> Response:
     """
-    Deletes the user with the given user_id. It redirects back to the login screen after completion.
+    Deletes the current user and logs them out. Their entries are removed in the background. It redirects back to
+    the login screen after completion.
 
     Returns:
         response: the redirect back to the login page
     """
     DiaryUser.delete_user({"user": current_user})
+    logout_user()
     flash("User account deleted!", "alert-success")
-    return redirect(url_for("login"))
+    return redirect(url_for("diary.login"))
+
+
+@views.cli.command("init-db")
+def init_db() -> None:
+    """
+    Creates any missing tables and indexes of the database. New databases are created with the latest schema.
+    When sharding is enabled, the shard directory is created too, and each user's shard is created when it is
+    first used.
+    """
+    db.create_all()
+    if ShardRouter.is_enabled():
+        os.makedirs(current_app.config['SHARD_DIRECTORY'], exist_ok=True)
+    click.echo("Database is ready.")
+
+
+@views.cli.command("build-assets")
+def build_assets() -> None:
+    """
+    Fingerprints and precompresses the static files. Restart the app after building to serve the new files.
+    """
+    manifest = StaticAssets.build(current_app.static_folder)
+    click.echo(f"Built {len(manifest)} static files.")
+
+
+@views.cli.command("upgrade-db")
+def upgrade_db() -> None:
+    """
+    Upgrades an existing database in place to the latest schema, together with every shard when sharding is
+    enabled.
+    """
+    try:
+        applied = Migrations.upgrade()
+    except UnsupportedDatabaseError as error:
+        raise click.ClickException(str(error))
+    if ShardRouter.is_enabled():
+        for user_id in ShardRouter.shard_user_ids():
+            with ShardRouter.engine(user_id).begin() as connection:
+                Migrations.upgrade(connection)
+    if applied:
+        click.echo("Applied migrations: " + ", ".join(applied))
+    else:
+        click.echo("Database is already up to date.")
+
+
+@views.cli.command("rebuild-search-index")
+def rebuild_search_index() -> None:
+    """
+    Creates the full-text search index if it is missing and re-indexes every existing entry.
+    """
+    if all(ShardRouter.for_each_shard(SearchIndex.rebuild)):
+        click.echo("Search index rebuilt.")
+    else:
+        click.echo("Full-text search is not supported by this database, searches will use LIKE matching.")
+
+
+@views.cli.command("repair-tag-usage")
+def repair_tag_usage() -> None:
+    """
+    Rebuilds every user's tag usage counts from their entries.
+    """
+    click.echo(f"Rebuilt {sum(ShardRouter.for_each_shard(Diary.rebuild_tag_usage))} tag usage rows.")
+
+
+@views.cli.command("rebuild-mood-rollups")
+@click.option("--chunk-size", default=REBUILD_CHUNK_SIZE, show_default=True, type=click.IntRange(min=1),
+              help="The number of entries read at a time.")
+def rebuild_mood_rollups(chunk_size: int) -> None:
+    """
+    Recounts every user's moods per day, week and month from their entries.
+    """
+    counted = sum(ShardRouter.for_each_shard(MoodRollups.rebuild, None, chunk_size))
+    click.echo(f"Counted the moods of {counted} entries.")
+
+
+@views.cli.command("rebuild-fuzzy-index")
+@click.option("--chunk-size", default=FUZZY_REBUILD_CHUNK_SIZE, show_default=True, type=click.IntRange(min=1),
+              help="The number of entries read at a time.")
+def rebuild_fuzzy_index(chunk_size: int) -> None:
+    """
+    Re-indexes the words of every entry's title and tags used by fuzzy searches.
+    """
+    indexed = sum(ShardRouter.for_each_shard(FuzzyIndex.rebuild, None, chunk_size))
+    click.echo(f"Indexed the words of {indexed} entries.")
+
+
+@views.cli.command("purge-deleted-users")
+@click.option("--chunk-size", default=PURGE_CHUNK_SIZE, show_default=True, type=click.IntRange(min=1),
+              help="The number of entries removed per transaction.")
+def purge_deleted_users(chunk_size: int) -> None:
+    """
+    Removes every deleted account whose entries have not been removed yet, such as when the app stopped first.
+    """
+    click.echo(f"Purged {len(DiaryUser.purge_deleted_users(chunk_size))} deleted users.")
+
+
+@views.cli.command("import-entries")
+@click.argument("username")
+@click.argument("source", type=click.File("r", encoding="utf-8"))
+@click.option("--format", "file_format", type=click.Choice(["jsonl", "csv"]),
+              help="The format of the file. Defaults to csv for .csv files and jsonl otherwise.")
+@click.option("--chunk-size", default=DEFAULT_CHUNK_SIZE, show_default=True, type=click.IntRange(min=1),
+              help="The number of entries committed at a time.")
+def import_entries(username: str, source, file_format: str, chunk_size: int) -> None:
+    """
+    Adds the entries in a JSON Lines or CSV file to a user's diary. Rows that are not valid entries are skipped.
+    """
+    user = User.query.filter_by(username=username).first()
+    if not user:
+        raise click.ClickException(f"No user with the username {username}")
+
+    file_format = file_format or ("csv" if source.name.endswith(".csv") else "jsonl")
+    rows = DiaryTransfer.read_csv(source) if file_format == "csv" else DiaryTransfer.read_jsonl(source)
+    with ShardRouter.routed(user.id):
+        result = DiaryTransfer.import_entries(user.id, rows, chunk_size)
+
+    for row_number, reason in result["errors"]:
+        click.echo(f"Skipped row {row_number}: {reason}", err=True)
+    click.echo(f"Imported {result['imported']} entries, skipped {result['skipped']} rows.")
+
+
+@views.cli.command("export-entries")
+@click.argument("username")
+@click.argument("destination", type=click.File("w", encoding="utf-8"), default="-")
+@click.option("--format", "file_format", type=click.Choice(["jsonl", "csv"]),
+              help="The format of the file. Defaults to csv for .csv files and jsonl otherwise.")
+@click.option("--chunk-size", default=DEFAULT_CHUNK_SIZE, show_default=True, type=click.IntRange(min=1),
+              help="The number of entries read at a time.")
+def export_entries(username: str, destination, file_format: str, chunk_size: int) -> None:
+    """
+    Writes all of a user's entries to a JSON Lines or CSV file, or to standard output.
+    """
+    user = User.query.filter_by(username=username).first()
+    if not user:
+        raise click.ClickException(f"No user with the username {username}")
+
+    file_format = file_format or ("csv" if destination.name.endswith(".csv") else "jsonl")
+    with ShardRouter.routed(user.id):
+        entries = DiaryTransfer.read_entries(user.id, chunk_size)
+        lines = DiaryTransfer.write_csv(entries) if file_format == "csv" else DiaryTransfer.write_jsonl(entries)
+        destination.writelines(lines)
+
+
+@views.cli.command("split-database")
+@click.argument("shard_directory", type=click.Path(file_okay=False))
+def split_database(shard_directory: str) -> None:
+    """
+    Copies each user's entries from the app's unsharded SQLite database into their own shard in SHARD_DIRECTORY.
+    The database is left unchanged, and is used as the directory database once the app is started with
+    DIARY_SHARD_DIRECTORY set to SHARD_DIRECTORY.
+    """
+    if ShardRouter.is_enabled():
+        raise click.ClickException("The database is already sharded")
+    url = db.engine.url
+    if url.get_backend_name() != "sqlite" or not url.database:
+        raise click.ClickException("Only SQLite database files can be split")
+    if Migrations.upgrade():
+        click.echo("Upgraded the database to the latest schema first.")
+
+    split = ShardRouter.split_database(url.database, shard_directory)
+    click.echo(f"Split the entries of {len(split)} users into {shard_directory}.")
+
+
+@views.cli.command("replicate-db")
+@click.option("--interval", default=0.0, show_default=True, type=click.FloatRange(min=0),
+              help="The number of seconds between copies, or 0 to copy once.")
+def replicate_db(interval: float) -> None:
+    """
+    Copies the app's SQLite database over its SQLite read replica, once or every --interval seconds until stopped.
+    This stands in for the replication of a database server, to run the app with a replica on one machine.
+    """
+    if not ReplicaRouter.is_enabled():
+        raise click.ClickException("DIARY_REPLICA_DATABASE_URI is not set")
+    primary_url, replica_url = db.engine.url, ReplicaRouter.engine().url
+    if any(url.get_backend_name() != "sqlite" or not url.database for url in (primary_url, replica_url)):
+        raise click.ClickException("Only SQLite database files can be replicated")
+
+    while True:
+        ReplicaRouter.replicate(primary_url.database, replica_url.database)
+        click.echo(f"Copied {primary_url.database} to {replica_url.database}.")
+        if not interval:
+            return
+        time.sleep(interval)
 
 
 if __name__ == '__main__':
-    flask_app.run(debug=True, host="0.0.0.0", port=5001)
+    create_app().run(debug=True, host="0.0.0.0", port=5001)
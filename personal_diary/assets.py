@@ -0,0 +1,234 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+from typing import Optional
+
+from flask import Flask, Response, current_app, request, send_from_directory
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, without it only gzip variants are built
+    brotli = None
+
+"""
+The folder within the static folder that built assets are written to
+"""
+BUILD_FOLDER = "build"
+
+"""
+The file within BUILD_FOLDER mapping the path of every static file to the path of its fingerprinted copy
+"""
+MANIFEST_NAME = "manifest.json"
+
+"""
+The extensions of the files that are precompressed. Images and fonts are already compressed.
+"""
+COMPRESSIBLE_EXTENSIONS = {".css", ".js", ".html", ".json", ".svg", ".txt", ".md", ".xml"}
+
+"""
+The number of hex digits of the content hash that are kept in fingerprinted names
+"""
+HASH_LENGTH = 12
+
+"""
+How long browsers may cache a fingerprinted asset for. Its name changes whenever its content does, so it never
+has to be revalidated.
+"""
+IMMUTABLE_MAX_AGE = 60 * 60 * 24 * 365
+
+"""
+The precompressed variants of an asset, as Content-Encoding and file suffix, in the order they are preferred
+"""
+ENCODINGS = [("br", ".br"), ("gzip", ".gz")]
+
+
+class StaticAssets:
+    """
+    A class containing helper functions to fingerprint and precompress the static files, and to serve the results.
+    Each top-level static file is copied to a name containing a hash of its content, such as style.3f2a9c1b0d4e.css.
+    Each top-level folder, such as the CKEditor bundle, is copied as a whole to a folder named with a hash of all of
+    its files, since the editor loads its plugins, skins and translations by paths relative to ckeditor.js.
+    """
+
+    @staticmethod
+    def build(static_folder: str) -> dict:
+        """
+        Writes the fingerprinted copies of the static files to BUILD_FOLDER, each with a gzip and, when brotli is
+        installed, a brotli compressed variant, and writes the manifest. Any previous build is replaced.
+
+        Args:
+            static_folder: the app's static folder
+
+        Returns:
+            the manifest, mapping the path of each static file to the path of its fingerprinted copy, both relative
+            to the static folder
+        """
+        build_folder = os.path.join(static_folder, BUILD_FOLDER)
+        shutil.rmtree(build_folder, ignore_errors=True)
+
+        manifest = {}
+        for name in sorted(os.listdir(static_folder)):
+            source = os.path.join(static_folder, name)
+            if name == BUILD_FOLDER or name.startswith("."):
+                continue
+            if os.path.isdir(source):
+                files = StaticAssets.list_files(source)
+                built_folder = f"{BUILD_FOLDER}/{name}.{StaticAssets.hash_files(source, files)}"
+                for path in files:
+                    manifest[f"{name}/{path}"] = f"{built_folder}/{path}"
+            else:
+                stem, extension = os.path.splitext(name)
+                manifest[name] = f"{BUILD_FOLDER}/{stem}.{StaticAssets.hash_files(static_folder, [name])}{extension}"
+
+        for path, built_path in manifest.items():
+            target = os.path.join(static_folder, *built_path.split("/"))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copyfile(os.path.join(static_folder, *path.split("/")), target)
+            StaticAssets.compress(target)
+
+        with open(os.path.join(build_folder, MANIFEST_NAME), "w") as manifest_file:
+            json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+        return manifest
+
+    @staticmethod
+    def list_files(folder: str) -> list:
+        """
+        Returns:
+            the paths of every file within the folder, relative to it and with forward slashes, in sorted order
+        """
+        return sorted(os.path.relpath(os.path.join(root, name), folder).replace(os.sep, "/")
+                      for root, _, names in os.walk(folder) for name in names)
+
+    @staticmethod
+    def hash_files(folder: str, files: list) -> str:
+        """
+        Hashes the paths and contents of files, so renaming, adding, removing or changing any of them changes the
+        hash.
+
+        Args:
+            folder: the folder the paths are relative to
+            files: the paths of the files
+
+        Returns:
+            the first HASH_LENGTH hex digits of the hash
+        """
+        digest = hashlib.sha256()
+        for path in files:
+            digest.update(path.encode() + b"\0")
+            with open(os.path.join(folder, path), "rb") as file:
+                digest.update(hashlib.sha256(file.read()).digest())
+        return digest.hexdigest()[:HASH_LENGTH]
+
+    @staticmethod
+    def compress(path: str) -> None:
+        """
+        Writes the compressed variants of a file next to it, with the suffixes in ENCODINGS. Variants that would not
+        be smaller than the file are not written.
+
+        Args:
+            path: the path of the file
+        """
+        if os.path.splitext(path)[1].lower() not in COMPRESSIBLE_EXTENSIONS:
+            return
+        with open(path, "rb") as file:
+            content = file.read()
+
+        # a fixed mtime keeps the gzip output the same between builds
+        variants = {".gz": gzip.compress(content, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            variants[".br"] = brotli.compress(content, quality=11)
+        for suffix, compressed in variants.items():
+            if len(compressed) < len(content):
+                with open(path + suffix, "wb") as file:
+                    file.write(compressed)
+
+    @staticmethod
+    def load_manifest(static_folder: str) -> dict:
+        """
+        Returns:
+            the manifest of the last build of the static folder, or an empty dictionary if it was never built
+        """
+        try:
+            with open(os.path.join(static_folder, BUILD_FOLDER, MANIFEST_NAME)) as manifest_file:
+                return json.load(manifest_file)
+        except FileNotFoundError:
+            return {}
+
+    @staticmethod
+    def init_app(app: Flask) -> None:
+        """
+        Makes url_for('static', filename=...) return the fingerprinted path of every file in the manifest, and
+        serves fingerprinted files in the best precompressed encoding the client accepts with immutable cache
+        headers. Static files are served as before when the static folder was never built.
+
+        Args:
+            app: the Flask app
+        """
+        manifest = StaticAssets.load_manifest(app.static_folder)
+        app.extensions["static_assets"] = manifest
+        app.extensions["static_assets_version"] = hashlib.sha256(
+            json.dumps(manifest, sort_keys=True).encode()).hexdigest()[:HASH_LENGTH]
+
+        @app.url_defaults
+        def fingerprint_static_url(endpoint: str, values: dict) -> None:
+            if endpoint == "static" and "filename" in values:
+                values["filename"] = current_app.extensions["static_assets"].get(values["filename"],
+                                                                                 values["filename"])
+
+        app.view_functions["static"] = StaticAssets.send_static_file
+
+    @staticmethod
+    def version(app: Optional[Flask] = None) -> str:
+        """
+        Pages link to the fingerprinted paths of the build they were rendered with, so anything validating a cached
+        page must change when the assets are built again.
+
+        Returns:
+            a hash of the manifest the app was started with
+        """
+        app = app or current_app
+        return app.extensions["static_assets_version"]
+
+    @staticmethod
+    def send_static_file(filename: str) -> Response:
+        """
+        Serves a static file. Fingerprinted files are served with the precompressed variant preferred by the
+        request's Accept-Encoding header, and may be cached by browsers and proxies for IMMUTABLE_MAX_AGE seconds
+        without revalidation.
+
+        Args:
+            filename: the path of the file, relative to the static folder
+
+        Returns:
+            the response with the file
+        """
+        if not filename.startswith(BUILD_FOLDER + "/"):
+            return current_app.send_static_file(filename)
+
+        encoding, suffix = StaticAssets.choose_encoding(filename) or (None, "")
+        mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        response = send_from_directory(current_app.static_folder, filename + suffix, mimetype=mimetype,
+                                       max_age=IMMUTABLE_MAX_AGE)
+        if encoding:
+            response.content_encoding = encoding
+        response.vary.add("Accept-Encoding")
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
+
+    @staticmethod
+    def choose_encoding(filename: str) -> Optional[tuple]:
+        """
+        Returns:
+            the Content-Encoding and file suffix of the precompressed variant of a file the request accepts with the
+            highest quality, preferring brotli on ties, or None if the file should be sent uncompressed
+        """
+        best, best_quality = None, 0
+        for encoding, suffix in ENCODINGS:
+            quality = request.accept_encodings.quality(encoding)
+            if quality > best_quality and os.path.isfile(os.path.join(current_app.static_folder, filename + suffix)):
+                best, best_quality = (encoding, suffix), quality
+        return best
@@ -0,0 +1,93 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+
+class LRUCache:
+    """
+    A thread-safe, in-process cache holding at most max_size keys. Once it is full, the least recently used key is
+    evicted to make room for a new one. Keys can optionally expire ttl seconds after they were set. Hits and misses
+    are counted so the benefit of a cache can be checked.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: Optional[float] = None) -> None:
+        """
+        Args:
+            max_size: the maximum number of keys held by the cache
+            ttl: the number of seconds a key is kept for after it was set, or None to keep keys until they are evicted
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Looks up a key and marks it as the most recently used.
+
+        Args:
+            key: the key to look up
+            default: the value to return when the key is not cached
+
+        Returns:
+            the cached value, or default if the key is not cached or has expired
+        """
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None and self.ttl is not None and item[1] <= time.monotonic():
+                del self._items[key]
+                item = None
+            if item is None:
+                self.misses += 1
+                return default
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """
+        Caches a value under a key, evicting the least recently used key if the cache is full.
+
+        Args:
+            key: the key to cache the value under
+            value: the value to cache
+        """
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._items[key] = (value, expires)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def delete(self, key: Hashable) -> None:
+        """
+        Removes a key from the cache if it is cached.
+
+        Args:
+            key: the key to remove
+        """
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self) -> None:
+        """
+        Removes every key from the cache and resets its statistics.
+        """
+        with self._lock:
+            self._items.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            a dictionary with the number of hits, misses, cached keys and the maximum number of keys
+        """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._items), "max_size": self.max_size}
+
+    def __len__(self) -> int:
+        return len(self._items)
@@ -1,9 +1,76 @@
-from datetime import datetime
-import uuid
-from personal_diary.models import Entry, Tag
-from sqlalchemy import desc, asc
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+import base64
+import binascii
+import json
+from collections import Counter, namedtuple
+from personal_diary.cache import LRUCache
+from personal_diary.fragment_cache import ENTRY_CARD_CACHE
+from personal_diary.fuzzy_index import FuzzyIndex
+from personal_diary.ids import TimeOrderedIds
+from personal_diary.models import Entry, Tag, TagUsage, tags as entry_tags
+from personal_diary.mood_rollups import MoodRollups
+from personal_diary.replicas import ReplicaRouter
+from personal_diary.search_index import SearchIndex
+from personal_diary.shards import ShardRouter
+from sqlalchemy import bindparam, case, desc, asc, event, func, or_, select, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Query, joinedload, make_transient_to_detached, selectinload
 from personal_diary import db
-from typing import Iterable
+from flask import abort
+from flask_sqlalchemy import SignallingSession
+from typing import Iterable, Optional
+
+"""
+A lightweight, immutable view of an entry for listing pages, which holds the names of its tags and leaves out the body
+"""
+EntrySummary = namedtuple("EntrySummary", ["id", "title", "mood", "created", "modified", "tags"])
+SUMMARY_COLUMNS = (Entry.id, Entry.title, Entry.mood, Entry.created, Entry.modified)
+
+"""
+Maps each supported sort type to the Entry column it orders by and whether the order is ascending
+"""
+SORT_TYPES = {
+    "created_desc": (Entry.created, False),
+    "created_asc": (Entry.created, True),
+    "modified_desc": (Entry.modified, False),
+    "modified_asc": (Entry.modified, True)
+}
+DEFAULT_SORT_TYPE = "created_desc"
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+"""
+Maps the id of a user to the created datetime of an entry they are known to have made most recently. Only entries
+seen by this process are cached, so a cached entry from today proves there is an entry for today but a miss must be
+checked against the database. Deletes made by other processes are not seen, which can at most hide the reminder for
+an entry deleted earlier that day.
+"""
+LATEST_ENTRY_CACHE = LRUCache(max_size=10000)
+
+"""
+Maps tag names to the ids of their EntryTags rows. Tags are never renamed, but purging a user deletes the tags no
+other entry is attached to, possibly in another process, so cached ids are checked before they are used.
+"""
+TAG_ID_CACHE = LRUCache(max_size=10000)
+
+"""
+The key of Session.info holding the tag ids resolved within the session's current transaction. They are only added to
+TAG_ID_CACHE once the transaction commits, since a tag inserted by a transaction that rolls back never exists.
+"""
+PENDING_TAG_IDS_KEY = "pending_tag_ids"
+
+"""
+The number of a user's most used tags listed in the tag sidebar of the home page
+"""
+TAG_SIDEBAR_SIZE = 20
+
+"""
+The maximum number of tag names looked up in a single IN query, kept well below SQLite's limit on bound parameters
+"""
+TAG_LOOKUP_BATCH_SIZE = 500
 
 
 class Diary:
@@ -24,7 +91,7 @@ class Diary:
         Returns:
              dictionary containing the entry_id of the new entry
         """
-        new_entry_id = str(uuid.uuid4())
+        new_entry_id = TimeOrderedIds.new()
         curr_datetime = datetime.now()
         entry = Entry(id=new_entry_id,
                       title=request["title"],
@@ -35,26 +102,278 @@ class Diary:
                       mood=request["mood"])
         Diary.add_tags_to_entry(entry, request["tags"])
         db.session.add(entry)
+        Diary.change_tag_usage(entry.user_id, added=[(tag.id, curr_datetime) for tag in entry.tags])
+        FuzzyIndex.index_entries(entry.user_id, [(new_entry_id, entry.title, [tag.name for tag in entry.tags])],
+                                 replace=False)
+        MoodRollups.change(entry.user_id, added=[(entry.mood, curr_datetime)])
         db.session.commit()
+        LATEST_ENTRY_CACHE.set(entry.user_id, curr_datetime)
         return {"entry_id": new_entry_id}
 
     @staticmethod
     def add_tags_to_entry(entry: Entry, tags: list) -> None:
         """
-        Attaches tags to the given entry.
+        Attaches tags to the given entry. Tags that do not exist yet are created.
 
         Args:
             entry: an Entry object which the tags will be attached to
             tags: a list of tags to attach to the entry parameter in the form ["tag1", "tag2", "tag3"]
         """
-        entry.tags = []
-        for tag_name in tags:
-            tag = Tag.query.filter_by(name=tag_name).first()
-            if not tag:
-                tag = Tag(name=tag_name)
-            entry.tags.append(tag)
+        entry_tags = []
+        for tag_name, tag_id in Diary.resolve_tag_ids(tags).items():
+            tag = Tag(id=tag_id, name=tag_name)
+            make_transient_to_detached(tag)
+            # merging without loading reuses the tag already in the session, or attaches this one without a SELECT
+            entry_tags.append(db.session.merge(tag, load=False))
+        entry.tags = entry_tags
 
     @staticmethod
+    def resolve_tag_ids(tag_names: Iterable[str]) -> dict:
+        """
+        Finds the ids of the tags with the given names, creating any tags that do not exist yet. Cached ids are checked
+        with a single IN query on the primary key, and ids of tags deleted since they were cached are evicted and
+        looked up again. All other names are looked up with a single IN query, and missing tags are inserted with an
+        INSERT ... ON CONFLICT DO NOTHING so that concurrent writers can never create the same tag twice. The ids
+        looked up are cached once the current transaction commits.
+
+        Args:
+            tag_names: the names of the tags
+
+        Returns:
+            a dictionary mapping each distinct tag name, in the order given, to the id of its tag
+        """
+        tag_names = list(dict.fromkeys(tag_names))
+        pending_tag_ids = db.session.info.setdefault(PENDING_TAG_IDS_KEY, {})
+        tag_ids = {}
+        cached_tag_ids = {}
+        for tag_name in tag_names:
+            cache_key = ShardRouter.tag_cache_key(tag_name)
+            tag_id = pending_tag_ids.get(cache_key)
+            if tag_id is not None:
+                tag_ids[tag_name] = tag_id
+                continue
+            tag_id = TAG_ID_CACHE.get(cache_key)
+            if tag_id is not None:
+                cached_tag_ids[tag_name] = tag_id
+
+        if cached_tag_ids:
+            existing_tag_ids = Diary.select_existing_tag_ids(list(cached_tag_ids.values()))
+            for tag_name, tag_id in cached_tag_ids.items():
+                if tag_id in existing_tag_ids:
+                    tag_ids[tag_name] = tag_id
+                else:
+                    TAG_ID_CACHE.delete(ShardRouter.tag_cache_key(tag_name))
+
+        uncached_names = [tag_name for tag_name in tag_names if tag_name not in tag_ids]
+        if uncached_names:
+            tag_ids.update(Diary.select_tag_ids(uncached_names))
+            missing_names = [tag_name for tag_name in uncached_names if tag_name not in tag_ids]
+            if missing_names:
+                Diary.insert_missing_tags(missing_names)
+                tag_ids.update(Diary.select_tag_ids(missing_names))
+            for tag_name in uncached_names:
+                pending_tag_ids[ShardRouter.tag_cache_key(tag_name)] = tag_ids[tag_name]
+
+        return {tag_name: tag_ids[tag_name] for tag_name in tag_names}
+
+    @staticmethod
+    def select_tag_ids(tag_names: list) -> dict:
+        """
+        Looks up the ids of existing tags, in batches of at most TAG_LOOKUP_BATCH_SIZE names per query.
+
+        Args:
+            tag_names: the names of the tags
+
+        Returns:
+            a dictionary mapping the name of each existing tag to its id
+        """
+        tag_ids = {}
+        for start in range(0, len(tag_names), TAG_LOOKUP_BATCH_SIZE):
+            batch = tag_names[start:start + TAG_LOOKUP_BATCH_SIZE]
+            tag_ids.update(db.session.execute(select(Tag.name, Tag.id).where(Tag.name.in_(batch))).all())
+        return tag_ids
+
+    @staticmethod
+    def select_existing_tag_ids(tag_ids: list) -> set:
+        """
+        Checks which of the given tag ids still exist, in batches of at most TAG_LOOKUP_BATCH_SIZE ids per query. On
+        PostgreSQL the rows are locked against deletion until the current transaction ends, so a purge cannot delete
+        a tag between the check and the insert of the entry it is attached to.
+
+        Args:
+            tag_ids: the ids of the tags
+
+        Returns:
+            the set of the ids whose tags exist
+        """
+        existing_tag_ids = set()
+        for start in range(0, len(tag_ids), TAG_LOOKUP_BATCH_SIZE):
+            batch = tag_ids[start:start + TAG_LOOKUP_BATCH_SIZE]
+            existing_tag_ids.update(db.session.execute(
+                select(Tag.id).where(Tag.id.in_(batch)).with_for_update(read=True)).scalars())
+        return existing_tag_ids
+
+    @staticmethod
+    def insert_missing_tags(tag_names: list) -> None:
+        """
+        Inserts tags with the given names, skipping any name that another writer has inserted in the meantime.
+
+        Args:
+            tag_names: the names of the tags to insert
+        """
+        rows = [{"name": tag_name} for tag_name in tag_names]
+        dialect = db.session().get_bind(Tag.__mapper__).dialect.name
+        if dialect in ("sqlite", "postgresql"):
+            insert = sqlite.insert if dialect == "sqlite" else postgresql.insert
+            db.session.execute(insert(Tag.__table__).on_conflict_do_nothing(index_elements=["name"]), rows)
+            return
+
+        for row in rows:
+            try:
+                with db.session.begin_nested():
+                    db.session.execute(Tag.__table__.insert(), row)
+            except IntegrityError:
+                pass
+
+    @staticmethod
+    def read_tag_names(entry_ids: list) -> dict:
+        """
+        Reads the names of the tags attached to each of the given entries with one query per TAG_LOOKUP_BATCH_SIZE
+        entries.
+
+        Args:
+            entry_ids: the ids of the entries
+
+        Returns:
+            a dictionary mapping the id of each entry to a list of the names of its tags
+        """
+        tag_names = {entry_id: [] for entry_id in entry_ids}
+        for start in range(0, len(entry_ids), TAG_LOOKUP_BATCH_SIZE):
+            batch = entry_ids[start:start + TAG_LOOKUP_BATCH_SIZE]
+            rows = db.session.execute(select(entry_tags.c.entry_id, Tag.name)
+                                      .join(Tag, Tag.id == entry_tags.c.tag_id)
+                                      .where(entry_tags.c.entry_id.in_(batch))
+                                      .order_by(entry_tags.c.entry_id, Tag.id))
+            for entry_id, tag_name in rows:
+                tag_names[entry_id].append(tag_name)
+        return tag_names
+
+    @staticmethod
+    @ReplicaRouter.read_only
+    def read_entry_bodies(entry_ids: list) -> dict:
+        """
+        Reads the body text of each of the given entries with one query, for listings of entry summaries that need
+        the bodies too.
+
+        Args:
+            entry_ids: the ids of the entries, at most TAG_LOOKUP_BATCH_SIZE of them
+
+        Returns:
+            a dictionary mapping the id of each entry to its body text
+        """
+        return dict(db.session.query(Entry.id, Entry.body).filter(Entry.id.in_(entry_ids)).all())
+
+    @staticmethod
+    @ReplicaRouter.read_only
+    def read_tag_usage(user_id: str, limit: Optional[int] = None) -> list:
+        """
+        Reads the tags a user has attached to their entries from the TagUsage table, without reading the entries.
+
+        Args:
+            user_id: string representing the id of the user the entries belong to
+            limit: the maximum number of tags to read, or None to read all of them
+
+        Returns:
+            a list of rows with the name, entry_count and last_used datetime of each tag, with the tags attached to
+            the most entries first and ties ordered by name
+        """
+        query = db.session.query(Tag.name, TagUsage.entry_count, TagUsage.last_used) \
+            .join(Tag, Tag.id == TagUsage.tag_id) \
+            .filter(TagUsage.user_id == user_id) \
+            .order_by(TagUsage.entry_count.desc(), Tag.name)
+        return query.limit(limit).all() if limit else query.all()
+
+    @staticmethod
+    def change_tag_usage(user_id: str, added: Iterable[tuple] = (), removed: Iterable[int] = ()) -> None:
+        """
+        Updates a user's rows of the TagUsage table within the current transaction, after tags were attached to or
+        detached from their entries. Rows of tags that are no longer attached to any of the user's entries are
+        deleted. The last_used datetime of a tag is not moved back when it is detached, until the table is rebuilt
+        with rebuild_tag_usage.
+
+        Args:
+            user_id: string representing the id of the user the entries belong to
+            added: a (tag id, entry created datetime) tuple for every time a tag was attached to an entry
+            removed: a tag id for every time a tag was detached from an entry, including by deleting the entry
+        """
+        usage = TagUsage.__table__
+        added_usage = {}
+        for tag_id, created in added:
+            entry_count, last_used = added_usage.get(tag_id, (0, created))
+            added_usage[tag_id] = (entry_count + 1, max(last_used, created))
+        if added_usage:
+            rows = [{"user_id": user_id, "tag_id": tag_id, "entry_count": entry_count, "last_used": last_used}
+                    for tag_id, (entry_count, last_used) in added_usage.items()]
+            dialect = db.session().get_bind(TagUsage.__mapper__).dialect.name
+            if dialect in ("sqlite", "postgresql"):
+                insert = (sqlite.insert if dialect == "sqlite" else postgresql.insert)(usage)
+                db.session.execute(insert.on_conflict_do_update(
+                    index_elements=["user_id", "tag_id"],
+                    set_={"entry_count": usage.c.entry_count + insert.excluded.entry_count,
+                          "last_used": case((or_(usage.c.last_used.is_(None),
+                                                 insert.excluded.last_used > usage.c.last_used),
+                                             insert.excluded.last_used),
+                                            else_=usage.c.last_used)}), rows)
+            else:
+                for row in rows:
+                    # other databases have no portable upsert, so the row is inserted when there is none to update
+                    updated = db.session.execute(
+                        usage.update()
+                        .where(usage.c.user_id == user_id, usage.c.tag_id == row["tag_id"])
+                        .values(entry_count=usage.c.entry_count + row["entry_count"],
+                                last_used=func.coalesce(func.greatest(usage.c.last_used, row["last_used"]),
+                                                        row["last_used"])))
+                    if updated.rowcount == 0:
+                        db.session.execute(usage.insert(), row)
+
+        removed_counts = Counter(removed)
+        if removed_counts:
+            db.session.execute(usage.update()
+                               .where(usage.c.user_id == user_id, usage.c.tag_id == bindparam("removed_tag_id"))
+                               .values(entry_count=usage.c.entry_count - bindparam("removed_count")),
+                               [{"removed_tag_id": tag_id, "removed_count": count}
+                                for tag_id, count in removed_counts.items()])
+            db.session.execute(usage.delete().where(usage.c.user_id == user_id,
+                                                    usage.c.tag_id.in_(list(removed_counts)),
+                                                    usage.c.entry_count <= 0))
+
+    @staticmethod
+    def rebuild_tag_usage(connection=None) -> int:
+        """
+        Rebuilds the TagUsage table from scratch from every entry's tags, within a single transaction.
+
+        Args:
+            connection: the SQLAlchemy connection to the database, or None to use a new transaction on the database
+            the app stores entries in
+
+        Returns:
+            the number of rows in the rebuilt table
+        """
+        if connection is None:
+            with db.session.get_bind(Entry.__mapper__).begin() as connection:
+                return Diary.rebuild_tag_usage(connection)
+
+        usage = TagUsage.__table__
+        connection.execute(usage.delete())
+        connection.execute(usage.insert().from_select(
+            ["user_id", "tag_id", "entry_count", "last_used"],
+            select(Entry.user_id, entry_tags.c.tag_id, func.count(), func.max(Entry.created))
+            .select_from(entry_tags.join(Entry.__table__, Entry.id == entry_tags.c.entry_id))
+            .group_by(Entry.user_id, entry_tags.c.tag_id)))
+        return connection.execute(select(func.count()).select_from(usage)).scalar()
+
+    @staticmethod
+    @ReplicaRouter.read_only
     def read_single_entry(request: dict) -> dict:
         """
         Reads single diary entry from the database.
@@ -64,12 +383,86 @@ class Diary:
 
         Returns:
             a dictionary containing a key "entry" with of a value of type Entry. The Entry has information about the
-            title, body, date_created, and time_created of the requested entry_id
+            title, body, date_created, and time_created of the requested entry_id. Its tags are loaded in the same
+            query.
         """
-        entry = Entry.query.get_or_404(request["entry_id"])
+        entry = Entry.query.options(joinedload(Entry.tags)).get_or_404(request["entry_id"])
         return {"entry": entry}
 
     @staticmethod
+    def read_owned_entry(entry_id: str, user_id: str) -> Entry:
+        """
+        Reads an entry that belongs to the given user, responding with 404 Not Found if there is no such entry or
+        it belongs to another user, so other users' entries cannot be told apart from missing ones.
+
+        Args:
+            entry_id: the id of the entry
+            user_id: string representing the id of the user the entry must belong to
+
+        Returns:
+            the Entry
+        """
+        entry = Entry.query.get_or_404(entry_id)
+        if entry.user_id != user_id:
+            abort(404)
+        return entry
+
+    @staticmethod
+    def read_owned_entries(entry_ids: list, user_id: str) -> list:
+        """
+        Reads several entries that belong to the given user with one query, loading their tags with a second one.
+        Like read_owned_entry, responds with 404 Not Found if any of the entries is missing or belongs to another
+        user.
+
+        Args:
+            entry_ids: the ids of the entries
+            user_id: string representing the id of the user the entries must belong to
+
+        Returns:
+            a list of the Entry objects in the order of entry_ids, without duplicates
+        """
+        entry_ids = list(dict.fromkeys(entry_ids))
+        entries = {entry.id: entry for entry in Entry.query.options(selectinload(Entry.tags))
+                   .filter(Entry.id.in_(entry_ids), Entry.user_id == user_id)}
+        if len(entries) != len(entry_ids):
+            abort(404)
+        return [entries[entry_id] for entry_id in entry_ids]
+
+    @staticmethod
+    @ReplicaRouter.read_only
+    def read_entry_version(entry_id: str) -> Optional[tuple]:
+        """
+        Reads only what is needed to tell whether an entry changed, without loading the entry.
+
+        Args:
+            entry_id: the id of the entry
+
+        Returns:
+            a tuple of the id of the user the entry belongs to and the entry's modified datetime, or None if there
+            is no such entry
+        """
+        return db.session.query(Entry.user_id, Entry.modified).filter(Entry.id == entry_id).first()
+
+    @staticmethod
+    @ReplicaRouter.read_only
+    def read_entries_version(user_id: str) -> tuple:
+        """
+        Reads what is needed to tell whether any of a user's entries changed, with one aggregate query over the
+        index on the user id and modified datetime. Creating or editing an entry changes the latest modified
+        datetime and deleting one changes the count.
+
+        Args:
+            user_id: string representing the id of the user the entries belong to
+
+        Returns:
+            a tuple of the latest modified datetime of the user's entries, or None if they have none, and the number
+            of entries
+        """
+        return tuple(db.session.query(func.max(Entry.modified), func.count(Entry.id))
+                     .filter(Entry.user_id == user_id).one())
+
+    @staticmethod
+    @ReplicaRouter.read_only
     def read_all_entries(user_id: str, tag_name: str) -> dict:
         """
         Reads all entries currently stored in local database.
@@ -81,7 +474,7 @@ class Diary:
         Returns:
              dictionary containing all the stored entries, where each entry has an id, title, body, date, and time
         """
-        all_entries = Entry.query.filter_by(user_id=user_id)
+        all_entries = Entry.query.filter_by(user_id=user_id).options(selectinload(Entry.tags))
         if tag_name:
             all_entries = all_entries.join(Entry.tags).filter(Tag.name == tag_name).all()
 
@@ -103,15 +496,44 @@ class Diary:
         Returns:
             a dictionary containing the updated entry
         """
-        entry = Entry.query.get(request["entry_id"])
-        entry_id = request["entry_id"]
-        entry.body = request["body"]
-        entry.title = request["title"]
-        entry.mood = request["mood"]
-        entry.modified = datetime.now()
-        Diary.add_tags_to_entry(entry, request["tags"])
+        return Diary.update_entries([request])
+
+    @staticmethod
+    def update_entries(requests: list) -> dict:
+        """
+        Updates several entries in a single transaction, so either all of the updates are saved or none are.
+
+        Args:
+            requests: a list of dictionaries each containing the title, body, mood, tags and id of an entry, as
+            taken by update_entry
+
+        Returns:
+            a dictionary mapping the id of each updated entry to the updated Entry
+        """
+        updated_entries = {}
+        for request in requests:
+            entry = Entry.query.get(request["entry_id"])
+            title_changed = entry.title != request["title"]
+            entry.body = request["body"]
+            entry.title = request["title"]
+            if entry.mood != request["mood"]:
+                MoodRollups.change(entry.user_id, added=[(request["mood"], entry.created)],
+                                   removed=[(entry.mood, entry.created)])
+            entry.mood = request["mood"]
+            entry.modified = datetime.now()
+            old_tag_ids = {tag.id for tag in entry.tags}
+            Diary.add_tags_to_entry(entry, request["tags"])
+            new_tag_ids = {tag.id for tag in entry.tags}
+            Diary.change_tag_usage(entry.user_id,
+                                   added=[(tag_id, entry.created) for tag_id in new_tag_ids - old_tag_ids],
+                                   removed=old_tag_ids - new_tag_ids)
+            if title_changed or old_tag_ids != new_tag_ids:
+                FuzzyIndex.index_entries(entry.user_id, [(entry.id, entry.title, [tag.name for tag in entry.tags])])
+            updated_entries[entry.id] = entry
         db.session.commit()
-        return {entry_id: entry}
+        for entry_id in updated_entries:
+            ENTRY_CARD_CACHE.delete(entry_id)
+        return updated_entries
 
     @staticmethod
     def delete_entry(request: dict) -> dict:
@@ -125,17 +547,76 @@ class Diary:
             dictionary containing the id of the entry that was deleted
         """
         entry_id = request.get("entry_id")
-        deleted_entry = Entry.query.get(entry_id)
-        db.session.delete(deleted_entry)
+        Diary.delete_entries([Entry.query.get(entry_id)])
+        return {"entry_id": entry_id}
+
+    @staticmethod
+    def delete_entries(entries: list) -> list:
+        """
+        Deletes several entries in a single transaction.
+
+        Args:
+            entries: the Entry objects to delete
+
+        Returns:
+            a list of the ids of the deleted entries
+        """
+        removed_tag_ids = {}
+        removed_moods = {}
+        for entry in entries:
+            removed_tag_ids.setdefault(entry.user_id, []).extend(tag.id for tag in entry.tags)
+            removed_moods.setdefault(entry.user_id, []).append((entry.mood, entry.created))
+            db.session.delete(entry)
+        for user_id, tag_ids in removed_tag_ids.items():
+            Diary.change_tag_usage(user_id, removed=tag_ids)
+            MoodRollups.change(user_id, removed=removed_moods[user_id])
+        FuzzyIndex.remove_entries([entry.id for entry in entries])
         db.session.commit()
+        for entry in entries:
+            LATEST_ENTRY_CACHE.delete(entry.user_id)
+            ENTRY_CARD_CACHE.delete(entry.id)
+        return [entry.id for entry in entries]
 
-        return {"entry_id": entry_id}
+    @staticmethod
+    def filter_entries(user_id: str, search_query: str, tag_name: str, mood: Optional[str] = None,
+                       fuzzy: bool = False) -> Query:
+        """
+        Builds the query for the entries of a user that match the search query, tag and mood, without any ordering.
+
+        Args:
+            user_id: string representing the id of the user the entry belongs to
+            search_query: a string containing keywords that must all be in the title or body text of an entry
+            tag_name: name of entry tag to filter by
+            mood: the HTML entity of the mood to filter by, or None for entries of any mood
+            fuzzy: whether an entry also matches when every keyword is similar to a word of its title or tags, in
+            addition to when its title or body text contains every keyword
+
+        Returns:
+            a query for the matching entries
+        """
+        matching_entries = Entry.query.filter_by(user_id=user_id)
+        if mood:
+            matching_entries = matching_entries.filter(Entry.mood == mood)
+        if search_query:
+            exact_entries = SearchIndex.filter_entries(matching_entries, search_query.split(' '))
+            fuzzy_match = FuzzyIndex.match_entries(user_id, search_query) if fuzzy else None
+            if fuzzy_match is not None:
+                # the entries the exact search finds are kept, so allowing typos never finds fewer entries
+                matching_entries = matching_entries.filter(
+                    or_(fuzzy_match, Entry.id.in_(exact_entries.with_entities(Entry.id))))
+            else:
+                matching_entries = exact_entries
+        if tag_name:
+            matching_entries = matching_entries.join(Entry.tags).filter(Tag.name == tag_name)
+        return matching_entries
 
     @staticmethod
+    @ReplicaRouter.read_only
     def search_entries(search_query: str, user_id: str, tag_name: str, sort_by: str = "created_desc") -> dict:
         """
         Returns entries that contain the keywords in the search query. The search is not case-sensitive.
-        An entry matches the search query if it contains all keywords in its title or body text.
+        An entry matches the search query if it contains all keywords in its title or body text. Keywords are looked up
+        in the full-text search index when the database has one.
 
         Args:
             search_query: a string containing keywords to search for in the query. For example, a string of
@@ -150,15 +631,8 @@ class Diary:
         if search_query is None:
             return Diary.read_all_entries(user_id, tag_name)
 
-        matching_entries = Entry.query.filter_by(user_id=user_id)
-        matching_entries = Diary.sort_entries(matching_entries, sort_by)
-
-        for keyword in search_query.split(' '):
-            matching_entries = matching_entries.filter(Entry.title.ilike("%" + keyword + "%") |
-                                                       Entry.body.ilike("%" + keyword + "%"))
-
-        if tag_name:
-            matching_entries = matching_entries.join(Entry.tags).filter(Tag.name == tag_name).all()
+        matching_entries = Diary.filter_entries(user_id, search_query, tag_name)
+        matching_entries = Diary.sort_entries(matching_entries, sort_by).options(selectinload(Entry.tags))
 
         entry_dict = {}
         for entry in matching_entries:
@@ -167,41 +641,222 @@ class Diary:
         return entry_dict
 
     @staticmethod
-    def sort_entries(entries: Entry, sort_type: str) -> Iterable:
+    @ReplicaRouter.read_only
+    def read_entries_page(user_id: str, search_query: str, tag_name: str, sort_by: str = DEFAULT_SORT_TYPE,
+                          cursor: Optional[str] = None, page_size: int = DEFAULT_PAGE_SIZE,
+                          mood: Optional[str] = None, fuzzy: bool = False) -> dict:
+        """
+        Returns one page of the entries that match the search query, tag and mood. Pages are found with keyset pagination
+        on the sort column and entry id, so reading any page costs the same no matter how many entries come before it.
+
+        Args:
+            search_query: a string containing keywords that must all be in the title or body text of an entry
+            user_id: string representing the id of the user the entry belongs to
+            tag_name: name of entry tag to filter by
+            sort_by: string representing how entries should be sorted by
+            cursor: a cursor returned with a previous page, or None for the first page
+            page_size: the maximum number of entries on the page
+            mood: the HTML entity of the mood to filter by, or None for entries of any mood
+            fuzzy: whether to match keywords to similar words in the titles and tags of entries, as in filter_entries
+
+        Returns:
+            a dictionary containing the page's entries as EntrySummary tuples keyed by id under "entries", the total
+            number of matching entries
+            under "count", and the cursors for the next and previous pages under "next_cursor" and "prev_cursor",
+            which are None when there is no such page
+        """
+        sort_by = sort_by if sort_by in SORT_TYPES else DEFAULT_SORT_TYPE
+        page_size = min(max(page_size, 1), MAX_PAGE_SIZE)
+        column, ascending = SORT_TYPES[sort_by]
+
+        matching_entries = Diary.filter_entries(user_id, search_query, tag_name, mood, fuzzy)
+        count = matching_entries.with_entities(func.count(Entry.id)).scalar()
+
+        direction, position = Diary.decode_cursor(cursor)
+        backwards = direction == "prev"
+        if position:
+            after = ascending != backwards
+            key = tuple_(column, Entry.id)
+            matching_entries = matching_entries.filter(key > position if after else key < position)
+        page = Diary.sort_entries(matching_entries.with_entities(*SUMMARY_COLUMNS), sort_by, reverse=backwards) \
+            .limit(page_size + 1).all()
+
+        has_more = len(page) > page_size
+        page = page[:page_size]
+        if backwards:
+            page.reverse()
+
+        next_cursor = prev_cursor = None
+        if page:
+            if has_more or backwards:
+                next_cursor = Diary.encode_cursor("next", getattr(page[-1], column.key), page[-1].id)
+            if (has_more and backwards) or (position and not backwards):
+                prev_cursor = Diary.encode_cursor("prev", getattr(page[0], column.key), page[0].id)
+
+        return {"entries": {entry.id: entry for entry in Diary.summarize_entries(page)},
+                "count": count,
+                "next_cursor": next_cursor,
+                "prev_cursor": prev_cursor}
+
+    @staticmethod
+    def summarize_entries(rows: list) -> list:
+        """
+        Turns rows selected with SUMMARY_COLUMNS into entry summaries, reading the tags of all the rows with one
+        query per TAG_LOOKUP_BATCH_SIZE entries.
+
+        Args:
+            rows: the rows holding the SUMMARY_COLUMNS of each entry
+
+        Returns:
+            a list of EntrySummary tuples in the same order as the rows
+        """
+        tag_names = Diary.read_tag_names([row.id for row in rows])
+        return [EntrySummary(row.id, row.title, row.mood, row.created, row.modified, tuple(tag_names[row.id]))
+                for row in rows]
+
+    @staticmethod
+    def encode_cursor(direction: str, sort_value: datetime, entry_id: str) -> str:
+        """
+        Encodes the position of an entry in a sorted list of entries into an opaque, URL-safe cursor.
+
+        Args:
+            direction: "next" for a cursor to the entries after the position, or "prev" for the entries before it
+            sort_value: the entry's value for the column the list is sorted by
+            entry_id: the id of the entry
+
+        Returns:
+            the cursor string
+        """
+        position = json.dumps([direction, sort_value.isoformat() if sort_value else None, entry_id])
+        return base64.urlsafe_b64encode(position.encode()).decode().rstrip("=")
+
+    @staticmethod
+    def decode_cursor(cursor: Optional[str]) -> tuple:
         """
-        Sorts a collection of entries based on either date created or date modified.
+        Decodes a cursor created by encode_cursor. Missing or malformed cursors decode to the start of the list.
+
+        Args:
+            cursor: the cursor string
+
+        Returns:
+            a tuple of the cursor's direction and a tuple of the sort value and entry id it points at, or
+            ("next", None) for the start of the list
+        """
+        if not cursor:
+            return "next", None
+        try:
+            direction, sort_value, entry_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+            sort_value = datetime.fromisoformat(sort_value)
+        except (binascii.Error, ValueError, TypeError):
+            return "next", None
+        if direction not in ("next", "prev"):
+            return "next", None
+        return direction, (sort_value, entry_id)
+
+    @staticmethod
+    def sort_entries(entries: Query, sort_type: str, reverse: bool = False) -> Iterable:
+        """
+        Sorts a collection of entries based on either date created or date modified. Entries with the same date
+        are ordered by their id, so the order is always the same.
 
         Args:
             entries: an Entry object that is used to do the sorting on
             sort_type: a string indicating the type of sort to do. The sorting can be based on the date modified
             or date created time, ascending or descending.
+            reverse: whether to reverse the sort order
 
         Returns:
             an iterable collection of sorted entries
         """
-        if sort_type == "created_asc":
-            return entries.order_by(asc(Entry.created))
-        elif sort_type == "modified_asc":
-            return entries.order_by(asc(Entry.modified))
-        elif sort_type == "modified_desc":
-            return entries.order_by(desc(Entry.modified))
-        else:
-            return entries.order_by(desc(Entry.created))
+        column, ascending = SORT_TYPES.get(sort_type, SORT_TYPES[DEFAULT_SORT_TYPE])
+        order = asc if ascending != reverse else desc
+        return entries.order_by(order(column), order(Entry.id))
 
     @staticmethod
-    def check_entry_for_today(user_id: str) -> bool:
+    @ReplicaRouter.read_only
+    def check_entry_for_today(user_id: str, timezone: Optional[str] = None) -> bool:
         """
-        Searches the collection of entries for a user to see if the user has made an entry for the day.
+        Checks whether the user has made an entry for the day. Entries the user made through this process are
+        remembered, so after the first entry of the day the check does not need to query the database.
 
         Args:
             user_id: string representing the id of the user the entry belongs to
+            timezone: the name of the IANA timezone the user's day follows, or None to follow the server's timezone
 
         Returns:
             a boolean which represents whether the user has made an entry for the day
         """
-        today = datetime.today()
-        user_entries = Entry.query.filter_by(user_id=user_id)
-        for entry in user_entries:
-            if entry.created.strftime("%d/%m/%Y") == today.strftime("%d/%m/%Y"):
-                return True
-        return False
+        start_of_day, start_of_next_day = Diary.day_bounds(timezone)
+
+        latest_created = LATEST_ENTRY_CACHE.get(user_id)
+        if latest_created is not None and start_of_day <= latest_created < start_of_next_day:
+            return True
+
+        created = db.session.query(Entry.created) \
+            .filter(Entry.user_id == user_id, Entry.created >= start_of_day, Entry.created < start_of_next_day) \
+            .limit(1).scalar()
+        if created is None:
+            return False
+        if latest_created is None or created > latest_created:
+            LATEST_ENTRY_CACHE.set(user_id, created)
+        return True
+
+    @staticmethod
+    def day_bounds(timezone: Optional[str] = None) -> tuple:
+        """
+        Finds the start of the current day and of the next day in the given timezone. Entry datetimes are stored in
+        the server's local time, so the bounds are converted to it.
+
+        Args:
+            timezone: the name of the IANA timezone to find the day in, or None to use the server's timezone.
+            Unknown timezones also use the server's timezone.
+
+        Returns:
+            a tuple of the start of the day and the start of the next day, as naive datetimes in the server's local time
+        """
+        try:
+            zone = ZoneInfo(timezone) if timezone else None
+        except (ZoneInfoNotFoundError, ValueError):
+            zone = None
+
+        if zone is None:
+            start_of_day = datetime.combine(datetime.now().date(), datetime.min.time())
+            return start_of_day, start_of_day + timedelta(days=1)
+
+        start_of_day = datetime.combine(datetime.now(zone).date(), datetime.min.time(), tzinfo=zone)
+        start_of_next_day = start_of_day + timedelta(days=1)
+        return (start_of_day.astimezone().replace(tzinfo=None),
+                start_of_next_day.astimezone().replace(tzinfo=None))
+
+
+@event.listens_for(Tag.__table__, "before_drop")
+def clear_tag_id_cache(target, connection, **kw) -> None:
+    """
+    Forgets every cached tag id when the EntryTags table is dropped, since the ids are reused once it is recreated.
+    """
+    TAG_ID_CACHE.clear()
+
+
+@event.listens_for(SignallingSession, "after_commit")
+def cache_pending_tag_ids(db_session) -> None:
+    """
+    Caches the tag ids resolved within a transaction once it commits, when their tags are known to exist.
+    """
+    for cache_key, tag_id in db_session.info.pop(PENDING_TAG_IDS_KEY, {}).items():
+        TAG_ID_CACHE.set(cache_key, tag_id)
+
+
+@event.listens_for(SignallingSession, "after_rollback")
+def forget_pending_tag_ids(db_session) -> None:
+    """
+    Forgets the tag ids resolved within a transaction that was rolled back, since the tags it inserted are gone.
+    """
+    db_session.info.pop(PENDING_TAG_IDS_KEY, None)
+
+
+@event.listens_for(Entry.__table__, "before_drop")
+def clear_entry_card_cache(target, connection, **kw) -> None:
+    """
+    Forgets every cached entry card when the DiaryEntries table is dropped, since entry ids may then be reused.
+    """
+    ENTRY_CARD_CACHE.clear()
@@ -1,7 +1,63 @@
-import uuid
-from personal_diary.models import User
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+from flask import has_request_context, session
+from sqlalchemy import event, exists, func, select
+from sqlalchemy.orm import make_transient_to_detached
+from personal_diary.cache import LRUCache
+from personal_diary.diary import LATEST_ENTRY_CACHE, TAG_ID_CACHE
+from personal_diary.fragment_cache import ENTRY_CARD_CACHE
+from personal_diary.fuzzy_index import FuzzyIndex
+from personal_diary.ids import TimeOrderedIds
+from personal_diary.jobs import BACKGROUND_JOBS
+from personal_diary.models import Entry, MoodRollup, Tag, TagUsage, User, WordTrigram, tags as entry_tags
+from personal_diary.replicas import ReplicaRouter
+from personal_diary.shards import ShardRouter
 from personal_diary import db
 
+"""
+The number of seconds a user's identity is reused for before it is read from the database again. Profile changes made
+through this process are seen at once, but other processes see them up to this long afterwards. Deletions are seen
+within REVOCATION_CHECK_INTERVAL instead.
+"""
+USER_CACHE_TTL = 60
+
+"""
+The number of seconds the ids of the users marked as deleted are reused for before they are read from the database
+again. A cached identity is never served for a user in that list, so every process stops serving a deleted user
+within this long.
+"""
+REVOCATION_CHECK_INTERVAL = 1
+
+"""
+The columns of a user that are needed to serve a request, which are cached instead of loading the user. The password
+hash is left out, so it is never kept in a cache or a session cookie.
+"""
+IDENTITY_COLUMNS = ("id", "username", "name", "timezone")
+
+"""
+The key of the user's identity in the signed session cookie, when identities are kept in the session
+"""
+SESSION_IDENTITY_KEY = "_user_identity"
+
+"""
+Maps the id of a user to a dictionary of their IDENTITY_COLUMNS
+"""
+USER_CACHE = LRUCache(max_size=10000, ttl=USER_CACHE_TTL)
+
+"""
+Holds the frozenset of the ids of the users marked as deleted, under the single key DELETED_USER_IDS_KEY
+"""
+DELETED_USER_IDS_CACHE = LRUCache(max_size=1, ttl=REVOCATION_CHECK_INTERVAL)
+DELETED_USER_IDS_KEY = "deleted_user_ids"
+
+"""
+The number of entries removed per transaction when a deleted account is purged, which bounds how long each
+transaction holds the database's write lock
+"""
+PURGE_CHUNK_SIZE = 500
+
 
 class DiaryUser:
     """
@@ -18,7 +74,7 @@ class DiaryUser:
         Returns:
             dictionary containing the user id of the new user
         """
-        new_user_id = str(uuid.uuid4())
+        new_user_id = TimeOrderedIds.new()
         new_user = User(id=new_user_id,
                         username=request["username"].strip(),
                         name=request["full_name"].strip(),
@@ -28,10 +84,30 @@ class DiaryUser:
         db.session.commit()
         return {"user_id": new_user_id}
 
+    @staticmethod
+    def update_user(request: dict) -> dict:
+        """
+        Updates the profile of the user specified by the request parameter. The user may update their full name
+        or timezone.
+
+        Args:
+            request: dictionary containing the user id, full name, and timezone of the user, where an empty
+            timezone means the user's days follow the server's timezone
+        Returns:
+            dictionary containing the user id of the updated user
+        """
+        user = User.query.get(request["user_id"])
+        user.name = request["full_name"].strip()
+        user.timezone = request["timezone"].strip() or None
+        db.session.commit()
+        DiaryUser.forget_identity(user.id)
+        return {"user_id": user.id}
+
     @staticmethod
     def delete_user(request: dict) -> dict:
         """
-        Deletes a user from the database
+        Deletes a user. The user is marked as deleted at once, so they can no longer log in or make requests, and
+        their account and entries are removed by purge_user in the background.
 
         Args:
             request: dictionary containing the user to be deleted
@@ -39,6 +115,254 @@ class DiaryUser:
             dictionary containing the user id of the deleted user
         """
         user = request["user"]
-        db.session.delete(user)
+        user_id = user.id
+        user.deleted_at = datetime.now()
         db.session.commit()
-        return {"user_id": user.id}
+        # callers may still read the user after its row is removed, such as through current_user
+        db.session.refresh(user)
+        DiaryUser.forget_identity(user_id)
+        DELETED_USER_IDS_CACHE.delete(DELETED_USER_IDS_KEY)
+        BACKGROUND_JOBS.submit(DiaryUser.purge_user, user_id)
+        return {"user_id": user_id}
+
+    @staticmethod
+    def purge_user(user_id: str, chunk_size: int = PURGE_CHUNK_SIZE) -> int:
+        """
+        Removes a user marked as deleted together with everything they own. Entries are removed with set-based
+        deletes, chunk_size entries per transaction, so other requests can write between the chunks. The user's tag
+        and mood counts and the user are then removed in one transaction, together with the tags no other entry is
+        attached to, with the user's row kept as a tombstone until every cached identity has expired. A background job
+        removes the tombstone once that has happened. Other processes may still have the ids of the removed tags
+        cached, which Diary.resolve_tag_ids checks before using them. When sharding is enabled, the user's shard file
+        is deleted instead. Purging can be started again after it was interrupted, and users that are not marked as
+        deleted are left unchanged.
+
+        Args:
+            user_id: the id of the user
+            chunk_size: the number of entries removed per transaction
+
+        Returns:
+            the number of entries removed
+        """
+        with db.engine.connect() as connection:
+            if connection.execute(select(User.id).where(User.id == user_id, User.deleted_at.isnot(None))).scalar() \
+                    is None:
+                return 0
+
+        if ShardRouter.is_enabled():
+            return DiaryUser.purge_user_shard(user_id)
+
+        purged = 0
+        while True:
+            with db.engine.begin() as connection:
+                removed = DiaryUser.remove_entries(connection, user_id, chunk_size)
+            if not removed:
+                break
+            purged += removed
+
+        with db.engine.begin() as connection:
+            # a request that was authenticated before the deletion was seen may have added entries since
+            purged += DiaryUser.remove_entries(connection, user_id)
+            used_tag_ids = select(TagUsage.tag_id).where(TagUsage.user_id == user_id)
+            orphaned_tags = connection.execute(
+                select(Tag.id, Tag.name)
+                .where(Tag.id.in_(used_tag_ids), ~exists().where(entry_tags.c.tag_id == Tag.id))).all()
+            connection.execute(TagUsage.__table__.delete().where(TagUsage.user_id == user_id))
+            connection.execute(MoodRollup.__table__.delete().where(MoodRollup.user_id == user_id))
+            connection.execute(WordTrigram.__table__.delete().where(WordTrigram.user_id == user_id))
+            if orphaned_tags:
+                connection.execute(Tag.__table__.delete().where(Tag.id.in_([tag.id for tag in orphaned_tags])))
+            DiaryUser.remove_user(connection, user_id)
+
+        for tag in orphaned_tags:
+            TAG_ID_CACHE.delete(tag.name)
+        LATEST_ENTRY_CACHE.delete(user_id)
+        USER_CACHE.delete(user_id)
+        return purged
+
+    @staticmethod
+    def remove_entries(connection, user_id: str, limit: Optional[int] = None) -> int:
+        """
+        Deletes entries of a user together with their tag links and trigrams within the connection's transaction.
+
+        Args:
+            connection: the SQLAlchemy connection to the database
+            user_id: the id of the user
+            limit: the maximum number of entries to delete, or None to delete all of them
+
+        Returns:
+            the number of entries deleted
+        """
+        entry_ids = connection.execute(select(Entry.id).where(Entry.user_id == user_id).limit(limit)).scalars().all()
+        if entry_ids:
+            # foreign keys are not enforced on SQLite, so the rows referring to the entries are deleted here
+            connection.execute(entry_tags.delete().where(entry_tags.c.entry_id.in_(entry_ids)))
+            FuzzyIndex.remove_entries(entry_ids, connection)
+            connection.execute(Entry.__table__.delete().where(Entry.id.in_(entry_ids)))
+            for entry_id in entry_ids:
+                ENTRY_CARD_CACHE.delete(entry_id)
+        return len(entry_ids)
+
+    @staticmethod
+    def remove_user(connection, user_id: str) -> None:
+        """
+        Removes the row of a purged user within the connection's transaction. Other processes may serve the user's
+        cached identity until they see the user among the users marked as deleted, so the row is kept as a tombstone
+        without its username, name and password until USER_CACHE_TTL seconds after the deletion, when every cached
+        identity has expired. Tombstones older than that are deleted, and this one is deleted by a background job
+        once it is that old.
+
+        Args:
+            connection: the SQLAlchemy connection to the database
+            user_id: the id of the user
+        """
+        connection.execute(User.__table__.update().where(User.id == user_id)
+                           .values(username=None, name=None, password=None))
+        DiaryUser.remove_tombstones(connection)
+        BACKGROUND_JOBS.submit_later(USER_CACHE_TTL, DiaryUser.remove_tombstones)
+
+    @staticmethod
+    def remove_tombstones(connection=None) -> int:
+        """
+        Deletes the rows kept for purged users whose deletion is more than USER_CACHE_TTL seconds old.
+
+        Args:
+            connection: the SQLAlchemy connection to the database, or None to use a new transaction
+
+        Returns:
+            the number of rows deleted
+        """
+        if connection is None:
+            with db.engine.begin() as connection:
+                return DiaryUser.remove_tombstones(connection)
+
+        expired = datetime.now() - timedelta(seconds=USER_CACHE_TTL)
+        return connection.execute(User.__table__.delete()
+                                  .where(User.username.is_(None), User.deleted_at <= expired)).rowcount
+
+    @staticmethod
+    def purge_user_shard(user_id: str) -> int:
+        """
+        Removes a user marked as deleted whose entries are stored in their own shard, by deleting the shard file and
+        then the user, whose row is kept as a tombstone until every cached identity has expired.
+
+        Args:
+            user_id: the id of the user
+
+        Returns:
+            the number of entries removed
+        """
+        path = ShardRouter.shard_path(user_id)
+        purged = 0
+        if os.path.exists(path):
+            with ShardRouter.engine(user_id).connect() as connection:
+                purged = connection.execute(select(func.count()).select_from(Entry.__table__)).scalar()
+            ShardRouter.drop_shard(user_id)
+        with db.engine.begin() as connection:
+            DiaryUser.remove_user(connection, user_id)
+        # a request that was authenticated before the deletion was seen may have created the shard again
+        if os.path.exists(path):
+            ShardRouter.drop_shard(user_id)
+
+        LATEST_ENTRY_CACHE.delete(user_id)
+        USER_CACHE.delete(user_id)
+        return purged
+
+    @staticmethod
+    def purge_deleted_users(chunk_size: int = PURGE_CHUNK_SIZE) -> list:
+        """
+        Purges every user marked as deleted, such as users whose purge was interrupted by the process exiting.
+
+        Args:
+            chunk_size: the number of entries removed per transaction
+
+        Returns:
+            a list of the ids of the purged users
+        """
+        with db.engine.connect() as connection:
+            user_ids = connection.execute(select(User.id).where(User.deleted_at.isnot(None))).scalars().all()
+        for user_id in user_ids:
+            DiaryUser.purge_user(user_id, chunk_size)
+        return user_ids
+
+    @staticmethod
+    @ReplicaRouter.read_only
+    def load_user(user_id: str, use_session: bool = False) -> Optional[User]:
+        """
+        Reads the user a request is made by. The user's identity is cached for USER_CACHE_TTL seconds, so most
+        requests build the user from the cache instead of querying the database. A cached identity is checked against
+        the ids of the users marked as deleted, which every process reads again every REVOCATION_CHECK_INTERVAL
+        seconds. The user is attached to the session without loading it, so any column left out of the identity, such
+        as the password hash, is still loaded when it is accessed.
+
+        Args:
+            user_id: the id of the user
+            use_session: whether to also keep the identity in the signed session cookie, so the requests of a
+            logged-in browser need no lookup even in a process that has not cached the user
+
+        Returns:
+            the User, or None if there is no user with the id or the user was deleted
+        """
+        identity = session.get(SESSION_IDENTITY_KEY) if use_session else None
+        if identity and identity.get("id") == user_id and user_id in DiaryUser.read_deleted_user_ids():
+            DiaryUser.forget_identity(user_id)
+            return None
+        if not identity or identity.get("id") != user_id or identity.get("expires", 0) <= time.time():
+            identity = USER_CACHE.get(user_id)
+            user = None
+            if identity is not None and user_id in DiaryUser.read_deleted_user_ids():
+                DiaryUser.forget_identity(user_id)
+                return None
+            if identity is None:
+                user = User.query.get(user_id)
+                if user is None or user.deleted_at is not None:
+                    return None
+                identity = {column: getattr(user, column) for column in IDENTITY_COLUMNS}
+                USER_CACHE.set(user_id, identity)
+            if use_session:
+                session[SESSION_IDENTITY_KEY] = {**identity, "expires": time.time() + USER_CACHE_TTL}
+            if user is not None:
+                return user
+
+        user = User(**{column: identity[column] for column in IDENTITY_COLUMNS})
+        make_transient_to_detached(user)
+        # merging without loading reuses the user already in the session, or attaches this one without a SELECT
+        return db.session.merge(user, load=False)
+
+    @staticmethod
+    def read_deleted_user_ids() -> frozenset:
+        """
+        Reads the ids of the users marked as deleted whose accounts have not been removed yet, from the primary
+        database and at most once every REVOCATION_CHECK_INTERVAL seconds.
+
+        Returns:
+            a frozenset of the ids
+        """
+        user_ids = DELETED_USER_IDS_CACHE.get(DELETED_USER_IDS_KEY)
+        if user_ids is None:
+            with db.engine.connect() as connection:
+                user_ids = frozenset(connection.execute(select(User.id).where(User.deleted_at.isnot(None)))
+                                     .scalars())
+            DELETED_USER_IDS_CACHE.set(DELETED_USER_IDS_KEY, user_ids)
+        return user_ids
+
+    @staticmethod
+    def forget_identity(user_id: str) -> None:
+        """
+        Removes a user's cached identity from this process, and from the session of the current request.
+
+        Args:
+            user_id: the id of the user
+        """
+        USER_CACHE.delete(user_id)
+        if has_request_context():
+            session.pop(SESSION_IDENTITY_KEY, None)
+
+
+@event.listens_for(User.__table__, "before_drop")
+def clear_user_cache(target, connection, **kw) -> None:
+    """
+    Forgets every cached user when the Users table is dropped, since user ids may then be reused.
+    """
+    USER_CACHE.clear()
+    DELETED_USER_IDS_CACHE.clear()
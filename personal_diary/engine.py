@@ -0,0 +1,113 @@
+import os
+from typing import Mapping
+
+from sqlalchemy import event
+from sqlalchemy.dialects import plugins
+from sqlalchemy.engine import CreateEnginePlugin, make_url
+from sqlalchemy.pool import QueuePool
+
+"""
+Name the SQLite pragma plugin is registered under with SQLAlchemy
+"""
+SQLITE_PROFILE_PLUGIN = "personal_diary_sqlite_profile"
+
+"""
+Pragmas set on every new SQLite connection. WAL lets readers run alongside the single writer, synchronous=NORMAL
+only syncs at checkpoints instead of at every commit, which is safe in WAL mode, and busy_timeout makes a writer wait
+for the write lock instead of failing with "database is locked". cache_size is in KiB when negative. Each pragma can
+be overridden with an environment variable named DIARY_SQLITE_ followed by the pragma name in upper case.
+"""
+DEFAULT_SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -65536,
+    "mmap_size": 268435456,
+    "busy_timeout": 5000
+}
+
+"""
+Connection pool settings, each of which can be overridden with an environment variable named DIARY_DB_ followed by
+the setting name in upper case
+"""
+DEFAULT_POOL_SETTINGS = {
+    "pool_size": 5,
+    "max_overflow": 10,
+    "pool_timeout": 30,
+    "pool_recycle": 1800
+}
+
+
+class SQLiteProfilePlugin(CreateEnginePlugin):
+    """
+    A SQLAlchemy engine plugin that sets the pragmas given in the sqlite_pragmas engine option on every new
+    connection of the engine.
+    """
+
+    def __init__(self, url, kwargs) -> None:
+        super().__init__(url, kwargs)
+        self.pragmas = kwargs.pop("sqlite_pragmas", DEFAULT_SQLITE_PRAGMAS)
+
+    def engine_created(self, engine) -> None:
+        @event.listens_for(engine, "connect")
+        def set_pragmas(dbapi_connection, connection_record) -> None:
+            cursor = dbapi_connection.cursor()
+            for name, value in self.pragmas.items():
+                cursor.execute(f"PRAGMA {name} = {value}")
+            cursor.close()
+
+
+plugins.register(SQLITE_PROFILE_PLUGIN, __name__, "SQLiteProfilePlugin")
+
+
+class EngineProfile:
+    """
+    A class containing helper functions to build the SQLAlchemy engine options for the database the app is pointed
+    at. SQLite databases get a pool of connections tuned with DEFAULT_SQLITE_PRAGMAS, so several threads and worker
+    processes can share a database file, and PostgreSQL databases get a QueuePool. The database itself can be chosen
+    with the DIARY_DATABASE_URI environment variable.
+    """
+
+    @staticmethod
+    def database_uri(default: str, environ: Mapping[str, str] = os.environ) -> str:
+        """
+        Args:
+            default: the database URI to use when none is set in the environment
+            environ: the environment variables to read
+
+        Returns:
+            the database URI from the DIARY_DATABASE_URI environment variable, or default if it is not set
+        """
+        return environ.get("DIARY_DATABASE_URI") or default
+
+    @staticmethod
+    def engine_options(database_uri: str, environ: Mapping[str, str] = os.environ) -> dict:
+        """
+        Builds the engine options, to be used as SQLALCHEMY_ENGINE_OPTIONS, for a database.
+
+        Args:
+            database_uri: the URI of the database
+            environ: the environment variables to read overrides of the defaults from
+
+        Returns:
+            a dictionary of keyword arguments for sqlalchemy.create_engine
+        """
+        url = make_url(database_uri)
+        pool_settings = {name: int(environ.get(f"DIARY_DB_{name.upper()}", default))
+                         for name, default in DEFAULT_POOL_SETTINGS.items()}
+
+        if url.get_backend_name() == "sqlite":
+            if url.database in (None, "", ":memory:"):
+                # an in-memory database only exists within its one connection, which Flask-SQLAlchemy keeps open
+                return {}
+            pragmas = {name: environ.get(f"DIARY_SQLITE_{name.upper()}", default)
+                       for name, default in DEFAULT_SQLITE_PRAGMAS.items()}
+            return {"plugins": [SQLITE_PROFILE_PLUGIN],
+                    "sqlite_pragmas": pragmas,
+                    "poolclass": QueuePool,
+                    "pool_size": pool_settings["pool_size"],
+                    "max_overflow": pool_settings["max_overflow"],
+                    "pool_timeout": pool_settings["pool_timeout"],
+                    # pooled connections are handed between the threads of a threaded server
+                    "connect_args": {"check_same_thread": False}}
+
+        return {"poolclass": QueuePool, "pool_pre_ping": True, **pool_settings}
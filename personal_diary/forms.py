@@ -1,9 +1,27 @@
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
 from flask_wtf import FlaskForm
 from markupsafe import Markup
 from wtforms import StringField, SubmitField, PasswordField, SearchField, RadioField
-from wtforms.validators import DataRequired, Length, EqualTo, Optional
+from wtforms.validators import DataRequired, Length, EqualTo, Optional, ValidationError
 from flask_ckeditor import CKEditorField
 
+from personal_diary.models import MOODS
+
+"""
+Limits on the contents of an entry, shared by the entry forms and the bulk entry import
+"""
+TITLE_MAX_LENGTH = 80
+BODY_MAX_LENGTH = 300
+TAG_MAX_LENGTH = 20
+MAX_TAGS = 3
+
+"""
+The mood emojis an entry can be given, as (value, label) choices. Each value is the HTML entity of the emoji.
+"""
+MOOD_CHOICES = [(entity, Markup(entity)) for entity in MOODS.values()]
+DEFAULT_MOOD = "&#128528"
+
 
 class CreateEntryForm(FlaskForm):
     """
@@ -11,27 +29,20 @@ class CreateEntryForm(FlaskForm):
     The title may only be at most 80 characters long, and the body may only be 300 characters long.
     """
     title = StringField('Title*',
-                        validators=[DataRequired(), Length(min=1, max=80)],
+                        validators=[DataRequired(), Length(min=1, max=TITLE_MAX_LENGTH)],
                         render_kw={'class': 'col-md-10', 'placeholder': 'Enter title...'}
                         )
     body = CKEditorField('Body*',
-                         validators=[DataRequired(), Length(min=1, max=300)],
+                         validators=[DataRequired(), Length(min=1, max=BODY_MAX_LENGTH)],
                          render_kw={'class': 'col-md-10', 'rows': '10'}
                          )
-    tag1 = StringField("Tag 1", validators=[Optional(), Length(min=1, max=20)],
+    tag1 = StringField("Tag 1", validators=[Optional(), Length(min=1, max=TAG_MAX_LENGTH)],
                        render_kw={'class': 'col-md-1', 'placeholder': 'Tag 1'})
-    tag2 = StringField("Tag 2", validators=[Optional(), Length(min=1, max=20)],
+    tag2 = StringField("Tag 2", validators=[Optional(), Length(min=1, max=TAG_MAX_LENGTH)],
                        render_kw={'class': 'col-md-1', 'placeholder': 'Tag 2'})
-    tag3 = StringField("Tag 3", validators=[Optional(), Length(min=1, max=20)],
+    tag3 = StringField("Tag 3", validators=[Optional(), Length(min=1, max=TAG_MAX_LENGTH)],
                        render_kw={'class': 'col-md-1', 'placeholder': 'Tag 3'})
-    mood = RadioField('Mood', choices=[('&#128528', Markup('&#128528')),
-                                       ('&#128512', Markup('&#128512')),
-                                       ('&#128525', Markup('&#128525')),
-                                       ('&#128541', Markup('&#128541')),
-                                       ('&#128532', Markup('&#128532')),
-                                       ('&#129314', Markup('&#129314')),
-                                       ('&#128552', Markup('&#128552')),
-                                       ('&#128545', Markup('&#128545'))], default="&#128528")
+    mood = RadioField('Mood', choices=MOOD_CHOICES, default=DEFAULT_MOOD)
     submit = SubmitField("Create Entry", render_kw={'class': 'rounded-pill btn btn-dark float-end ml-2'})
 
 
@@ -49,22 +60,15 @@ class UpdateEntryForm(FlaskForm):
     The title may only be at most 80 characters long, and the body may only be 300 characters long.
     """
     title = StringField('Title',
-                        validators=[DataRequired(), Length(min=1, max=80)],
+                        validators=[DataRequired(), Length(min=1, max=TITLE_MAX_LENGTH)],
                         render_kw={'class': 'col-md-10'}
                         )
     body = CKEditorField('Body',
-                         validators=[DataRequired(), Length(min=1, max=300)],
+                         validators=[DataRequired(), Length(min=1, max=BODY_MAX_LENGTH)],
                          render_kw={'class': 'col-md-10', 'rows': '10'}
                          )
 
-    mood = RadioField('Mood', choices=[('&#128528', Markup('&#128528')),
-                                       ('&#128512', Markup('&#128512')),
-                                       ('&#128525', Markup('&#128525')),
-                                       ('&#128541', Markup('&#128541')),
-                                       ('&#128532', Markup('&#128532')),
-                                       ('&#129314', Markup('&#129314')),
-                                       ('&#128552', Markup('&#128552')),
-                                       ('&#128545', Markup('&#128545'))], default="&#128528")
+    mood = RadioField('Mood', choices=MOOD_CHOICES, default=DEFAULT_MOOD)
 
     tag1 = StringField("Tag 1", render_kw={'class': 'col-md-2', 'placeholder': 'Tag 1'})
     tag2 = StringField("Tag 2", render_kw={'class': 'col-md-2', 'placeholder': 'Tag 2'})
@@ -118,3 +122,29 @@ class LoginForm(FlaskForm):
                              render_kw={'class': 'text-start', 'size': "30"}
                              )
     login = SubmitField("Login", render_kw={'class': 'rounded-pill btn btn-dark mt-3 login-btn mx-auto text-center'})
+
+
+class SettingsForm(FlaskForm):
+    """
+    Form used for user to update their profile settings.
+    The user must input their full name (max 30 characters), and may input the IANA name of the timezone their days
+    follow, such as "America/New_York". If no timezone is given, the server's timezone is used.
+    """
+    full_name = StringField('Full Name',
+                            validators=[DataRequired(), Length(min=1, max=30)],
+                            render_kw={'class': 'text-start', 'size': "30"}
+                            )
+    timezone = StringField('Timezone',
+                           validators=[Optional(), Length(max=64)],
+                           render_kw={'class': 'text-start', 'size': "30", 'placeholder': 'e.g. America/New_York'}
+                           )
+    submit = SubmitField("Save", render_kw={'class': 'rounded-pill btn btn-dark mt-3 login-btn mx-auto text-center'})
+
+    def validate_timezone(self, field) -> None:
+        """
+        Verifies that the timezone is a known IANA timezone.
+        """
+        try:
+            ZoneInfo(field.data.strip())
+        except (ZoneInfoNotFoundError, ValueError):
+            raise ValidationError("Unknown timezone")
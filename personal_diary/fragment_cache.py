@@ -0,0 +1,154 @@
+import json
+import threading
+from typing import Any, Callable, Hashable, Optional
+
+from personal_diary.cache import LRUCache
+
+
+class SharedCacheBackend:
+    """
+    A fragment cache backend that stores fragments in a cache server shared by every app process, through a client
+    with the get(key), set(key, value, ex=seconds) and delete(key) methods of a redis.Redis client. Values are
+    stored as JSON strings under prefixed keys.
+    """
+
+    def __init__(self, client: Any, prefix: str = "diary:fragment:", ttl: Optional[int] = None) -> None:
+        """
+        Args:
+            client: the client of the cache server
+            prefix: the prefix of every key stored by this backend
+            ttl: the number of seconds a fragment is kept for, or None to keep it until the server evicts it
+        """
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        value = self.client.get(self.prefix + str(key))
+        return json.loads(value) if value is not None else default
+
+    def set(self, key: Hashable, value: Any) -> None:
+        self.client.set(self.prefix + str(key), json.dumps(value), ex=self.ttl)
+
+    def delete(self, key: Hashable) -> None:
+        self.client.delete(self.prefix + str(key))
+
+
+class LocalCacheClient:
+    """
+    A stand-in for a cache server client that keeps values in a dictionary of this process, for tests and for
+    trying out the shared backend without a cache server. Expiry times are accepted but ignored.
+    """
+
+    def __init__(self) -> None:
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            return self.values.get(key)
+
+    def set(self, key: str, value: str, ex: Optional[int] = None) -> None:
+        with self._lock:
+            self.values[key] = value.encode()
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self.values.pop(key, None)
+
+
+class FragmentCache:
+    """
+    A cache of rendered HTML fragments. Each fragment is stored under a key together with the version of the data it
+    was rendered from, and is only reused while that version is unchanged, so an edit is never served stale even if
+    the fragment was not invalidated. Fragments can also be deleted explicitly when the data they show changes.
+    Fragments are kept in a bounded in-process LRUCache unless another backend is set with use_backend.
+    """
+
+    def __init__(self, max_size: int = 10000) -> None:
+        """
+        Args:
+            max_size: the maximum number of fragments held by the default in-process backend
+        """
+        self.backend = LRUCache(max_size=max_size)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def use_backend(self, backend: Any) -> None:
+        """
+        Replaces the backend fragments are stored in.
+
+        Args:
+            backend: an object with the get(key, default), set(key, value) and delete(key) methods of LRUCache,
+            such as a SharedCacheBackend
+        """
+        self.backend = backend
+        self.clear()
+
+    def get_or_render(self, key: Hashable, version: list, render: Callable[[], str]) -> str:
+        """
+        Returns the cached fragment for a key if it was rendered from the given version, and renders and caches it
+        otherwise.
+
+        Args:
+            key: the key of the fragment
+            version: a JSON serializable list identifying the data the fragment shows
+            render: called to render the fragment on a miss
+
+        Returns:
+            the HTML of the fragment
+        """
+        cached = self.backend.get(key)
+        if cached is not None and cached[0] == version:
+            self.count(hit=True)
+            return cached[1]
+
+        self.count(hit=False)
+        fragment = str(render())
+        self.backend.set(key, [version, fragment])
+        return fragment
+
+    def count(self, hit: bool) -> None:
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def delete(self, key: Hashable) -> None:
+        """
+        Removes the fragment for a key, if it is cached.
+
+        Args:
+            key: the key of the fragment
+        """
+        self.backend.delete(key)
+
+    def clear(self) -> None:
+        """
+        Removes every fragment from the in-process backend, and resets the statistics.
+        """
+        if isinstance(self.backend, LRUCache):
+            self.backend.clear()
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            a dictionary with the number of hits and misses, and the number of cached fragments when they are kept
+            in process
+        """
+        with self._lock:
+            stats = {"hits": self.hits, "misses": self.misses}
+        if isinstance(self.backend, LRUCache):
+            stats["size"] = len(self.backend)
+        return stats
+
+
+"""
+The rendered cards of entries on the home page, keyed by entry id
+"""
+ENTRY_CARD_CACHE = FragmentCache()
@@ -0,0 +1,273 @@
+import re
+from typing import Iterable
+
+from sqlalchemy import and_, bindparam, func, or_, select
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import IntegrityError
+
+from personal_diary import db
+from personal_diary.ids import TimeOrderedIds
+from personal_diary.models import Entry, EntryWord, Tag, WordTrigram, tags as entry_tags
+
+"""
+Matches the words of keywords, titles and tag names, which are compared in lowercase
+"""
+WORD_PATTERN = re.compile(r"[^\W_]+")
+
+"""
+The minimum trigram similarity between a keyword and a word of an entry's title or tags for the entry to match the
+keyword, the same default as PostgreSQL's pg_trgm extension
+"""
+SIMILARITY_THRESHOLD = 0.3
+
+"""
+The number of entries read per query when the word index is rebuilt
+"""
+REBUILD_CHUNK_SIZE = 1000
+
+
+class FuzzyIndex:
+    """
+    A class containing helper functions for the word index used by fuzzy searches, which find entries whose title
+    or tags contain words similar to misspelled keywords. Every word is split into trigrams the way pg_trgm does,
+    after padding it with two spaces before and one after, and the similarity of two words is the number of trigrams
+    they share divided by the number of trigrams in either. The index records the words of every entry, and the
+    trigrams of every word a user has written, so a search compares the keywords with the user's distinct words
+    instead of with their entries. The Diary class replaces an entry's words in the same transaction as every change
+    to its title or tags.
+    """
+
+    @staticmethod
+    def words(text: str) -> list:
+        """
+        Returns:
+            the lowercase words of a string
+        """
+        return WORD_PATTERN.findall(text.lower())
+
+    @staticmethod
+    def trigrams(word: str) -> set:
+        """
+        Returns:
+            the set of trigrams of a lowercase word
+        """
+        padded = "  " + word + " "
+        return {padded[start:start + 3] for start in range(len(padded) - 2)}
+
+    @staticmethod
+    def entry_words(title: str, tag_names: Iterable[str]) -> set:
+        """
+        Returns:
+            the set of the lowercase words in an entry's title and tag names
+        """
+        words = set()
+        for text in (title, *tag_names):
+            words.update(FuzzyIndex.words(text))
+        return words
+
+    @staticmethod
+    def similarity(keyword: str, title: str, tag_names: Iterable[str]) -> float:
+        """
+        Compares a lowercase keyword with an entry the way match_entries does in SQL. A keyword contained in a word
+        of the title or a tag name is similar to it as if it was spelled the same.
+
+        Returns:
+            the highest trigram similarity between the keyword and a word of the entry's title or tag names, between 0
+            and 1
+        """
+        keyword_trigrams = FuzzyIndex.trigrams(keyword)
+        best = 0.0
+        for word in FuzzyIndex.entry_words(title, tag_names):
+            if keyword in word:
+                return 1.0
+            word_trigrams = FuzzyIndex.trigrams(word)
+            best = max(best, len(keyword_trigrams & word_trigrams) / len(keyword_trigrams | word_trigrams))
+        return best
+
+    @staticmethod
+    def index_entries(user_id: str, entries: Iterable[tuple], connection=None, replace: bool = True) -> None:
+        """
+        Stores the words of entries, and the trigrams of the words the user has not written before, within the
+        current transaction. On SQLite the rows are inserted through the driver with every id converted to its stored
+        form once, which is much faster for bulk imports than converting the ids of every row.
+
+        Args:
+            user_id: string representing the id of the user the entries belong to
+            entries: an (entry id, title, list of tag names) tuple for every entry to index
+            connection: the SQLAlchemy connection to the database, or None to use the app's session
+            replace: whether the entries may already have words, which are deleted first. New entries have none.
+        """
+        entries = list(entries)
+        if replace:
+            FuzzyIndex.remove_entries([entry_id for entry_id, _, _ in entries], connection)
+        if connection is None:
+            connection = db.session.connection(bind_arguments={"mapper": EntryWord.__mapper__})
+
+        words_by_entry = [(entry_id, FuzzyIndex.entry_words(title, tag_names))
+                          for entry_id, title, tag_names in entries]
+        vocabulary = set().union(*(words for _, words in words_by_entry))
+        if not vocabulary:
+            return
+        trigram_rows = []
+        for word in sorted(vocabulary):
+            word_trigrams = FuzzyIndex.trigrams(word)
+            trigram_rows.extend((trigram, word, len(word_trigrams)) for trigram in word_trigrams)
+
+        if connection.dialect.name != "sqlite":
+            connection.execute(EntryWord.__table__.insert(), [
+                {"user_id": user_id, "word": word, "entry_id": entry_id}
+                for entry_id, words in words_by_entry for word in words])
+            FuzzyIndex.insert_missing_trigrams(connection, [
+                {"user_id": user_id, "trigram": trigram, "word": word, "trigram_count": trigram_count}
+                for trigram, word, trigram_count in trigram_rows])
+            return
+
+        # ids are stored as the bytes of their UUID when they are one, as IdType stores them
+        stored_user_id = TimeOrderedIds.to_bytes(user_id) or user_id
+        word_rows = []
+        for entry_id, words in words_by_entry:
+            stored_entry_id = TimeOrderedIds.to_bytes(entry_id) or entry_id
+            word_rows.extend((stored_user_id, word, stored_entry_id) for word in words)
+        # inserting in word order keeps the writes to the primary key index local
+        word_rows.sort(key=lambda row: row[1])
+        connection.exec_driver_sql('INSERT INTO "EntryWords" (user_id, word, entry_id) VALUES (?, ?, ?)', word_rows)
+        trigram_rows.sort()
+        connection.exec_driver_sql(
+            'INSERT OR IGNORE INTO "WordTrigrams" (user_id, trigram, word, trigram_count) VALUES (?, ?, ?, ?)',
+            [(stored_user_id, *row) for row in trigram_rows])
+
+    @staticmethod
+    def insert_missing_trigrams(connection, rows: list) -> None:
+        """
+        Inserts the trigram rows of words, skipping the rows of words the user has already written.
+
+        Args:
+            connection: the SQLAlchemy connection to the database
+            rows: the WordTrigrams rows to insert
+        """
+        trigrams = WordTrigram.__table__
+        if connection.dialect.name == "postgresql":
+            connection.execute(postgresql.insert(trigrams).on_conflict_do_nothing(), rows)
+            return
+
+        for row in rows:
+            try:
+                with connection.begin_nested():
+                    connection.execute(trigrams.insert(), row)
+            except IntegrityError:
+                pass
+
+    @staticmethod
+    def remove_entries(entry_ids: list, connection=None) -> None:
+        """
+        Deletes the words of entries within the current transaction. The trigrams of the words are kept, since the
+        user's other entries may still use them.
+
+        Args:
+            entry_ids: the ids of the entries
+            connection: the SQLAlchemy connection to the database, or None to use the app's session
+        """
+        if not entry_ids:
+            return
+        executor = connection if connection is not None else db.session
+        words = EntryWord.__table__
+        executor.execute(words.delete().where(words.c.entry_id == bindparam("removed_entry_id")),
+                         [{"removed_entry_id": entry_id} for entry_id in entry_ids])
+
+    @staticmethod
+    def rebuild(connection=None, chunk_size: int = REBUILD_CHUNK_SIZE) -> int:
+        """
+        Rebuilds the word index from scratch within a single transaction, which also forgets the words no entry
+        uses anymore. Entries are read chunk_size at a time with keyset pagination on their id.
+
+        Args:
+            connection: the SQLAlchemy connection to the database, or None to use a new transaction on the database
+            the app stores entries in
+            chunk_size: the number of entries read per query
+
+        Returns:
+            the number of entries indexed
+        """
+        if connection is None:
+            with db.session.get_bind(Entry.__mapper__).begin() as connection:
+                return FuzzyIndex.rebuild(connection, chunk_size)
+
+        connection.execute(EntryWord.__table__.delete())
+        connection.execute(WordTrigram.__table__.delete())
+        indexed = 0
+        last_id = None
+        while True:
+            query = select(Entry.id, Entry.user_id, Entry.title).order_by(Entry.id).limit(chunk_size)
+            if last_id is not None:
+                query = query.where(Entry.id > last_id)
+            chunk = connection.execute(query).all()
+            if not chunk:
+                return indexed
+
+            tag_names = FuzzyIndex.read_tag_names([row.id for row in chunk], connection)
+            entries_by_user = {}
+            for entry_id, user_id, title in chunk:
+                entries_by_user.setdefault(user_id, []).append((entry_id, title, tag_names.get(entry_id, [])))
+            for user_id, entries in entries_by_user.items():
+                FuzzyIndex.index_entries(user_id, entries, connection, replace=False)
+            indexed += len(chunk)
+            last_id = chunk[-1].id
+
+    @staticmethod
+    def read_tag_names(entry_ids: list, connection=None) -> dict:
+        """
+        Returns:
+            a dictionary mapping the id of each of the entries that has tags to a list of the names of its tags
+        """
+        executor = connection if connection is not None else db.session
+        tag_names = {}
+        rows = executor.execute(select(entry_tags.c.entry_id, Tag.name)
+                                .join(Tag, Tag.id == entry_tags.c.tag_id)
+                                .where(entry_tags.c.entry_id.in_(entry_ids)))
+        for entry_id, tag_name in rows:
+            tag_names.setdefault(entry_id, []).append(tag_name)
+        return tag_names
+
+    @staticmethod
+    def similar_words(user_id: str, keyword: str):
+        """
+        Builds the query for the words a user has written that are similar to a keyword, or contain it. Only the
+        rows of the keyword's trigrams are read, so the query reads the user's words sharing a trigram with the
+        keyword rather than the user's entries.
+
+        Args:
+            user_id: string representing the id of the user the words belong to
+            keyword: a lowercase keyword
+
+        Returns:
+            a select of the similar words
+        """
+        keyword_trigrams = FuzzyIndex.trigrams(keyword)
+        shared = func.count()
+        similarity = shared * 1.0 / (len(keyword_trigrams) + WordTrigram.trigram_count - shared)
+        return (select(WordTrigram.word)
+                .where(WordTrigram.user_id == user_id, WordTrigram.trigram.in_(sorted(keyword_trigrams)))
+                .group_by(WordTrigram.word, WordTrigram.trigram_count)
+                .having(or_(similarity >= SIMILARITY_THRESHOLD, WordTrigram.word.contains(keyword))))
+
+    @staticmethod
+    def match_entries(user_id: str, search_query: str):
+        """
+        Builds the condition matching the entries of a user with a word similar to every keyword of a search query
+        in their title or tags. The condition is evaluated by the database with subqueries on the word index, so the
+        work of a search does not depend on how many of the user's entries share trigrams with the keywords.
+
+        Args:
+            user_id: string representing the id of the user the entries belong to
+            search_query: a string containing the keywords
+
+        Returns:
+            the condition on Entry, or None if the search query has no words
+        """
+        keywords = list(dict.fromkeys(FuzzyIndex.words(search_query)))
+        if not keywords:
+            return None
+        return and_(*[Entry.id.in_(select(EntryWord.entry_id)
+                                   .where(EntryWord.user_id == user_id,
+                                          EntryWord.word.in_(FuzzyIndex.similar_words(user_id, keyword))))
+                      for keyword in keywords])
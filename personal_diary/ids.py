@@ -0,0 +1,63 @@
+import os
+import threading
+import time
+import uuid
+
+
+class TimeOrderedIds:
+    """
+    A class containing helper functions to make the ids of new users and entries. Ids are UUIDv7, as defined by
+    RFC 9562: a 48-bit Unix timestamp in milliseconds, a 12-bit counter and 62 random bits. Ids made later sort after
+    the ids made before them, both as strings and as the bytes they are stored as, so new rows are appended to the end
+    of every index on an id instead of being scattered across it. Ids made by this process within the same
+    millisecond are ordered by the counter.
+    """
+
+    _lock = threading.Lock()
+    _last_millis = 0
+    _counter = 0
+
+    @staticmethod
+    def new() -> str:
+        """
+        Returns:
+            a new id in the canonical string form of a UUID, such as 0190b2f4-7c1e-7a3b-9f21-6d0c4e8a1b2c
+        """
+        return str(TimeOrderedIds.new_uuid())
+
+    @staticmethod
+    def new_uuid() -> uuid.UUID:
+        """
+        Returns:
+            a new UUIDv7
+        """
+        with TimeOrderedIds._lock:
+            millis = time.time_ns() // 1_000_000
+            if millis > TimeOrderedIds._last_millis:
+                TimeOrderedIds._last_millis = millis
+                # starting below half of the counter's range leaves room for the ids of the same millisecond
+                TimeOrderedIds._counter = int.from_bytes(os.urandom(2), "big") & 0x7FF
+            elif TimeOrderedIds._counter < 0xFFF:
+                TimeOrderedIds._counter += 1
+            else:
+                # the counter ran out, so the id takes the next millisecond
+                TimeOrderedIds._last_millis += 1
+                TimeOrderedIds._counter = 0
+            millis, counter = TimeOrderedIds._last_millis, TimeOrderedIds._counter
+
+        random_bits = int.from_bytes(os.urandom(8), "big") & ((1 << 62) - 1)
+        return uuid.UUID(int=(millis << 80) | (0x7 << 76) | (counter << 64) | (0b10 << 62) | random_bits)
+
+    @staticmethod
+    def to_bytes(value: str):
+        """
+        Returns:
+            the 16 bytes of the UUID a string holds in canonical form, or None if the string is not a canonical UUID
+        """
+        if not isinstance(value, str) or len(value) != 36:
+            return None
+        try:
+            parsed = uuid.UUID(value)
+        except ValueError:
+            return None
+        return parsed.bytes if str(parsed) == value else None
@@ -0,0 +1,245 @@
+import bisect
+import threading
+import time
+from typing import Iterable, Optional
+
+from flask import Flask, Response, before_render_template, g, has_request_context, request, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from personal_diary.diary import LATEST_ENTRY_CACHE, TAG_ID_CACHE
+from personal_diary.diary_user import USER_CACHE
+from personal_diary.fragment_cache import ENTRY_CARD_CACHE
+
+"""
+Upper bounds in seconds of the histogram buckets for request, SQL and template render durations
+"""
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+"""
+Upper bounds of the histogram buckets for the number of SQL statements run by a request
+"""
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class Histogram:
+    """
+    A thread-safe Prometheus histogram with one series per route and method. Each series counts the observations
+    falling into every bucket, along with their total count and sum.
+    """
+
+    def __init__(self, name: str, description: str, buckets: Iterable[float]) -> None:
+        """
+        Args:
+            name: the metric name the histogram is exposed under
+            description: the help text of the metric
+            buckets: the upper bounds of the buckets, in increasing order
+        """
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels: tuple, value: float) -> None:
+        """
+        Records an observation.
+
+        Args:
+            labels: the (route, method) the observation belongs to
+            value: the observed value
+        """
+        with self._lock:
+            series = self._series.setdefault(labels, [[0] * len(self.buckets), 0, 0.0])
+            bucket = bisect.bisect_left(self.buckets, value)
+            if bucket < len(self.buckets):
+                series[0][bucket] += 1
+            series[1] += 1
+            series[2] += value
+
+    def clear(self) -> None:
+        """
+        Removes every recorded observation.
+        """
+        with self._lock:
+            self._series.clear()
+
+    def render(self) -> list:
+        """
+        Returns:
+            the lines of the histogram in the Prometheus text exposition format
+        """
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for (route, method), (bucket_counts, count, total) in sorted(self._series.items()):
+                labels = f'route="{escape_label(route)}",method="{method}"'
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, bucket_counts):
+                    cumulative += bucket_count
+                    lines.append(f'{self.name}_bucket{{{labels},le="{bound:g}"}} {cumulative}')
+                lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {count}')
+                lines.append(f"{self.name}_sum{{{labels}}} {total:g}")
+                lines.append(f"{self.name}_count{{{labels}}} {count}")
+        return lines
+
+
+def escape_label(value: str) -> str:
+    """
+    Escapes a Prometheus label value.
+    """
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+REQUEST_DURATION = Histogram("diary_request_duration_seconds", "Total time spent handling a request.",
+                             DURATION_BUCKETS)
+SQL_DURATION = Histogram("diary_request_sql_duration_seconds", "Time spent running SQL statements in a request.",
+                         DURATION_BUCKETS)
+TEMPLATE_DURATION = Histogram("diary_request_template_duration_seconds",
+                              "Time spent rendering templates in a request.", DURATION_BUCKETS)
+SQL_STATEMENTS = Histogram("diary_request_sql_statements", "Number of SQL statements run by a request.",
+                           STATEMENT_BUCKETS)
+METRICS = [REQUEST_DURATION, SQL_DURATION, TEMPLATE_DURATION, SQL_STATEMENTS]
+
+"""
+The caches whose hit and miss counts are served from /metrics, by name
+"""
+CACHES = {
+    "entry_card": ENTRY_CARD_CACHE,
+    "latest_entry": LATEST_ENTRY_CACHE,
+    "tag_id": TAG_ID_CACHE,
+    "user": USER_CACHE
+}
+
+
+def render_cache_stats() -> list:
+    """
+    Returns:
+        the lines of the hit and miss counters of every cache in CACHES in the Prometheus text exposition format
+    """
+    lines = []
+    for stat in ("hits", "misses"):
+        name = f"diary_cache_{stat}_total"
+        lines += [f"# HELP {name} Number of cache lookups that were {stat}.", f"# TYPE {name} counter"]
+        lines += [f'{name}{{cache="{cache_name}"}} {cache.stats()[stat]}' for cache_name, cache in CACHES.items()]
+    return lines
+
+
+class RequestTimings:
+    """
+    The SQL statement count and time spent so far by the request being handled.
+    """
+
+    def __init__(self) -> None:
+        self.start = time.perf_counter()
+        self.sql_statements = 0
+        self.sql_time = 0.0
+        self.template_time = 0.0
+        self.template_start = None
+
+
+class Instrumentation:
+    """
+    A class containing helper functions to measure where the time of each request goes. When enabled on an app,
+    every request records its SQL statement count, SQL time, template render time and total latency per route.
+    The timings of a request are sent back in its Server-Timing header, and the histograms of every request so far
+    are served from /metrics in the Prometheus text format. Nothing is hooked until init_app is called, so an app
+    that does not enable instrumentation pays nothing for it.
+    """
+
+    sql_events_registered = False
+
+    @staticmethod
+    def init_app(app: Flask) -> None:
+        """
+        Enables instrumentation on an app.
+
+        Args:
+            app: the Flask app to instrument
+        """
+        if not Instrumentation.sql_events_registered:
+            # engines are created lazily per database URI, so every engine is hooked through the Engine class
+            event.listen(Engine, "before_cursor_execute", Instrumentation.before_cursor_execute)
+            event.listen(Engine, "after_cursor_execute", Instrumentation.after_cursor_execute)
+            Instrumentation.sql_events_registered = True
+
+        app.before_request(Instrumentation.before_request)
+        app.after_request(Instrumentation.after_request)
+        before_render_template.connect(Instrumentation.before_render_template, app)
+        template_rendered.connect(Instrumentation.template_rendered, app)
+        app.add_url_rule("/metrics", "metrics", Instrumentation.metrics)
+
+    @staticmethod
+    def before_request() -> None:
+        g.request_timings = RequestTimings()
+
+    @staticmethod
+    def after_request(response: Response) -> Response:
+        timings = g.pop("request_timings", None)
+        if timings is None or request.endpoint == "metrics":
+            return response
+
+        total_time = time.perf_counter() - timings.start
+        labels = (request.url_rule.rule if request.url_rule else "unmatched", request.method)
+        REQUEST_DURATION.observe(labels, total_time)
+        SQL_DURATION.observe(labels, timings.sql_time)
+        TEMPLATE_DURATION.observe(labels, timings.template_time)
+        SQL_STATEMENTS.observe(labels, timings.sql_statements)
+
+        response.headers.add("Server-Timing", f'sql;desc="{timings.sql_statements} statements";'
+                                              f'dur={timings.sql_time * 1000:.2f}, '
+                                              f'template;dur={timings.template_time * 1000:.2f}, '
+                                              f'total;dur={total_time * 1000:.2f}')
+        return response
+
+    @staticmethod
+    def current_timings() -> Optional[RequestTimings]:
+        """
+        Returns:
+            the timings of the request being handled, or None outside of an instrumented request
+        """
+        return g.get("request_timings") if has_request_context() else None
+
+    @staticmethod
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+        conn.info["query_start"] = time.perf_counter()
+
+    @staticmethod
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+        start = conn.info.pop("query_start", None)
+        timings = Instrumentation.current_timings()
+        if timings is not None and start is not None:
+            elapsed = time.perf_counter() - start
+            timings.sql_statements += 1
+            timings.sql_time += elapsed
+
+    @staticmethod
+    def before_render_template(sender, template, context, **extra) -> None:
+        timings = Instrumentation.current_timings()
+        if timings is not None:
+            timings.template_start = time.perf_counter()
+
+    @staticmethod
+    def template_rendered(sender, template, context, **extra) -> None:
+        timings = Instrumentation.current_timings()
+        if timings is not None and timings.template_start is not None:
+            timings.template_time += time.perf_counter() - timings.template_start
+            timings.template_start = None
+
+    @staticmethod
+    def metrics() -> Response:
+        """
+        Serves the histograms of every instrumented request so far, and the hit and miss counts of the caches.
+
+        Returns:
+            response: the histograms in the Prometheus text exposition format
+        """
+        lines = [line for metric in METRICS for line in metric.render()] + render_cache_stats()
+        return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
+
+    @staticmethod
+    def reset() -> None:
+        """
+        Removes every recorded observation.
+        """
+        for metric in METRICS:
+            metric.clear()
@@ -0,0 +1,85 @@
+import queue
+import threading
+from typing import Callable
+
+from flask import current_app
+
+
+class BackgroundJobs:
+    """
+    Runs jobs one at a time on a daemon thread of this process, so a request can respond before slow work it started,
+    such as removing a deleted account, has finished. Each job runs within an app context of the app it was submitted
+    from. Jobs are only kept in memory, so jobs that have not finished when the process exits are lost, and the work
+    they do must be safe to start again.
+    """
+
+    def __init__(self) -> None:
+        self.jobs = queue.Queue()
+        self.thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, job: Callable, *args) -> None:
+        """
+        Queues a job, starting the worker thread if it is not running. Must be called within an app context.
+
+        Args:
+            job: the function to run
+            args: the arguments to call the function with
+        """
+        self.enqueue(current_app._get_current_object(), job, args)
+
+    def submit_later(self, delay: float, job: Callable, *args) -> None:
+        """
+        Queues a job once a number of seconds have passed, without holding up the jobs queued in the meantime. Must be
+        called within an app context.
+
+        Args:
+            delay: the number of seconds to wait before queuing the job
+            job: the function to run
+            args: the arguments to call the function with
+        """
+        timer = threading.Timer(delay, self.enqueue, (current_app._get_current_object(), job, args))
+        timer.daemon = True
+        timer.start()
+
+    def enqueue(self, app, job: Callable, args: tuple) -> None:
+        """
+        Queues a job to run within an app context of the given app, starting the worker thread if it is not running.
+
+        Args:
+            app: the Flask app the job runs within
+            job: the function to run
+            args: the arguments to call the function with
+        """
+        self.jobs.put((app, job, args))
+        with self._lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name="diary-background-jobs", daemon=True)
+                self.thread.start()
+
+    def run(self) -> None:
+        """
+        Runs queued jobs until the process exits. A job that raises is logged and does not stop the jobs after it.
+        """
+        while True:
+            app, job, args = self.jobs.get()
+            try:
+                with app.app_context():
+                    job(*args)
+            except Exception:
+                app.logger.exception("Background job %s failed", getattr(job, "__name__", job))
+            finally:
+                self.jobs.task_done()
+
+    def join(self) -> None:
+        """
+        Waits until every queued job has finished. Jobs submitted to run later are only waited for once they are
+        queued.
+        """
+        self.jobs.join()
+
+
+"""
+The background jobs of this process
+"""
+BACKGROUND_JOBS = BackgroundJobs()
@@ -0,0 +1,247 @@
+from sqlalchemy import MetaData, event, inspect, text
+from sqlalchemy.schema import CreateTable
+
+from personal_diary import db
+from personal_diary.diary import Diary
+from personal_diary.forms import DEFAULT_MOOD
+from personal_diary.fuzzy_index import FuzzyIndex
+from personal_diary.ids import TimeOrderedIds
+from personal_diary.models import Entry, EntryWord, Mood, MoodRollup, MOOD_CODES, Tag, TagUsage, User, WordTrigram, \
+    tags
+from personal_diary.mood_rollups import MoodRollups
+from personal_diary.search_index import SearchIndex
+
+
+def create_search_index(connection) -> None:
+    """
+    Creates the full-text search index and indexes every existing entry.
+    """
+    SearchIndex.rebuild(connection)
+
+
+def add_query_indexes(connection) -> None:
+    """
+    Adds the indexes used by the home page queries and tag lookups. Tags sharing a name are merged into the tag
+    with the lowest id first, since tag names become unique.
+    """
+    connection.execute(text("""
+        UPDATE OR IGNORE tags
+        SET tag_id = (SELECT MIN(duplicate.id) FROM EntryTags AS duplicate, EntryTags AS tag
+                      WHERE tag.id = tags.tag_id AND duplicate.name = tag.name)
+        WHERE tag_id NOT IN (SELECT MIN(id) FROM EntryTags GROUP BY name)
+    """))
+    # entries that were already tagged with the kept tag still reference a duplicate, which can be dropped
+    connection.execute(text("DELETE FROM tags WHERE tag_id NOT IN (SELECT MIN(id) FROM EntryTags GROUP BY name)"))
+    connection.execute(text("DELETE FROM EntryTags WHERE id NOT IN (SELECT MIN(id) FROM EntryTags GROUP BY name)"))
+
+    for table in (Entry.__table__, Tag.__table__, tags):
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+
+def add_user_timezone(connection) -> None:
+    """
+    Adds the column holding the timezone each user's days follow.
+    """
+    columns = {column["name"] for column in inspect(connection).get_columns("Users")}
+    if "timezone" not in columns:
+        connection.execute(text('ALTER TABLE "Users" ADD COLUMN timezone VARCHAR(64)'))
+
+
+def add_tag_usage(connection) -> None:
+    """
+    Adds the table of per-user tag counts and fills it from the existing entries.
+    """
+    TagUsage.__table__.create(connection, checkfirst=True)
+    Diary.rebuild_tag_usage(connection)
+
+
+def add_mood_rollups(connection) -> None:
+    """
+    Adds the table of per-user mood counts per day, week and month and fills it from the existing entries.
+    """
+    MoodRollup.__table__.create(connection, checkfirst=True)
+    MoodRollups.rebuild(connection)
+
+
+def normalize_moods(connection) -> None:
+    """
+    Stores the mood of every entry as its small integer code from the Moods table instead of the HTML entity of its
+    emoji, and adds the index used to filter entries by mood. SQLite cannot change the type of a column, so
+    DiaryEntries is copied to a new table with the same rowids, which keeps the full-text search index valid.
+    Moods that are not in the Moods table are stored as the default mood. The mood rollups are rebuilt with codes.
+    """
+    Mood.__table__.create(connection, checkfirst=True)
+
+    # the copy references the same tables as DiaryEntries, so its foreign keys can be compiled
+    metadata = MetaData()
+    for table in (User.__table__, Mood.__table__):
+        table.to_metadata(metadata)
+    new_entries = Entry.__table__.to_metadata(metadata, name="DiaryEntries_new")
+    connection.execute(CreateTable(new_entries))
+    connection.execute(text("""
+        INSERT INTO DiaryEntries_new (rowid, id, title, body, created, modified, user_id, mood)
+        SELECT rowid, id, title, body, created, modified, user_id,
+               COALESCE((SELECT code FROM Moods WHERE entity = DiaryEntries.mood), :default_code)
+        FROM DiaryEntries
+    """), {"default_code": MOOD_CODES[DEFAULT_MOOD]})
+    connection.execute(text("DROP TABLE DiaryEntries"))
+    connection.execute(text("ALTER TABLE DiaryEntries_new RENAME TO DiaryEntries"))
+    for index in Entry.__table__.indexes:
+        index.create(connection)
+    SearchIndex.create(connection)
+
+    MoodRollup.__table__.drop(connection, checkfirst=True)
+    MoodRollup.__table__.create(connection)
+    MoodRollups.rebuild(connection)
+
+
+def add_user_deleted_at(connection) -> None:
+    """
+    Adds the column marking users whose account was deleted but not yet removed.
+    """
+    columns = {column["name"] for column in inspect(connection).get_columns("Users")}
+    if "deleted_at" not in columns:
+        connection.execute(text('ALTER TABLE "Users" ADD COLUMN deleted_at DATETIME'))
+
+
+"""
+Every column holding the id of a user or an entry, as (table, column) tuples
+"""
+ID_COLUMNS = [
+    ("Users", "id"),
+    ("DiaryEntries", "id"),
+    ("DiaryEntries", "user_id"),
+    ("tags", "entry_id"),
+    ("TagUsage", "user_id"),
+    ("MoodRollups", "user_id")
+]
+
+
+def compact_ids(connection) -> None:
+    """
+    Stores every id that is a UUID in canonical string form as its 16 bytes, as new ids are stored. SQLite keeps a
+    blob in a column declared as text, so the tables are updated in place and the ids read back unchanged. Ids that
+    are not UUIDs are left as text.
+    """
+    for table, column in ID_COLUMNS:
+        rows = connection.execute(text(f'SELECT DISTINCT "{column}" FROM "{table}" '
+                                       f'WHERE typeof("{column}") = \'text\' AND length("{column}") = 36'))
+        changes = [{"old": old, "new": TimeOrderedIds.to_bytes(old)} for (old,) in rows]
+        changes = [change for change in changes if change["new"] is not None]
+        if changes:
+            connection.execute(text(f'UPDATE "{table}" SET "{column}" = :new WHERE "{column}" = :old'), changes)
+
+
+def add_fuzzy_index(connection) -> None:
+    """
+    Created a trigram index over the titles and tags of entries, which index_fuzzy_words replaced. The index is
+    built by index_fuzzy_words instead.
+    """
+
+
+def index_fuzzy_words(connection) -> None:
+    """
+    Replaces the trigram index of every entry used by fuzzy searches with the index of the words of every entry and
+    the trigrams of every user's words, and indexes the title and tags of every existing entry.
+    """
+    connection.execute(text('DROP TABLE IF EXISTS "EntryTrigrams"'))
+    EntryWord.__table__.create(connection, checkfirst=True)
+    WordTrigram.__table__.create(connection, checkfirst=True)
+    FuzzyIndex.rebuild(connection)
+
+
+"""
+Every migration in the order it is applied. A database's schema version is the number of migrations applied to it,
+so new migrations must only ever be appended.
+"""
+MIGRATIONS = [
+    create_search_index,
+    add_query_indexes,
+    add_user_timezone,
+    add_tag_usage,
+    add_mood_rollups,
+    normalize_moods,
+    add_user_deleted_at,
+    compact_ids,
+    add_fuzzy_index,
+    index_fuzzy_words
+]
+
+
+class UnsupportedDatabaseError(Exception):
+    """
+    Raised when a database cannot be upgraded by Migrations, since only SQLite databases are.
+    """
+
+
+class Migrations:
+    """
+    A class containing helper functions to upgrade an existing SQLite database in place to the schema declared in
+    models.py. The schema version is kept in SQLite's user_version pragma. Databases created from scratch already
+    have the latest schema and are stamped with the latest version.
+    """
+
+    @staticmethod
+    def schema_version(connection) -> int:
+        """
+        Reads the schema version of a database.
+
+        Args:
+            connection: the SQLAlchemy connection to the database
+
+        Returns:
+            the number of migrations that have been applied to the database
+        """
+        return connection.execute(text("PRAGMA user_version")).scalar()
+
+    @staticmethod
+    def stamp(connection, version: int = len(MIGRATIONS)) -> None:
+        """
+        Sets the schema version of a database without applying any migrations.
+
+        Args:
+            connection: the SQLAlchemy connection to the database
+            version: the schema version to set
+        """
+        connection.execute(text(f"PRAGMA user_version = {int(version)}"))
+
+    @staticmethod
+    def upgrade(connection=None) -> list:
+        """
+        Applies every migration the database has not had yet, in order, within a single transaction.
+
+        Args:
+            connection: the SQLAlchemy connection to the database, or None to use a new transaction on the app's
+            database
+
+        Returns:
+            a list of the names of the migrations that were applied
+
+        Raises:
+            UnsupportedDatabaseError: if the database is not a SQLite database
+        """
+        if connection is None:
+            with db.engine.begin() as connection:
+                return Migrations.upgrade(connection)
+
+        if connection.dialect.name != "sqlite":
+            raise UnsupportedDatabaseError(
+                f"Schema migrations are only supported for SQLite databases, not {connection.dialect.name}")
+
+        applied = []
+        version = Migrations.schema_version(connection)
+        for migration in MIGRATIONS[version:]:
+            migration(connection)
+            applied.append(migration.__name__)
+        Migrations.stamp(connection)
+        return applied
+
+
+@event.listens_for(Entry.__table__, "after_create")
+def stamp_new_database(target, connection, **kw) -> None:
+    """
+    Marks a newly created database as having the latest schema version.
+    """
+    if connection.dialect.name == "sqlite":
+        Migrations.stamp(connection)
@@ -1,15 +1,126 @@
+import uuid
+
 from personal_diary import db
+from personal_diary.ids import TimeOrderedIds
 from flask_login import UserMixin
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql
+
+"""
+Maps the code each mood is stored as to the HTML entity of its emoji, in the order the moods are offered. Codes are
+stored in the database, so an existing code must never be changed or reused.
+"""
+MOODS = {
+    1: '&#128528',
+    2: '&#128512',
+    3: '&#128525',
+    4: '&#128541',
+    5: '&#128532',
+    6: '&#129314',
+    7: '&#128552',
+    8: '&#128545'
+}
+MOOD_CODES = {entity: code for code, entity in MOODS.items()}
+
+
+class IdType(db.TypeDecorator):
+    """
+    Stores an id that is a UUID in canonical string form as its 16 bytes, or as a native UUID on PostgreSQL, while
+    the application reads and writes the string. Other strings, such as ids made before ids were UUIDs, are stored
+    unchanged on SQLite, and never match a stored id on PostgreSQL.
+    """
+
+    impl = db.LargeBinary(16)
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == "postgresql":
+            return dialect.type_descriptor(postgresql.UUID())
+        return dialect.type_descriptor(self.impl)
+
+    def bind_processor(self, dialect):
+        postgres = dialect.name == "postgresql"
+
+        def process(value):
+            if value is None:
+                return None
+            value = str(value)
+            compact = TimeOrderedIds.to_bytes(value)
+            if postgres:
+                return value if compact is not None else None
+            return compact if compact is not None else value
+        return process
+
+    def literal_processor(self, dialect):
+        def process(value):
+            value = str(value)
+            compact = TimeOrderedIds.to_bytes(value)
+            if compact is not None and dialect.name != "postgresql":
+                return f"X'{compact.hex()}'"
+            return "'" + value.replace("'", "''") + "'"
+        return process
+
+    def result_processor(self, dialect, coltype):
+        def process(value):
+            if isinstance(value, (bytes, memoryview)):
+                return str(uuid.UUID(bytes=bytes(value)))
+            return value if value is None else str(value)
+        return process
 
 """
 Association table for entries and tags, as described by Flask-SQLAlchemy documentation
 """
 tags = db.Table('tags',
                 db.Column('tag_id', db.Integer, db.ForeignKey('EntryTags.id'), primary_key=True),
-                db.Column('entry_id', db.String, db.ForeignKey('DiaryEntries.id'), primary_key=True)
+                db.Column('entry_id', IdType, db.ForeignKey('DiaryEntries.id'), primary_key=True),
+                db.Index('ix_tags_entry_id', 'entry_id')
                 )
 
 
+class MoodType(db.TypeDecorator):
+    """
+    Stores a mood as its small integer code from MOODS, while the application reads and writes the HTML entity of
+    the mood's emoji. Values stored before moods were normalized are read back unchanged.
+    """
+
+    impl = db.SmallInteger
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        try:
+            return MOOD_CODES[value]
+        except KeyError:
+            raise ValueError(f"Unknown mood {value!r}")
+
+    def process_result_value(self, value, dialect):
+        return MOODS.get(value, value)
+
+
+class Mood(db.Model):
+    """
+    Defines the lookup table of moods, holding the code and HTML entity of every mood in MOODS, so the stored codes
+    can be read from SQL alone. The table is filled when it is created.
+
+    Inherits:
+        db.Model: base class from SQLAlchemy to define a model
+    """
+
+    __tablename__ = 'Moods'
+
+    code = db.Column(db.SmallInteger, primary_key=True, autoincrement=False)
+    entity = db.Column(db.String(16), unique=True, nullable=False)
+
+
+@event.listens_for(Mood.__table__, "after_create")
+def fill_moods(target, connection, **kw) -> None:
+    """
+    Adds every mood in MOODS to the newly created Moods table.
+    """
+    connection.execute(target.insert(), [{"code": code, "entity": entity} for code, entity in MOODS.items()])
+
+
 class Tag(db.Model):
     """
     Defines the data model for diary entry tags. Tags can contain an id and name.
@@ -21,7 +132,87 @@ class Tag(db.Model):
     __tablename__ = 'EntryTags'
 
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String)
+    name = db.Column(db.String, unique=True, index=True)
+
+
+class TagUsage(db.Model):
+    """
+    Defines the data model for how often each user has used each tag. A row holds the number of the user's entries
+    the tag is attached to and the latest created datetime of those entries. Rows are kept up to date whenever
+    entries are created, updated or deleted, so a user's tags can be listed without reading their entries.
+
+    Inherits:
+        db.Model: base class from SQLAlchemy to define a model
+    """
+
+    __tablename__ = 'TagUsage'
+    __table_args__ = (
+        # the tag sidebar lists a user's most used tags first
+        db.Index('ix_TagUsage_user_id_entry_count', 'user_id', 'entry_count'),
+    )
+
+    user_id = db.Column(IdType, db.ForeignKey('Users.id'), primary_key=True)
+    tag_id = db.Column(db.Integer, db.ForeignKey('EntryTags.id'), primary_key=True)
+    entry_count = db.Column(db.Integer, nullable=False)
+    last_used = db.Column(db.DateTime, nullable=True)
+
+
+class MoodRollup(db.Model):
+    """
+    Defines the data model for how often a user chose each mood over a period. A row holds the number of the user's
+    entries with a mood created within the day, week or month starting on period_start. Rows are kept up to date
+    whenever entries are created, updated or deleted, so mood trends can be charted without reading the entries.
+
+    Inherits:
+        db.Model: base class from SQLAlchemy to define a model
+    """
+
+    __tablename__ = 'MoodRollups'
+
+    user_id = db.Column(IdType, db.ForeignKey('Users.id'), primary_key=True)
+    period = db.Column(db.String(5), primary_key=True)
+    period_start = db.Column(db.Date, primary_key=True)
+    mood = db.Column(MoodType, db.ForeignKey('Moods.code'), primary_key=True)
+    entry_count = db.Column(db.Integer, nullable=False)
+
+
+class EntryWord(db.Model):
+    """
+    Defines the data model for the word index used by fuzzy searches. A row records that a word is in the title or
+    tag names of a user's entry. Rows are replaced whenever an entry's title or tags change.
+
+    Inherits:
+        db.Model: base class from SQLAlchemy to define a model
+    """
+
+    __tablename__ = 'EntryWords'
+    __table_args__ = (
+        # an entry's rows are replaced whenever its title or tags change
+        db.Index('ix_EntryWords_entry_id', 'entry_id'),
+    )
+
+    user_id = db.Column(IdType, db.ForeignKey('Users.id'), primary_key=True)
+    word = db.Column(db.String, primary_key=True)
+    entry_id = db.Column(IdType, db.ForeignKey('DiaryEntries.id'), primary_key=True)
+
+
+class WordTrigram(db.Model):
+    """
+    Defines the data model for the trigrams of the words a user has written in entry titles and tag names, used by
+    fuzzy searches to find the words similar to a keyword without reading the user's entries. A row records that a
+    word contains a trigram, together with the number of distinct trigrams in the word. Words are added as entries
+    are written and are kept after the entries using them change, until the index is rebuilt or the user is purged.
+
+    Inherits:
+        db.Model: base class from SQLAlchemy to define a model
+    """
+
+    __tablename__ = 'WordTrigrams'
+
+    user_id = db.Column(IdType, db.ForeignKey('Users.id'), primary_key=True)
+    trigram = db.Column(db.String(3), primary_key=True)
+    word = db.Column(db.String, primary_key=True)
+    trigram_count = db.Column(db.Integer, nullable=False)
 
 
 class Entry(UserMixin, db.Model):
@@ -35,20 +226,29 @@ class Entry(UserMixin, db.Model):
     """
 
     __tablename__ = 'DiaryEntries'
+    __table_args__ = (
+        # the home page filters by user and keyset paginates on (sort date, id)
+        db.Index('ix_DiaryEntries_user_id_created', 'user_id', 'created', 'id'),
+        db.Index('ix_DiaryEntries_user_id_modified', 'user_id', 'modified', 'id'),
+        # filtering the home page by mood keeps the created order of the index
+        db.Index('ix_DiaryEntries_user_id_mood_created', 'user_id', 'mood', 'created', 'id'),
+    )
 
-    id = db.Column(db.String(), primary_key=True)
+    id = db.Column(IdType, primary_key=True)
     title = db.Column(db.String(), unique=False, nullable=False)
     body = db.Column(db.Text, unique=False, nullable=False)
     created = db.Column(db.DateTime, unique=False, nullable=False)
     modified = db.Column(db.DateTime, unique=False, nullable=True)
-    tags = db.relationship('Tag', secondary=tags, lazy='subquery', backref=db.backref('entries', lazy=True))
-    user_id = db.Column(db.String(), db.ForeignKey('Users.id'), nullable=False)
-    mood = db.Column(db.Text, unique=False, nullable=False)
+    tags = db.relationship('Tag', secondary=tags, lazy='select', backref=db.backref('entries', lazy=True))
+    user_id = db.Column(IdType, db.ForeignKey('Users.id'), nullable=False)
+    mood = db.Column(MoodType, db.ForeignKey('Moods.code'), unique=False, nullable=False)
 
 
 class User(UserMixin, db.Model):
     """
-    Defines the data model for users. Users can contain an id, username, name, password, and associated entries.
+    Defines the data model for users. Users can contain an id, username, name, password, timezone, and associated
+    entries. The timezone is the name of the IANA timezone the user's days follow, or None for the server's timezone.
+    deleted_at is set when the user deletes their account, until the account and its entries are removed.
 
     Inherits:
         UserMixin: base class from Flask to be able to check whether the user matches the logged-in user
@@ -57,8 +257,10 @@ class User(UserMixin, db.Model):
 
     __tablename__ = 'Users'
 
-    id = db.Column(db.String(), primary_key=True)
+    id = db.Column(IdType, primary_key=True)
     username = db.Column(db.String(15), unique=True)
     name = db.Column(db.String(30))
     password = db.Column(db.String(15))
+    timezone = db.Column(db.String(64), nullable=True)
+    deleted_at = db.Column(db.DateTime, nullable=True)
     entries = db.relationship('Entry', backref='Users', lazy=True, cascade="all, delete-orphan")
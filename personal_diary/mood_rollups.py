@@ -0,0 +1,256 @@
+from collections import Counter
+from datetime import date, datetime, timedelta
+from typing import Iterable, Optional
+
+from sqlalchemy import bindparam, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from personal_diary import db
+from personal_diary.models import Entry, MoodRollup
+from personal_diary.replicas import ReplicaRouter
+
+"""
+The periods moods are counted over. Weeks start on Monday and months on their first day.
+"""
+PERIODS = ("day", "week", "month")
+
+"""
+Maps each bucket a mood series can be returned in to the period of the rollups it is added up from. Quarters and
+years are added up from the monthly rollups.
+"""
+BUCKETS = {
+    "day": "day",
+    "week": "week",
+    "month": "month",
+    "quarter": "month",
+    "year": "month"
+}
+
+"""
+The maximum number of buckets in a mood series. Series over longer ranges are returned in coarser buckets.
+"""
+MAX_SERIES_POINTS = 366
+
+"""
+The number of entries read per query when the rollups are rebuilt
+"""
+REBUILD_CHUNK_SIZE = 1000
+
+
+class MoodRollups:
+    """
+    A class containing helper functions for the MoodRollups table, which counts the moods of each user's entries per
+    day, week and month. The Diary class adjusts the counts in the same transaction as every change to an entry's mood
+    or created datetime, so a mood series over years of entries reads a few hundred rollup rows at most.
+    Entries are counted in the day of their created datetime as stored, which is the server's local time.
+    """
+
+    @staticmethod
+    def period_starts(created: datetime) -> dict:
+        """
+        Returns:
+            a dictionary mapping each of PERIODS to the first day of the period of that length the datetime is in
+        """
+        day = created.date()
+        return {"day": day, "week": day - timedelta(days=day.weekday()), "month": day.replace(day=1)}
+
+    @staticmethod
+    def change(user_id: str, added: Iterable[tuple] = (), removed: Iterable[tuple] = (), connection=None) -> None:
+        """
+        Updates a user's mood counts within the current transaction, after entries were created, deleted or had their
+        mood changed. Counts that drop to zero are deleted.
+
+        Args:
+            user_id: string representing the id of the user the entries belong to
+            added: a (mood, created datetime) tuple for every entry that was created or given a new mood
+            removed: a (mood, created datetime) tuple for every entry that was deleted or had its mood changed, with
+            the mood it had before
+            connection: the SQLAlchemy connection to the database, or None to use the app's session
+        """
+        counts = Counter()
+        for sign, moods in ((1, added), (-1, removed)):
+            for mood, created in moods:
+                for period, period_start in MoodRollups.period_starts(created).items():
+                    counts[(user_id, period, period_start, mood)] += sign
+        MoodRollups.add_counts(counts, connection)
+
+    @staticmethod
+    def add_counts(counts: Counter, connection=None) -> None:
+        """
+        Adds to the counts of the MoodRollups table with one statement, creating the rows that do not exist yet.
+        Rows whose count drops to zero or below are deleted.
+
+        Args:
+            counts: a Counter mapping (user id, period, period start, mood) tuples to the number to add, which is
+            negative for removed entries
+            connection: the SQLAlchemy connection to the database, or None to use the app's session
+        """
+        rows = [{"user_id": user_id, "period": period, "period_start": period_start, "mood": mood,
+                 "entry_count": count}
+                for (user_id, period, period_start, mood), count in counts.items() if count]
+        if not rows:
+            return
+
+        executor = connection if connection is not None else db.session
+        dialect = connection.dialect.name if connection is not None \
+            else db.session().get_bind(MoodRollup.__mapper__).dialect.name
+        rollups = MoodRollup.__table__
+        if dialect in ("sqlite", "postgresql"):
+            insert = (sqlite.insert if dialect == "sqlite" else postgresql.insert)(rollups)
+            executor.execute(insert.on_conflict_do_update(
+                index_elements=["user_id", "period", "period_start", "mood"],
+                set_={"entry_count": rollups.c.entry_count + insert.excluded.entry_count}), rows)
+        else:
+            for row in rows:
+                # other databases have no portable upsert, so the row is inserted when there is none to update
+                updated = executor.execute(
+                    rollups.update()
+                    .where(rollups.c.user_id == row["user_id"], rollups.c.period == row["period"],
+                           rollups.c.period_start == row["period_start"], rollups.c.mood == row["mood"])
+                    .values(entry_count=rollups.c.entry_count + row["entry_count"]))
+                if updated.rowcount == 0:
+                    executor.execute(rollups.insert(), row)
+
+        decreased = [row for row in rows if row["entry_count"] < 0]
+        if decreased:
+            executor.execute(rollups.delete().where(rollups.c.user_id == bindparam("removed_user_id"),
+                                                    rollups.c.period == bindparam("removed_period"),
+                                                    rollups.c.period_start == bindparam("removed_period_start"),
+                                                    rollups.c.mood == bindparam("removed_mood"),
+                                                    rollups.c.entry_count <= 0),
+                             [{"removed_user_id": row["user_id"], "removed_period": row["period"],
+                               "removed_period_start": row["period_start"], "removed_mood": row["mood"]}
+                              for row in decreased])
+
+    @staticmethod
+    def rebuild(connection=None, chunk_size: int = REBUILD_CHUNK_SIZE) -> int:
+        """
+        Rebuilds the MoodRollups table from scratch within a single transaction. Entries are read chunk_size at a time
+        with keyset pagination on their id, and each chunk's counts are added with one statement, so the whole table
+        of entries is never held in memory.
+
+        Args:
+            connection: the SQLAlchemy connection to the database, or None to use a new transaction on the database
+            the app stores entries in
+            chunk_size: the number of entries read per query
+
+        Returns:
+            the number of entries counted
+        """
+        if connection is None:
+            with db.session.get_bind(Entry.__mapper__).begin() as connection:
+                return MoodRollups.rebuild(connection, chunk_size)
+
+        connection.execute(MoodRollup.__table__.delete())
+        counted = 0
+        last_id = None
+        while True:
+            query = select(Entry.id, Entry.user_id, Entry.mood, Entry.created).order_by(Entry.id).limit(chunk_size)
+            if last_id is not None:
+                query = query.where(Entry.id > last_id)
+            chunk = connection.execute(query).all()
+            if not chunk:
+                return counted
+
+            counts = Counter()
+            for entry_id, user_id, mood, created in chunk:
+                for period, period_start in MoodRollups.period_starts(created).items():
+                    counts[(user_id, period, period_start, mood)] += 1
+            MoodRollups.add_counts(counts, connection)
+            counted += len(chunk)
+            last_id = chunk[-1].id
+
+    @staticmethod
+    def bucket_index(day: date, bucket: str) -> int:
+        """
+        Numbers the buckets of a kind consecutively, so the number of buckets between two days is the difference of
+        their indexes.
+
+        Returns:
+            the index of the bucket the day is in
+        """
+        if bucket == "day":
+            return day.toordinal()
+        if bucket == "week":
+            # the first ordinal is a Monday
+            return (day.toordinal() - 1) // 7
+        month_index = day.year * 12 + day.month - 1
+        if bucket == "month":
+            return month_index
+        if bucket == "quarter":
+            return month_index // 3
+        return day.year
+
+    @staticmethod
+    def bucket_start(index: int, bucket: str) -> date:
+        """
+        Returns:
+            the first day of the bucket with the given index, the inverse of bucket_index
+        """
+        if bucket == "day":
+            return date.fromordinal(index)
+        if bucket == "week":
+            return date.fromordinal(index * 7 + 1)
+        if bucket == "year":
+            return date(index, 1, 1)
+        month_index = index * 3 if bucket == "quarter" else index
+        return date(month_index // 12, month_index % 12 + 1, 1)
+
+    @staticmethod
+    def choose_bucket(start: date, end: date, max_points: int = MAX_SERIES_POINTS) -> str:
+        """
+        Returns:
+            the finest bucket a series from start to end can be returned in with at most max_points buckets
+        """
+        for bucket in BUCKETS:
+            if MoodRollups.bucket_index(end, bucket) - MoodRollups.bucket_index(start, bucket) < max_points:
+                return bucket
+        return "year"
+
+    @staticmethod
+    @ReplicaRouter.read_only
+    def read_series(user_id: str, start: date, end: date, bucket: Optional[str] = None) -> dict:
+        """
+        Reads how often a user chose each mood in every bucket between two days, from the rollups of the coarsest
+        period that divides the bucket. The counts of each bucket are added up in one pass over the rollup rows into
+        a list per mood, indexed by bucket. The buckets holding start and end are counted whole.
+
+        Args:
+            user_id: string representing the id of the user the entries belong to
+            start: the first day of the series
+            end: the last day of the series
+            bucket: one of BUCKETS, or None to choose the finest bucket with at most MAX_SERIES_POINTS buckets
+
+        Returns:
+            a dictionary with the bucket under "bucket", the first day of every bucket under "periods", and a
+            dictionary mapping each mood chosen in the range to its list of counts per bucket under "moods"
+
+        Raises:
+            ValueError: if start is after end, the bucket is unknown or the series would have more than
+            MAX_SERIES_POINTS buckets
+        """
+        if start > end:
+            raise ValueError("The start of the range must not be after its end")
+        bucket = bucket or MoodRollups.choose_bucket(start, end)
+        if bucket not in BUCKETS:
+            raise ValueError(f"Unknown bucket {bucket!r}, expected one of {', '.join(BUCKETS)}")
+        first_index = MoodRollups.bucket_index(start, bucket)
+        points = MoodRollups.bucket_index(end, bucket) - first_index + 1
+        if points > MAX_SERIES_POINTS:
+            raise ValueError(f"The range holds {points} {bucket} buckets, more than the maximum of "
+                             f"{MAX_SERIES_POINTS}")
+
+        rows = db.session.query(MoodRollup.period_start, MoodRollup.mood, MoodRollup.entry_count) \
+            .filter(MoodRollup.user_id == user_id, MoodRollup.period == BUCKETS[bucket],
+                    MoodRollup.period_start >= MoodRollups.bucket_start(first_index, bucket),
+                    MoodRollup.period_start <= end)
+        moods = {}
+        for period_start, mood, entry_count in rows:
+            counts = moods.get(mood)
+            if counts is None:
+                counts = moods[mood] = [0] * points
+            counts[MoodRollups.bucket_index(period_start, bucket) - first_index] += entry_count
+
+        return {"bucket": bucket,
+                "periods": [MoodRollups.bucket_start(first_index + offset, bucket) for offset in range(points)],
+                "moods": dict(sorted(moods.items()))}
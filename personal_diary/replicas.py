@@ -0,0 +1,182 @@
+import contextvars
+import functools
+import sqlite3
+import threading
+import time
+from typing import Callable, Optional
+
+from flask import Flask, current_app, has_request_context, session
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.sql.expression import CompoundSelect, Select
+
+from personal_diary.engine import EngineProfile
+
+"""
+The number of seconds after a browser's last write during which its reads are sent to the primary database, so a
+user sees their own changes even while the replica lags behind
+"""
+STICKY_SECONDS = 10
+
+"""
+The key of the session cookie holding the time until which the browser's reads are sent to the primary database
+"""
+STICKY_SESSION_KEY = "_read_primary_until"
+
+"""
+The key of Session.info marking that the session's current transaction wrote to the database
+"""
+WROTE_INFO_KEY = "replica_wrote"
+
+"""
+Whether the code running is a read-only method whose queries may be sent to the replica
+"""
+READ_ONLY = contextvars.ContextVar("read_only", default=False)
+
+
+class ReplicaRouter:
+    """
+    A class containing helper functions to send the queries of read-only methods to a read replica of the database
+    when REPLICA_DATABASE_URI is set. Everything else, including every write and every query of a transaction that
+    already wrote, is sent to the primary database. Once a transaction that wrote is committed during a request,
+    the browser's reads go to the primary database for the next REPLICA_STICKY_SECONDS, so the page it is redirected
+    to shows what it just saved.
+    """
+
+    _lock = threading.Lock()
+
+    @staticmethod
+    def is_enabled(app: Optional[Flask] = None) -> bool:
+        """
+        Returns:
+            whether the app has a read replica
+        """
+        app = app or current_app
+        return bool(app.config.get("REPLICA_DATABASE_URI"))
+
+    @staticmethod
+    def engine(app: Optional[Flask] = None) -> Engine:
+        """
+        Returns:
+            the engine of the app's read replica, which is created with the engine profile on first use
+        """
+        app = app or current_app
+        engine = app.extensions.get("replica_engine")
+        if engine is None:
+            with ReplicaRouter._lock:
+                engine = app.extensions.get("replica_engine")
+                if engine is None:
+                    database_uri = app.config["REPLICA_DATABASE_URI"]
+                    engine = app.extensions["replica_engine"] = create_engine(
+                        database_uri, **EngineProfile.engine_options(database_uri))
+        return engine
+
+    @staticmethod
+    def read_only(function: Callable) -> Callable:
+        """
+        Decorates a method that only reads, so the queries it makes may be sent to the replica.
+
+        Args:
+            function: the method
+
+        Returns:
+            the decorated method
+        """
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            token = READ_ONLY.set(True)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                READ_ONLY.reset(token)
+        return wrapper
+
+    @staticmethod
+    def use_replica(db_session, clause) -> bool:
+        """
+        Decides whether a statement of the session is sent to the replica.
+
+        Args:
+            db_session: the session executing the statement
+            clause: the statement, or None when the session flushes
+
+        Returns:
+            whether the statement is a SELECT made by a read-only method, with a replica, outside a transaction that
+            wrote and outside the sticky period of the browser's last write
+        """
+        return (READ_ONLY.get() and isinstance(clause, (Select, CompoundSelect))
+                and ReplicaRouter.is_enabled(db_session.app)
+                and not db_session.info.get(WROTE_INFO_KEY)
+                and not ReplicaRouter.is_sticky())
+
+    @staticmethod
+    def stick(app: Optional[Flask] = None) -> None:
+        """
+        Sends the reads of the current request's browser to the primary database for the next
+        REPLICA_STICKY_SECONDS. Does nothing outside a request.
+        """
+        if has_request_context():
+            app = app or current_app
+            session[STICKY_SESSION_KEY] = time.time() + app.config.get("REPLICA_STICKY_SECONDS", STICKY_SECONDS)
+
+    @staticmethod
+    def is_sticky() -> bool:
+        """
+        Returns:
+            whether the current request's browser wrote within the last REPLICA_STICKY_SECONDS
+        """
+        return has_request_context() and session.get(STICKY_SESSION_KEY, 0) > time.time()
+
+    @staticmethod
+    def replicate(primary_path: str, replica_path: str) -> None:
+        """
+        Copies a SQLite database over its replica with SQLite's online backup, a stand-in for the streaming
+        replication of a database server. Readers of the replica keep reading the previous copy until it is
+        replaced.
+
+        Args:
+            primary_path: the path of the primary database file
+            replica_path: the path of the replica's database file, which is created if it does not exist
+        """
+        primary = sqlite3.connect(primary_path)
+        replica = sqlite3.connect(replica_path)
+        try:
+            primary.backup(replica)
+        finally:
+            replica.close()
+            primary.close()
+
+
+@event.listens_for(SignallingSession, "after_flush")
+def record_flush(db_session, flush_context) -> None:
+    """
+    Marks the session's transaction as having written, so its later queries read from the primary database.
+    """
+    db_session.info[WROTE_INFO_KEY] = True
+
+
+@event.listens_for(SignallingSession, "do_orm_execute")
+def record_write(orm_execute_state) -> None:
+    """
+    Marks the session's transaction as having written when it executes an INSERT, UPDATE or DELETE statement.
+    """
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info[WROTE_INFO_KEY] = True
+
+
+@event.listens_for(SignallingSession, "after_commit")
+def stick_after_write(db_session) -> None:
+    """
+    Sends the browser's next reads to the primary database once a transaction that wrote is committed.
+    """
+    if db_session.info.pop(WROTE_INFO_KEY, False) and ReplicaRouter.is_enabled(db_session.app):
+        ReplicaRouter.stick(db_session.app)
+
+
+@event.listens_for(SignallingSession, "after_rollback")
+def forget_write(db_session) -> None:
+    """
+    Forgets the writes of a transaction that was rolled back.
+    """
+    db_session.info.pop(WROTE_INFO_KEY, None)
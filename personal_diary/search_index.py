@@ -0,0 +1,199 @@
+from contextlib import contextmanager
+from typing import Iterable, Iterator
+
+from sqlalchemy import event, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Query
+
+from personal_diary import db
+from personal_diary.models import Entry
+
+"""
+Name of the SQLite FTS5 virtual table that indexes the title and body of every entry in DiaryEntries
+"""
+SEARCH_TABLE = "DiaryEntriesSearch"
+
+"""
+The trigram tokenizer only matches substrings of at least this many characters
+"""
+MIN_INDEXED_KEYWORD_LENGTH = 3
+
+CREATE_SEARCH_TABLE = f"""
+CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE}
+USING fts5(title, body, content='DiaryEntries', content_rowid='rowid', tokenize='trigram')
+"""
+
+CREATE_SEARCH_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_insert AFTER INSERT ON DiaryEntries BEGIN
+        INSERT INTO {SEARCH_TABLE}(rowid, title, body) VALUES (new.rowid, new.title, new.body);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_delete AFTER DELETE ON DiaryEntries BEGIN
+        INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rowid, title, body) VALUES ('delete', old.rowid, old.title, old.body);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_update AFTER UPDATE OF title, body ON DiaryEntries BEGIN
+        INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rowid, title, body) VALUES ('delete', old.rowid, old.title, old.body);
+        INSERT INTO {SEARCH_TABLE}(rowid, title, body) VALUES (new.rowid, new.title, new.body);
+    END
+    """
+]
+
+
+class SearchIndex:
+    """
+    A class containing helper functions for the full-text search index over diary entries. The index is an SQLite FTS5
+    table using the trigram tokenizer, so it answers the same case-insensitive substring matches as the LIKE
+    based search. It is kept in sync with DiaryEntries by triggers, so every create, update and delete of an Entry
+    is reflected without any extra work from the Diary class.
+    """
+
+    @staticmethod
+    def create(connection) -> bool:
+        """
+        Creates the search table and the triggers that keep it in sync with DiaryEntries. Databases that are not
+        SQLite, or SQLite builds without FTS5 and the trigram tokenizer, are left unchanged.
+
+        Args:
+            connection: the SQLAlchemy connection to create the search table with
+
+        Returns:
+            a boolean which represents whether the search table exists after the call
+        """
+        if connection.dialect.name != "sqlite":
+            return False
+        try:
+            connection.execute(text(CREATE_SEARCH_TABLE))
+        except OperationalError:
+            return False
+        for trigger in CREATE_SEARCH_TRIGGERS:
+            connection.execute(text(trigger))
+        return True
+
+    @staticmethod
+    def drop(connection) -> None:
+        """
+        Drops the search table. The triggers are dropped by SQLite together with DiaryEntries.
+
+        Args:
+            connection: the SQLAlchemy connection to drop the search table with
+        """
+        if connection.dialect.name == "sqlite":
+            connection.execute(text(f"DROP TABLE IF EXISTS {SEARCH_TABLE}"))
+
+    @staticmethod
+    def rebuild(connection=None) -> bool:
+        """
+        Creates the search table if it is missing and re-indexes every stored entry. This backfills databases that
+        were created before the search index existed, and should also be run after a VACUUM since SQLite may then
+        renumber the rowids the index refers to.
+
+        Args:
+            connection: the SQLAlchemy connection to rebuild the search index with, or None to use a new transaction
+            on the database the app stores entries in
+
+        Returns:
+            a boolean which represents whether the search index is available after the rebuild
+        """
+        if connection is None:
+            with db.session.get_bind(Entry.__mapper__).begin() as connection:
+                return SearchIndex.rebuild(connection)
+
+        if not SearchIndex.create(connection):
+            return False
+        connection.execute(text(f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('rebuild')"))
+        return True
+
+    @staticmethod
+    @contextmanager
+    def deferred_indexing(connection) -> Iterator[None]:
+        """
+        Defers indexing the entries inserted within the block to a single bulk insert into the search table when
+        the block ends, which is several times faster than indexing each entry from the insert trigger. The insert
+        trigger is dropped for the duration of the block, so the block must run within the transaction that inserts
+        the entries, which keeps other connections from inserting entries until the trigger is back.
+
+        Args:
+            connection: the SQLAlchemy connection the entries are inserted with
+        """
+        if not SearchIndex.is_available(connection):
+            yield
+            return
+
+        last_rowid = connection.execute(text("SELECT MAX(rowid) FROM DiaryEntries")).scalar() or 0
+        connection.execute(text(f"DROP TRIGGER IF EXISTS {SEARCH_TABLE}_insert"))
+        yield
+        connection.execute(text(f"INSERT INTO {SEARCH_TABLE}(rowid, title, body) "
+                                f"SELECT rowid, title, body FROM DiaryEntries WHERE rowid > :last_rowid"),
+                           {"last_rowid": last_rowid})
+        connection.execute(text(CREATE_SEARCH_TRIGGERS[0]))
+
+    @staticmethod
+    def is_available(connection=None) -> bool:
+        """
+        Checks whether the database that entries are stored in has the search table.
+
+        Args:
+            connection: the SQLAlchemy connection to check, or None to use the app's session
+
+        Returns:
+            a boolean which represents whether searches can use the search index
+        """
+        if (connection or db.session.get_bind(Entry.__mapper__)).dialect.name != "sqlite":
+            return False
+        query = text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name")
+        if connection is not None:
+            return connection.execute(query, {"name": SEARCH_TABLE}).first() is not None
+        # the query names no table, so the session is told which database entries are stored in
+        return db.session.execute(query, {"name": SEARCH_TABLE},
+                                  bind_arguments={"mapper": Entry.__mapper__}).first() is not None
+
+    @staticmethod
+    def filter_entries(entries: Query, keywords: Iterable[str]) -> Query:
+        """
+        Filters a query of entries down to the entries that contain every keyword in their title or body text.
+        Keywords long enough for the trigram tokenizer are matched through the search index, and any shorter
+        keywords, or all keywords when the index is not available, are matched with a case-insensitive LIKE.
+
+        Args:
+            entries: the query of entries to filter
+            keywords: the keywords that must all be contained in an entry's title or body text
+
+        Returns:
+            the query filtered to only the matching entries
+        """
+        keywords = [keyword for keyword in keywords if keyword]
+        unindexed_keywords = keywords
+
+        if keywords and SearchIndex.is_available():
+            indexed_keywords = [keyword for keyword in keywords if len(keyword) >= MIN_INDEXED_KEYWORD_LENGTH]
+            unindexed_keywords = [keyword for keyword in keywords if len(keyword) < MIN_INDEXED_KEYWORD_LENGTH]
+            if indexed_keywords:
+                # each keyword is quoted as a phrase, and FTS5 requires all space separated phrases to match
+                match = " ".join('"' + keyword.replace('"', '""') + '"' for keyword in indexed_keywords)
+                entries = entries.filter(text(f"DiaryEntries.rowid IN (SELECT rowid FROM {SEARCH_TABLE} "
+                                              f"WHERE {SEARCH_TABLE} MATCH :match)").bindparams(match=match))
+
+        for keyword in unindexed_keywords:
+            entries = entries.filter(Entry.title.ilike("%" + keyword + "%") | Entry.body.ilike("%" + keyword + "%"))
+
+        return entries
+
+
+@event.listens_for(Entry.__table__, "after_create")
+def create_search_index(target, connection, **kw) -> None:
+    """
+    Creates the search index whenever the DiaryEntries table is created.
+    """
+    SearchIndex.create(connection)
+
+
+@event.listens_for(Entry.__table__, "before_drop")
+def drop_search_index(target, connection, **kw) -> None:
+    """
+    Drops the search index whenever the DiaryEntries table is dropped.
+    """
+    SearchIndex.drop(connection)
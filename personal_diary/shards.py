@@ -0,0 +1,436 @@
+import contextvars
+import os
+import re
+import resource
+import threading
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional
+
+from flask import Flask, current_app, has_request_context
+from flask_login import current_user
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import create_engine, orm, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.sql.util import find_tables
+
+from personal_diary.engine import EngineProfile
+from personal_diary.ids import TimeOrderedIds
+from personal_diary.replicas import ReplicaRouter
+
+"""
+The tables whose rows belong to a single user and are stored in that user's shard when sharding is enabled. Users and
+Moods stay in the directory database the app's SQLALCHEMY_DATABASE_URI points at.
+"""
+SHARDED_TABLES = frozenset({"DiaryEntries", "DiaryEntriesSearch", "tags", "EntryTags", "TagUsage", "MoodRollups",
+                            "EntryWords", "WordTrigrams"})
+
+"""
+The most shard engines kept open at once. The least recently used engine is closed when another one is opened.
+"""
+MAX_OPEN_SHARDS = 128
+
+"""
+Connection pool settings of each shard engine. A shard has one writer at a time, so one pooled connection serves
+most requests and overflow connections are closed when they are returned.
+"""
+SHARD_POOL_SETTINGS = {
+    "pool_size": 1,
+    "max_overflow": 4
+}
+
+"""
+The file descriptors an open SQLite connection in WAL mode uses, for the database, its write-ahead log and its shared
+memory index
+"""
+FDS_PER_CONNECTION = 3
+
+"""
+The characters a user id may have to name a shard file
+"""
+SHARD_NAME_PATTERN = re.compile(r"[A-Za-z0-9_-]+")
+
+"""
+The user that the sharded tables are routed to outside a request, such as in commands and background jobs
+"""
+ROUTED_USER_ID = contextvars.ContextVar("routed_user_id", default=None)
+
+
+class ShardEngines:
+    """
+    Keeps the engines of the shards that were used most recently open, at most max_open at a time. Opening the shard
+    of a user that has none creates it with the latest schema. A shard is first created under a temporary name and
+    then linked into place, so processes creating the same shard at once never see a half created file.
+    """
+
+    def __init__(self, max_open: int = MAX_OPEN_SHARDS) -> None:
+        """
+        Args:
+            max_open: the maximum number of engines kept open, which is lowered to fit the file descriptor limit of
+            the process
+        """
+        self.max_open = min(max_open, ShardEngines.fd_limit())
+        self._engines = OrderedDict()
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.closed = 0
+
+    @staticmethod
+    def fd_limit() -> int:
+        """
+        Returns:
+            the number of shard engines that can have every pooled connection open while using at most half of the
+            process's file descriptors, leaving the rest for sockets and the directory database
+        """
+        soft_limit = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+        if soft_limit == resource.RLIM_INFINITY:
+            return MAX_OPEN_SHARDS
+        connections = SHARD_POOL_SETTINGS["pool_size"] + SHARD_POOL_SETTINGS["max_overflow"]
+        return max(1, soft_limit // 2 // (FDS_PER_CONNECTION * connections))
+
+    @staticmethod
+    def engine_options(path: str) -> dict:
+        """
+        Returns:
+            the engine options of a shard, which are the engine profile of SQLite databases with a smaller pool
+        """
+        return {**EngineProfile.engine_options("sqlite:///" + path), **SHARD_POOL_SETTINGS}
+
+    def get(self, path: str) -> Engine:
+        """
+        Returns the engine of a shard, opening it and creating the shard if needed.
+
+        Args:
+            path: the path of the shard's database file
+
+        Returns:
+            the engine
+        """
+        with self._lock:
+            engine = self._engines.get(path)
+            if engine is not None:
+                self._engines.move_to_end(path)
+                return engine
+
+            if not os.path.exists(path):
+                ShardEngines.create_shard(path)
+            engine = create_engine("sqlite:///" + path, **ShardEngines.engine_options(path))
+            self._engines[path] = engine
+            self.opened += 1
+            while len(self._engines) > self.max_open:
+                # connections still checked out of the evicted engine are closed once they are returned
+                self._engines.popitem(last=False)[1].dispose()
+                self.closed += 1
+            return engine
+
+    @staticmethod
+    def create_shard(path: str) -> None:
+        """
+        Creates a shard database with the latest schema, unless another process creates it first.
+
+        Args:
+            path: the path of the shard's database file
+        """
+        from personal_diary import db
+
+        temporary_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        engine = create_engine("sqlite:///" + temporary_path)
+        try:
+            with engine.begin() as connection:
+                db.Model.metadata.create_all(connection)
+            engine.dispose()
+            try:
+                os.link(temporary_path, path)
+            except FileExistsError:
+                pass
+        finally:
+            engine.dispose()
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+
+    def dispose(self, path: str) -> None:
+        """
+        Closes the engine of a shard if it is open.
+
+        Args:
+            path: the path of the shard's database file
+        """
+        with self._lock:
+            engine = self._engines.pop(path, None)
+        if engine is not None:
+            engine.dispose()
+            self.closed += 1
+
+    def clear(self) -> None:
+        """
+        Closes every open engine.
+        """
+        with self._lock:
+            engines = list(self._engines.values())
+            self._engines.clear()
+        for engine in engines:
+            engine.dispose()
+        self.closed += len(engines)
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            a dictionary with the number of open engines, the maximum number of open engines, and the number of
+            engines opened and closed so far
+        """
+        with self._lock:
+            return {"open": len(self._engines), "max_open": self.max_open, "opened": self.opened,
+                    "closed": self.closed}
+
+    def __len__(self) -> int:
+        return len(self._engines)
+
+
+"""
+The open shard engines of this process
+"""
+SHARD_ENGINES = ShardEngines()
+
+
+class ShardRouter:
+    """
+    A class containing helper functions to store each user's entries, tags, tag and mood counts and search indexes in
+    their own SQLite file. Sharding is enabled by setting the app's SHARD_DIRECTORY, which the DIARY_SHARD_DIRECTORY
+    environment variable sets. The session then sends every statement on a table in SHARDED_TABLES to the shard of
+    the user the request is made by, or of the user given to routed outside a request, so the Diary class works
+    unchanged. Every shard has the full schema, in which only the sharded tables are used.
+    """
+
+    @staticmethod
+    def is_enabled(app: Optional[Flask] = None) -> bool:
+        """
+        Returns:
+            a boolean which represents whether the app stores entries in per-user shards
+        """
+        return bool((app or current_app).config.get("SHARD_DIRECTORY"))
+
+    @staticmethod
+    def shard_path(user_id: str, directory: Optional[str] = None) -> str:
+        """
+        Args:
+            user_id: the id of the user
+            directory: the directory of the shards, or None to use the current app's SHARD_DIRECTORY
+
+        Returns:
+            the path of the database file of a user's shard
+
+        Raises:
+            ValueError: if the user id cannot name a file
+        """
+        if not SHARD_NAME_PATTERN.fullmatch(user_id):
+            raise ValueError(f"User id {user_id!r} cannot name a shard")
+        return os.path.join(directory or current_app.config["SHARD_DIRECTORY"], user_id + ".db")
+
+    @staticmethod
+    def shard_user_ids(directory: Optional[str] = None) -> list:
+        """
+        Args:
+            directory: the directory of the shards, or None to use the current app's SHARD_DIRECTORY
+
+        Returns:
+            a sorted list of the ids of the users that have a shard
+        """
+        directory = directory or current_app.config["SHARD_DIRECTORY"]
+        if not os.path.isdir(directory):
+            return []
+        return sorted(name[:-3] for name in os.listdir(directory)
+                      if name.endswith(".db") and SHARD_NAME_PATTERN.fullmatch(name[:-3]))
+
+    @staticmethod
+    @contextmanager
+    def routed(user_id: str) -> Iterator[None]:
+        """
+        Routes the sharded tables to a user's shard within the block, for work done outside a request.
+
+        Args:
+            user_id: the id of the user
+        """
+        token = ROUTED_USER_ID.set(user_id)
+        try:
+            yield
+        finally:
+            ROUTED_USER_ID.reset(token)
+
+    @staticmethod
+    def for_each_shard(function: Callable, *args) -> list:
+        """
+        Calls a function that works on the sharded tables once for every shard, routed to the shard's user, or once
+        when sharding is disabled.
+
+        Args:
+            function: the function to call
+            args: the arguments to call the function with
+
+        Returns:
+            a list of what each call returned
+        """
+        if not ShardRouter.is_enabled():
+            return [function(*args)]
+        results = []
+        for user_id in ShardRouter.shard_user_ids():
+            with ShardRouter.routed(user_id):
+                results.append(function(*args))
+        return results
+
+    @staticmethod
+    def current_user_id() -> str:
+        """
+        Returns:
+            the id of the user the sharded tables are routed to
+
+        Raises:
+            RuntimeError: if there is neither a routed user nor a logged-in user
+        """
+        user_id = ROUTED_USER_ID.get()
+        if user_id is None and has_request_context() and current_user.is_authenticated:
+            user_id = current_user.id
+        if user_id is None:
+            raise RuntimeError("Entries are stored per user, so they must be used within a request of a logged-in "
+                               "user or within ShardRouter.routed")
+        return user_id
+
+    @staticmethod
+    def engine(user_id: Optional[str] = None, app: Optional[Flask] = None) -> Engine:
+        """
+        Returns:
+            the engine of a user's shard, or of the shard of the current user if no user is given
+        """
+        return SHARD_ENGINES.get(ShardRouter.shard_path(user_id or ShardRouter.current_user_id(),
+                                                        (app or current_app).config["SHARD_DIRECTORY"]))
+
+    @staticmethod
+    def drop_shard(user_id: str) -> None:
+        """
+        Closes a user's shard and deletes its files, which removes everything the user stored at once.
+
+        Args:
+            user_id: the id of the user
+        """
+        path = ShardRouter.shard_path(user_id)
+        SHARD_ENGINES.dispose(path)
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+    @staticmethod
+    def tag_cache_key(tag_name: str):
+        """
+        Tags are numbered separately in every shard, so cached tag ids are kept per shard when sharding is enabled.
+
+        Returns:
+            the key a tag's id is cached under
+        """
+        if ShardRouter.is_enabled():
+            return ShardRouter.current_user_id(), tag_name
+        return tag_name
+
+    @staticmethod
+    def split_database(source_path: str, directory: str) -> list:
+        """
+        Copies the rows of every user of an unsharded database into the user's shard, creating the shards that do
+        not exist yet. Users that already have a shard are skipped, so a split that was interrupted can be started
+        again. The source database is left unchanged, and becomes the directory database once sharding is enabled.
+
+        Args:
+            source_path: the path of the unsharded database file
+            directory: the directory to create the shards in
+
+        Returns:
+            a list of the ids of the users whose rows were copied
+        """
+        os.makedirs(directory, exist_ok=True)
+        existing = set(ShardRouter.shard_user_ids(directory))
+        source = create_engine("sqlite:///" + source_path)
+        with source.connect() as connection:
+            user_ids = [str(uuid.UUID(bytes=user_id)) if isinstance(user_id, bytes) else user_id
+                        for user_id in connection.execute(text('SELECT id FROM "Users" ORDER BY id')).scalars()]
+        source.dispose()
+
+        split = []
+        for user_id in user_ids:
+            if user_id in existing:
+                continue
+            path = ShardRouter.shard_path(user_id, directory)
+            ShardRouter.copy_user(source_path, path + ".split", user_id)
+            os.replace(path + ".split", path)
+            split.append(user_id)
+        return split
+
+    @staticmethod
+    def copy_user(source_path: str, path: str, user_id: str) -> None:
+        """
+        Creates a shard holding one user's rows of the sharded tables of an unsharded database. The source is
+        attached to the new shard, so every table is copied with one INSERT ... SELECT, and the search index is
+        filled by its triggers.
+
+        Args:
+            source_path: the path of the unsharded database file
+            path: the path of the shard's database file to create
+            user_id: the id of the user
+        """
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        ShardEngines.create_shard(path)
+        # ids are stored as the bytes of their UUID when they are one, as IdType stores them
+        stored_id = TimeOrderedIds.to_bytes(user_id) or user_id
+        engine = create_engine("sqlite:///" + path)
+        try:
+            with engine.begin() as connection:
+                connection.execute(text("ATTACH DATABASE :source_path AS source"), {"source_path": source_path})
+                connection.execute(text("""
+                    INSERT INTO DiaryEntries (id, title, body, created, modified, user_id, mood)
+                    SELECT id, title, body, created, modified, user_id, mood FROM source.DiaryEntries
+                    WHERE user_id = :user_id ORDER BY rowid
+                """), {"user_id": stored_id})
+                connection.execute(text("""
+                    INSERT INTO tags (tag_id, entry_id)
+                    SELECT source_tags.tag_id, source_tags.entry_id FROM source.tags AS source_tags
+                    JOIN DiaryEntries ON DiaryEntries.id = source_tags.entry_id
+                """))
+                connection.execute(text("""
+                    INSERT INTO EntryTags (id, name)
+                    SELECT id, name FROM source.EntryTags WHERE id IN (SELECT tag_id FROM tags)
+                """))
+                for table in ("TagUsage", "MoodRollups", "EntryWords", "WordTrigrams"):
+                    connection.execute(text(f'INSERT INTO "{table}" SELECT * FROM source."{table}" '
+                                            f'WHERE user_id = :user_id'), {"user_id": stored_id})
+        finally:
+            engine.dispose()
+
+
+class ShardedSession(SignallingSession):
+    """
+    The session of the app, which sends statements on the tables in SHARDED_TABLES to the shard of the current user
+    when sharding is enabled, and every other statement to the directory database. Reads that ReplicaRouter allows
+    are sent to the read replica of the directory database instead.
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if ShardRouter.is_enabled(self.app):
+            if mapper is not None:
+                tables = find_tables(mapper.persist_selectable, include_joins=True)
+            elif clause is not None:
+                tables = find_tables(clause, include_crud=True, include_joins=True)
+            else:
+                tables = []
+            if any(table.name in SHARDED_TABLES for table in tables):
+                return ShardRouter.engine(app=self.app)
+        if ReplicaRouter.use_replica(self, clause):
+            return ReplicaRouter.engine(self.app)
+        return super().get_bind(mapper, clause)
+
+
+class ShardedSQLAlchemy(SQLAlchemy):
+    """
+    The Flask-SQLAlchemy extension of the app, whose sessions are ShardedSessions.
+    """
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=ShardedSession, db=self, **options)
@@ -0,0 +1,264 @@
+import csv
+import io
+import json
+from datetime import datetime
+from typing import Iterable, Iterator, Optional
+
+from sqlalchemy import tuple_
+
+from personal_diary import db
+from personal_diary.diary import Diary
+from personal_diary.fuzzy_index import FuzzyIndex
+from personal_diary.forms import TITLE_MAX_LENGTH, BODY_MAX_LENGTH, TAG_MAX_LENGTH, MAX_TAGS, MOOD_CHOICES, \
+    DEFAULT_MOOD
+from personal_diary.ids import TimeOrderedIds
+from personal_diary.models import Entry, tags as entry_tags
+from personal_diary.mood_rollups import MoodRollups
+from personal_diary.search_index import SearchIndex
+
+DEFAULT_CHUNK_SIZE = 5000
+
+"""
+The number of skipped rows reported individually by an import. Any further skipped rows are only counted.
+"""
+MAX_REPORTED_ERRORS = 100
+
+"""
+The columns of an exported CSV file. Tags are split over one column per tag, like the fields of the entry forms.
+"""
+CSV_COLUMNS = ["title", "body", "mood", "created", "modified"] + [f"tag{number}" for number in range(1, MAX_TAGS + 1)]
+
+MOOD_VALUES = {value for value, _ in MOOD_CHOICES}
+
+
+class DiaryTransfer:
+    """
+    A class containing helper functions to import and export a user's diary entries in bulk, as JSON Lines or CSV.
+    Entries are streamed through generators in both directions, so a whole diary is never held in memory at once.
+    """
+
+    @staticmethod
+    def read_jsonl(lines: Iterable[str]) -> Iterator[Optional[dict]]:
+        """
+        Parses JSON Lines, where each line is an object with a title, body, optional mood, optional list of tags,
+        and optional ISO 8601 created and modified datetimes. Blank lines are skipped.
+
+        Args:
+            lines: the lines of the JSON Lines input
+
+        Returns:
+            an iterator over the parsed rows, with None in place of any line that is not valid JSON
+        """
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                yield None
+
+    @staticmethod
+    def read_csv(lines: Iterable[str]) -> Iterator[dict]:
+        """
+        Parses CSV with a header row naming the columns in CSV_COLUMNS. Only the title and body columns are required.
+
+        Args:
+            lines: the lines of the CSV input
+
+        Returns:
+            an iterator over the parsed rows, with the tag columns collected into a list under "tags"
+        """
+        for row in csv.DictReader(lines):
+            row["tags"] = [row.pop(f"tag{number}", None) for number in range(1, MAX_TAGS + 1)]
+            yield row
+
+    @staticmethod
+    def validate_row(row: Optional[dict]) -> dict:
+        """
+        Checks that a row describes a valid entry, using the same limits as the form for creating an entry.
+
+        Args:
+            row: the parsed row
+
+        Returns:
+            a dictionary with the entry's title, body, mood, list of distinct non-empty tags, created datetime
+            and modified datetime. The mood defaults to the form's default mood, the created datetime to now, and
+            the modified datetime to the created datetime. Datetimes with a UTC offset are converted to naive
+            datetimes in the server's local time.
+
+        Raises:
+            ValueError: if the row does not describe a valid entry
+        """
+        if not isinstance(row, dict):
+            raise ValueError("Row is not a valid JSON object")
+
+        title, body = row.get("title"), row.get("body")
+        if not isinstance(title, str) or not title.strip() or len(title) > TITLE_MAX_LENGTH:
+            raise ValueError(f"Title must be between 1 and {TITLE_MAX_LENGTH} characters long")
+        if not isinstance(body, str) or not body.strip() or len(body) > BODY_MAX_LENGTH:
+            raise ValueError(f"Body must be between 1 and {BODY_MAX_LENGTH} characters long")
+
+        mood = row.get("mood") or DEFAULT_MOOD
+        if mood not in MOOD_VALUES:
+            raise ValueError(f"Unknown mood {mood!r}")
+
+        tag_names = row.get("tags") or []
+        if not isinstance(tag_names, list) or not all(isinstance(tag, str) or tag is None for tag in tag_names):
+            raise ValueError("Tags must be a list of strings")
+        tag_names = list(dict.fromkeys(tag for tag in tag_names if tag))
+        if len(tag_names) > MAX_TAGS or any(len(tag) > TAG_MAX_LENGTH for tag in tag_names):
+            raise ValueError(f"An entry can have at most {MAX_TAGS} tags of at most {TAG_MAX_LENGTH} characters")
+
+        try:
+            created = datetime.fromisoformat(row["created"]) if row.get("created") else datetime.now()
+            modified = datetime.fromisoformat(row["modified"]) if row.get("modified") else created
+        except (TypeError, ValueError):
+            raise ValueError("Created and modified must be ISO 8601 datetimes")
+        # datetimes are stored naive in server local time, so a UTC offset would otherwise be dropped
+        if created.tzinfo is not None:
+            created = created.astimezone().replace(tzinfo=None)
+        if modified.tzinfo is not None:
+            modified = modified.astimezone().replace(tzinfo=None)
+
+        return {"title": title, "body": body, "mood": mood, "tags": tag_names, "created": created,
+                "modified": modified}
+
+    @staticmethod
+    def import_entries(user_id: str, rows: Iterable[Optional[dict]], chunk_size: int = DEFAULT_CHUNK_SIZE) -> dict:
+        """
+        Adds entries to a user's diary in bulk. Rows are validated one at a time, and the valid ones are inserted
+        and committed chunk_size entries at a time with one multi-row insert for the entries and one for their tags.
+        Invalid rows are skipped.
+
+        Args:
+            user_id: string representing the id of the user the entries are for
+            rows: the parsed rows describing the entries, such as the rows from read_jsonl or read_csv
+            chunk_size: the number of entries inserted per transaction
+
+        Returns:
+            a dictionary containing the number of entries imported under "imported", the number of rows skipped under
+            "skipped", and a list of (row number, reason) tuples for the first MAX_REPORTED_ERRORS skipped rows
+            under "errors"
+        """
+        imported = skipped = 0
+        errors = []
+        chunk = []
+        for row_number, row in enumerate(rows, start=1):
+            try:
+                chunk.append(DiaryTransfer.validate_row(row))
+            except ValueError as error:
+                skipped += 1
+                if len(errors) < MAX_REPORTED_ERRORS:
+                    errors.append((row_number, str(error)))
+            if len(chunk) >= chunk_size:
+                imported += len(DiaryTransfer.insert_entries(user_id, chunk))
+                chunk = []
+        if chunk:
+            imported += len(DiaryTransfer.insert_entries(user_id, chunk))
+
+        return {"imported": imported, "skipped": skipped, "errors": errors}
+
+    @staticmethod
+    def insert_entries(user_id: str, entries: list) -> list:
+        """
+        Inserts validated entries and their tags in a single transaction, indexing the entries for search in bulk
+        once they are all inserted.
+
+        Args:
+            user_id: string representing the id of the user the entries are for
+            entries: the entries, as returned by validate_row
+
+        Returns:
+            a list of the ids of the inserted entries, in the order of entries
+        """
+        tag_ids = Diary.resolve_tag_ids(tag_name for entry in entries for tag_name in entry["tags"])
+        entry_rows = []
+        tag_rows = []
+        for entry in entries:
+            entry_id = TimeOrderedIds.new()
+            entry_rows.append({"id": entry_id, "title": entry["title"], "body": entry["body"], "mood": entry["mood"],
+                               "created": entry["created"], "modified": entry["modified"], "user_id": user_id})
+            tag_rows.extend({"tag_id": tag_ids[tag_name], "entry_id": entry_id} for tag_name in entry["tags"])
+
+        # inserting in primary key order keeps the writes to the tags index local
+        tag_rows.sort(key=lambda tag_row: (tag_row["tag_id"], tag_row["entry_id"]))
+        with SearchIndex.deferred_indexing(db.session.connection()):
+            db.session.execute(Entry.__table__.insert(), entry_rows)
+            if tag_rows:
+                db.session.execute(entry_tags.insert(), tag_rows)
+        Diary.change_tag_usage(user_id, added=[(tag_ids[tag_name], entry["created"])
+                                               for entry in entries for tag_name in entry["tags"]])
+        MoodRollups.change(user_id, added=[(entry["mood"], entry["created"]) for entry in entries])
+        FuzzyIndex.index_entries(user_id, [(entry_row["id"], entry["title"], entry["tags"])
+                                           for entry_row, entry in zip(entry_rows, entries)], replace=False)
+        db.session.commit()
+        return [entry_row["id"] for entry_row in entry_rows]
+
+    @staticmethod
+    def read_entries(user_id: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[dict]:
+        """
+        Reads all of a user's entries in the order they were created. Entries are read chunk_size at a time with
+        keyset pagination on the created datetime and id, and only the exported columns are selected.
+
+        Args:
+            user_id: string representing the id of the user the entries belong to
+            chunk_size: the number of entries read per query
+
+        Returns:
+            an iterator over dictionaries with each entry's title, body, mood, ISO 8601 created and modified
+            datetimes, and list of tag names
+        """
+        position = None
+        while True:
+            query = db.session.query(Entry.id, Entry.title, Entry.body, Entry.mood, Entry.created, Entry.modified) \
+                .filter(Entry.user_id == user_id)
+            if position:
+                query = query.filter(tuple_(Entry.created, Entry.id) > position)
+            rows = query.order_by(Entry.created, Entry.id).limit(chunk_size).all()
+            if not rows:
+                return
+
+            tag_names = Diary.read_tag_names([row.id for row in rows])
+            for row in rows:
+                yield {"title": row.title, "body": row.body, "mood": row.mood,
+                       "created": row.created.isoformat(),
+                       "modified": row.modified.isoformat() if row.modified else None,
+                       "tags": tag_names[row.id]}
+            position = (rows[-1].created, rows[-1].id)
+
+    @staticmethod
+    def write_jsonl(entries: Iterable[dict]) -> Iterator[str]:
+        """
+        Formats entries as JSON Lines.
+
+        Args:
+            entries: the entries, such as the entries from read_entries
+
+        Returns:
+            an iterator over the lines of the JSON Lines output
+        """
+        for entry in entries:
+            yield json.dumps(entry) + "\n"
+
+    @staticmethod
+    def write_csv(entries: Iterable[dict]) -> Iterator[str]:
+        """
+        Formats entries as CSV with a header row naming the columns in CSV_COLUMNS.
+
+        Args:
+            entries: the entries, such as the entries from read_entries
+
+        Returns:
+            an iterator over the lines of the CSV output
+        """
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=CSV_COLUMNS)
+        writer.writeheader()
+        for entry in entries:
+            row = {column: entry.get(column) for column in CSV_COLUMNS}
+            for number, tag_name in enumerate(entry["tags"][:MAX_TAGS], start=1):
+                row[f"tag{number}"] = tag_name
+            writer.writerow(row)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
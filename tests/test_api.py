@@ -0,0 +1,192 @@
+import unittest
+from unittest import TestCase, mock
+from personal_diary.app import flask_app
+from personal_diary.diary import Diary
+from personal_diary.models import Entry, User
+from tests.test_app import set_up_flask_app_test_client, create_test_user, tear_down_flask_test
+
+
+def create_test_entries(user_id: str, count: int) -> list:
+    return [Diary.create_entry({"title": f"Title {number}", "body": f"Body {number}", "user_id": user_id,
+                                "tags": ["tag1"], "mood": "&#128512"})["entry_id"]
+            for number in range(count)]
+
+
+class ApiTestReadEntries(TestCase):
+
+    def setUp(self) -> None:
+        self.client = set_up_flask_app_test_client()
+        self.test_user = create_test_user()
+        self.entry_ids = create_test_entries("1", 3)
+        self.other_entry_id = create_test_entries("2", 1)[0]
+
+    def tearDown(self) -> None:
+        tear_down_flask_test()
+
+    @mock.patch('flask_login.utils._get_user')
+    def test_list_entries_leaves_out_body_by_default(self, current_user):
+        current_user.return_value = self.test_user
+        response = self.client.get("/api/v1/entries")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["count"], 3)
+        self.assertEqual({entry["id"] for entry in response.json["entries"]}, set(self.entry_ids))
+        self.assertNotIn("body", response.json["entries"][0])
+        self.assertEqual(response.json["entries"][0]["tags"], ["tag1"])
+
+    @mock.patch('flask_login.utils._get_user')
+    def test_list_entries_returns_selected_fields(self, current_user):
+        current_user.return_value = self.test_user
+        response = self.client.get("/api/v1/entries?fields=title,body")
+        self.assertEqual(set(response.json["entries"][0]), {"id", "title", "body"})
+        self.assertTrue(response.json["entries"][0]["body"].startswith("Body"))
+
+    @mock.patch('flask_login.utils._get_user')
+    def test_list_entries_unknown_field_returns_400(self, current_user):
+        current_user.return_value = self.test_user
+        response = self.client.get("/api/v1/entries?fields=password")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("password", response.json["error"])
+
+    @mock.patch('flask_login.utils._get_user')
+    def test_list_entries_follows_cursor(self, current_user):
+        current_user.return_value = self.test_user
+        first_page = self.client.get("/api/v1/entries?page_size=2").json
+        second_page = self.client.get(f"/api/v1/entries?page_size=2&cursor={first_page['next_cursor']}").json
+        self.assertEqual(len(first_page["entries"]), 2)
+        self.assertEqual(len(second_page["entries"]), 1)
+        self.assertIsNone(second_page["next_cursor"])
+
+    @mock.patch('flask_login.utils._get_user')
+    def test_read_batch_returns_entries_in_order(self, current_user):
+        current_user.return_value = self.test_user
+        ids = [self.entry_ids[2], self.entry_ids[0]]
+        response = self.client.get("/api/v1/entries/batch?ids=" + ",".join(ids))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([entry["id"] for entry in response.json["entries"]], ids)
+
+    @mock.patch('flask_login.utils._get_user')
+    def test_read_batch_with_entry_from_different_user_returns_404(self, current_user):
+        current_user.return_value = self.test_user
+        response = self.client.get(f"/api/v1/entries/batch?ids={self.entry_ids[0]},{self.other_entry_id}")
+        self.assertEqual(response.status_code, 404)
+        self.assertIn("error", response.json)
+
+    @mock.patch('flask_login.utils._get_user')
+    def test_read_entry_from_different_user_returns_404(self, current_user):
+        current_user.return_value = self.test_user
+        self.assertEqual(self.client.get(f"/api/v1/entries/{self.entry_ids[0]}").status_code, 200)
+        self.assertEqual(self.client.get(f"/api/v1/entries/{self.other_entry_id}").status_code, 404)
+
+    @mock.patch('flask_login.utils._get_user')
+    def test_export_streams_json_lines(self, current_user):
+        current_user.return_value = self.test_user
+        response = self.client.get("/api/v1/entries/export")
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        self.assertEqual(len(response.get_data(as_text=True).splitlines()), 3)
+
+    @mock.patch('flask_login.utils._get_user')
+    def test_list_tags_counts_only_own_entries(self, current_user):
+        current_user.return_value = self.test_user
+        response = self.client.get("/api/v1/tags")
+        self.assertEqual([(tag["name"], tag["count"]) for tag in response.json["tags"]], [("tag1", 3)])
+        self.assertEqual(response.json["tags"][0]["last_used"], Entry.query.get(self.entry_ids[2]).created.isoformat())
+
+    @mock.patch('flask_login.utils._get_user')
+    def test_read_mood_series_counts_own_entries(self, current_user):
+        current_user.return_value = self.test_user
+        today = Entry.query.get(self.entry_ids[0]).created.date().isoformat()
+        response = self.client.get(f"/api/v1/moods?start={today}&end={today}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["bucket"], "day")
+        self.assertEqual(response.json["periods"], [today])
+        self.assertEqual(response.json["moods"], {"&#128512": [3]})
+        self.assertEqual(self.client.get("/api/v1/moods?start=yesterday").status_code, 400)
+
+    def test_unauthenticated_request_returns_401(self):
+        flask_app.config["LOGIN_DISABLED"] = False
+        try:
+            response = self.client.get("/api/v1/entries")
+        finally:
+            flask_app.config["LOGIN_DISABLED"] = True
+        self.assertEqual(response.status_code, 401)
+        self.assertIn("error", response.json)
+
+
+class ApiTestWriteEntries(TestCase):
+
+    def setUp(self) -> None:
+        self.client = set_up_flask_app_test_client()
+        self.test_user = create_test_user()
+        self.entry_ids = create_test_entries("1", 2)
+        self.other_entry_id = create_test_entries("2", 1)[0]
+
+    def tearDown(self) -> None:
+        tear_down_flask_test()
+
+    @mock.patch('flask_login.utils._get_user')
+    def test_create_batch_adds_entries(self, current_user):
+        current_user.return_value = self.test_user
+        response = self.client.post("/api/v1/entries", json={"entries": [
+            {"title": "New 1", "body": "Body", "tags": ["new"]}, {"title": "New 2", "body": "Body"}]})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.json["ids"]), 2)
+        self.assertEqual(Entry.query.get(response.json["ids"][0]).tags[0].name, "new")
+
+    @mock.patch('flask_login.utils._get_user')
+    def test_create_batch_with_invalid_entry_adds_none(self, current_user):
+        current_user.return_value = self.test_user
+        response = self.client.post("/api/v1/entries", json={"entries": [
+            {"title": "New", "body": "Body"}, {"title": "", "body": "Body"}]})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json["errors"][0]["index"], 1)
+        self.assertEqual(Entry.query.filter_by(user_id="1").count(), 2)
+
+    @mock.patch('flask_login.utils._get_user')
+    def test_create_batch_requires_json_body(self, current_user):
+        current_user.return_value = self.test_user
+        response = self.client.post("/api/v1/entries", data={"entries": "x"})
+        self.assertIn(response.status_code, (400, 415))
+
+    @mock.patch('flask_login.utils._get_user')
+    def test_update_batch_changes_only_given_fields(self, current_user):
+        current_user.return_value = self.test_user
+        response = self.client.patch("/api/v1/entries", json={"entries": [
+            {"id": self.entry_ids[0], "title": "Changed"}, {"id": self.entry_ids[1], "tags": ["other"]}]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Entry.query.get(self.entry_ids[0]).title, "Changed")
+        self.assertEqual(Entry.query.get(self.entry_ids[0]).body, "Body 0")
+        self.assertEqual([tag.name for tag in Entry.query.get(self.entry_ids[1]).tags], ["other"])
+
+    @mock.patch('flask_login.utils._get_user')
+    def test_update_batch_with_entry_from_different_user_updates_none(self, current_user):
+        current_user.return_value = self.test_user
+        response = self.client.patch("/api/v1/entries", json={"entries": [
+            {"id": self.entry_ids[0], "title": "Changed"}, {"id": self.other_entry_id, "title": "Changed"}]})
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(Entry.query.get(self.entry_ids[0]).title, "Title 0")
+
+    @mock.patch('flask_login.utils._get_user')
+    def test_delete_batch_removes_entries(self, current_user):
+        current_user.return_value = self.test_user
+        response = self.client.delete("/api/v1/entries", json={"ids": self.entry_ids})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Entry.query.filter_by(user_id="1").count(), 0)
+
+    @mock.patch('flask_login.utils._get_user')
+    def test_delete_batch_with_entry_from_different_user_deletes_none(self, current_user):
+        current_user.return_value = self.test_user
+        response = self.client.delete("/api/v1/entries", json={"ids": [self.entry_ids[0], self.other_entry_id]})
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(Entry.query.count(), 3)
+
+    @mock.patch('flask_login.utils._get_user')
+    def test_update_user_changes_timezone(self, current_user):
+        current_user.return_value = self.test_user
+        response = self.client.patch("/api/v1/user", json={"timezone": "Europe/Paris"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(User.query.get("1").timezone, "Europe/Paris")
+        self.assertEqual(self.client.patch("/api/v1/user", json={"timezone": "Mars/Base"}).status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
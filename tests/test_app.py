@@ -1,11 +1,16 @@
 import unittest
 from unittest import TestCase, mock
 import os
+import tempfile
+from datetime import datetime
+from sqlalchemy import inspect
 from personal_diary import db
-from personal_diary.app import flask_app
+from personal_diary.app import flask_app, create_app
+from personal_diary.jobs import BACKGROUND_JOBS
 from personal_diary.models import User
 from personal_diary.diary import Diary
 from werkzeug.security import generate_password_hash
+from tests.test_diary import capture_statements
 
 
 def set_up_flask_app_test_client():
@@ -27,11 +32,43 @@ def create_test_user():
 
 
 def tear_down_flask_test():
+    BACKGROUND_JOBS.join()
     db.drop_all()
     db.create_all()
     db.session.commit()
 
 
+class ApplicationTestFactory(TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.database_path = os.path.join(self.directory.name, "factory.db")
+        self.app = create_app({"SQLALCHEMY_DATABASE_URI": "sqlite:///" + self.database_path, "TESTING": True})
+
+    def tearDown(self) -> None:
+        with self.app.app_context():
+            db.session.remove()
+            db.engine.dispose()
+        self.directory.cleanup()
+
+    def test_create_app_applies_config(self):
+        self.assertTrue(self.app.config["TESTING"])
+        self.assertIsNot(self.app, flask_app)
+
+    def test_create_app_does_not_create_database(self):
+        self.assertFalse(os.path.exists(self.database_path))
+
+    def test_init_db_creates_tables(self):
+        with self.app.app_context():
+            result = self.app.test_cli_runner().invoke(args=["init-db"])
+            self.assertEqual(result.exit_code, 0)
+            self.assertTrue(inspect(db.engine).has_table("DiaryEntries"))
+
+    def test_login_page_served_before_database_is_used(self):
+        self.assertEqual(self.app.test_client().get("/login").status_code, 200)
+        self.assertFalse(os.path.exists(self.database_path))
+
+
 class ApplicationTestGETAll(TestCase):
 
     def setUp(self) -> None:
@@ -53,13 +90,188 @@ class ApplicationTestGETAll(TestCase):
         response = self.client.get("/")
         self.assertEqual(response.status_code, 200)
 
+    @mock.patch('flask_login.utils._get_user')
+    def test_get_with_mood_shows_only_entries_with_mood(self, current_user):
+        current_user.return_value = self.test_user
+        Diary.create_entry({"title": "Happy day", "body": "Body", "user_id": "1", "tags": [], "mood": "&#128512"})
+        Diary.create_entry({"title": "Sad day", "body": "Body", "user_id": "1", "tags": [], "mood": "&#128532"})
+        response = self.client.get("/?mood=5")
+        self.assertIn(b"Sad day", response.data)
+        self.assertNotIn(b"Happy day", response.data)
+        self.assertIn(b"Happy day", self.client.get("/?mood=99").data)
+
+    @mock.patch('flask_login.utils._get_user')
+    def test_get_with_fuzzy_search_finds_misspelled_title(self, current_user):
+        current_user.return_value = self.test_user
+        Diary.create_entry({"title": "A long Monday", "body": "Body", "user_id": "1", "tags": [], "mood": "&#128512"})
+        self.assertNotIn(b"A long Monday", self.client.get("/?search=mondy").data)
+        response = self.client.get("/?search=mondy&fuzzy=1")
+        self.assertIn(b"A long Monday", response.data)
+        self.assertIn(b"fuzzy=1", response.data)
+
+
+class ApplicationTestGETAllPaginated(TestCase):
+
+    def setUp(self) -> None:
+        self.client = set_up_flask_app_test_client()
+        self.test_user = create_test_user()
+        for idx in range(5):
+            Diary.create_entry({"title": f"Title {idx}", "body": "Body", "user_id": "1", "tags": [],
+                                "mood": "&#128512"})
+
+    def tearDown(self) -> None:
+        tear_down_flask_test()
+
+    @mock.patch('flask_login.utils._get_user')
+    def test_page_size_limits_entries_and_shows_total_count(self, current_user):
+        current_user.return_value = self.test_user
+        response = self.client.get("/?page_size=2")
+        self.assertEqual(response.data.count(b'card-entry-title'), 2)
+        self.assertIn(b'Entries: 5', response.data)
+        self.assertIn(b'cursor=', response.data)
+
+    @mock.patch('flask_login.utils._get_user')
+    def test_all_entries_on_one_page_has_no_cursor_links(self, current_user):
+        current_user.return_value = self.test_user
+        response = self.client.get("/")
+        self.assertEqual(response.data.count(b'card-entry-title'), 5)
+        self.assertNotIn(b'cursor=', response.data)
+
+
+class ApplicationTestGETAllQueryCount(TestCase):
+
+    def setUp(self) -> None:
+        self.client = set_up_flask_app_test_client()
+        self.test_user = create_test_user()
+
+    def tearDown(self) -> None:
+        tear_down_flask_test()
+
+    def create_entries(self, count: int) -> None:
+        for idx in range(count):
+            Diary.create_entry({"title": f"Title {idx}", "body": "Body", "user_id": "1",
+                                "tags": [f"tag{idx}", "shared"], "mood": "&#128512"})
+        db.session.expire_all()
+
+    def count_home_page_statements(self, path: str) -> int:
+        with capture_statements() as statements:
+            response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return len(statements)
+
+    @mock.patch('flask_login.utils._get_user')
+    def test_home_page_statement_count_does_not_grow_with_entries(self, current_user):
+        current_user.return_value = self.test_user
+        self.create_entries(2)
+        few_entries = self.count_home_page_statements("/")
+        self.create_entries(30)
+        self.assertEqual(self.count_home_page_statements("/"), few_entries)
+
+    @mock.patch('flask_login.utils._get_user')
+    def test_search_statement_count_does_not_grow_with_entries(self, current_user):
+        current_user.return_value = self.test_user
+        self.create_entries(2)
+        few_entries = self.count_home_page_statements("/shared?search=Title")
+        self.create_entries(30)
+        self.assertEqual(self.count_home_page_statements("/shared?search=Title"), few_entries)
+
+
+class ApplicationTestConditionalRequests(TestCase):
+
+    def setUp(self) -> None:
+        self.client = set_up_flask_app_test_client()
+        self.test_user = create_test_user()
+        self.entry_id = Diary.create_entry({"title": "Title", "body": "Body", "user_id": "1", "tags": [],
+                                            "mood": "&#128512"})["entry_id"]
+
+    def tearDown(self) -> None:
+        tear_down_flask_test()
+
+    def get_revalidated(self, path: str):
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return self.client.get(path, headers={"If-None-Match": response.headers["ETag"]})
+
+    @mock.patch('flask_login.utils._get_user')
+    def test_pages_are_private_and_must_be_revalidated(self, current_user):
+        current_user.return_value = self.test_user
+        for path in ["/", f"/entry/{self.entry_id}"]:
+            response = self.client.get(path)
+            self.assertIn("ETag", response.headers)
+            self.assertTrue(response.cache_control.private)
+            self.assertTrue(response.cache_control.no_cache)
+        self.assertIn("Last-Modified", self.client.get(f"/entry/{self.entry_id}").headers)
+
+    @mock.patch('flask_login.utils._get_user')
+    def test_unchanged_pages_return_not_modified_without_body(self, current_user):
+        current_user.return_value = self.test_user
+        for path in ["/", "/?search=title", f"/entry/{self.entry_id}"]:
+            response = self.get_revalidated(path)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.data, b"")
+
+    @mock.patch('flask_login.utils._get_user')
+    def test_if_modified_since_returns_not_modified(self, current_user):
+        current_user.return_value = self.test_user
+        response = self.client.get(f"/entry/{self.entry_id}")
+        response = self.client.get(f"/entry/{self.entry_id}",
+                                   headers={"If-Modified-Since": response.headers["Last-Modified"]})
+        self.assertEqual(response.status_code, 304)
+
+    @mock.patch('flask_login.utils._get_user')
+    def test_changed_entries_are_rendered_again(self, current_user):
+        current_user.return_value = self.test_user
+        list_etag = self.client.get("/").headers["ETag"]
+        entry_etag = self.client.get(f"/entry/{self.entry_id}").headers["ETag"]
+        Diary.update_entry({"entry_id": self.entry_id, "title": "New title", "body": "Body", "tags": [],
+                            "mood": "&#128512"})
+        self.assertEqual(self.client.get("/", headers={"If-None-Match": list_etag}).status_code, 200)
+        self.assertEqual(self.client.get(f"/entry/{self.entry_id}",
+                                         headers={"If-None-Match": entry_etag}).status_code, 200)
+
+    @mock.patch('flask_login.utils._get_user')
+    def test_deleted_entry_changes_list_page(self, current_user):
+        current_user.return_value = self.test_user
+        Diary.create_entry({"title": "Second", "body": "Body", "user_id": "1", "tags": [], "mood": "&#128512"})
+        list_etag = self.client.get("/").headers["ETag"]
+        Diary.delete_entry({"entry_id": self.entry_id})
+        self.assertEqual(self.client.get("/", headers={"If-None-Match": list_etag}).status_code, 200)
+
+    @mock.patch('flask_login.utils._get_user')
+    def test_list_page_is_not_validated_by_modified_date(self, current_user):
+        current_user.return_value = self.test_user
+        response = self.client.get("/")
+        self.assertNotIn("Last-Modified", response.headers)
+        Diary.create_entry({"title": "Second", "body": "Body", "user_id": "1", "tags": [], "mood": "&#128512"})
+        Diary.delete_entry({"entry_id": self.entry_id})
+        self.assertEqual(self.client.get("/", headers={"If-Modified-Since": "Fri, 01 Jan 2100 00:00:00 GMT"})
+                         .status_code, 200)
+
+    @mock.patch('flask_login.utils._get_user')
+    def test_new_asset_build_changes_pages(self, current_user):
+        current_user.return_value = self.test_user
+        etags = {path: self.client.get(path).headers["ETag"] for path in ["/", f"/entry/{self.entry_id}"]}
+        with mock.patch.dict(flask_app.extensions, {"static_assets_version": "rebuilt"}):
+            for path, etag in etags.items():
+                self.assertEqual(self.client.get(path, headers={"If-None-Match": etag}).status_code, 200)
+
+    @mock.patch('flask_login.utils._get_user')
+    def test_pending_flash_messages_are_always_rendered(self, current_user):
+        current_user.return_value = self.test_user
+        etag = self.client.get("/").headers["ETag"]
+        with self.client.session_transaction() as client_session:
+            client_session["_flashes"] = [("alert-success", "Entry created!")]
+        response = self.client.get("/", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"Entry created!", response.data)
+
 
 class ApplicationTestGETAllWithTag(TestCase):
 
     def setUp(self) -> None:
         self.client = set_up_flask_app_test_client()
         self.test_user = create_test_user()
-        Diary.create_entry({"title": "Title", "body": "Body", "user_id": "1", "tags": ["tag1"], "mood": "128512"})
+        Diary.create_entry({"title": "Title", "body": "Body", "user_id": "1", "tags": ["tag1"], "mood": "&#128512"})
 
     def tearDown(self) -> None:
         tear_down_flask_test()
@@ -76,6 +288,19 @@ class ApplicationTestGETAllWithTag(TestCase):
         response = self.client.get("/tag1")
         self.assertEqual(response.status_code, 200)
 
+    @mock.patch('flask_login.utils._get_user')
+    def test_entries_link_to_their_tags(self, current_user):
+        current_user.return_value = self.test_user
+        response = self.client.get("/")
+        self.assertIn(b'href="/tag1"', response.data)
+        self.assertIn(b'#tag1', response.data)
+
+    @mock.patch('flask_login.utils._get_user')
+    def test_sidebar_shows_tag_counts(self, current_user):
+        current_user.return_value = self.test_user
+        response = self.client.get("/")
+        self.assertIn(b'#tag1 (1)', response.data)
+
 
 class ApplicationTestReadEntryGET(TestCase):
 
@@ -420,6 +645,17 @@ class ApplicationTestLoginPOST(TestCase):
         ), follow_redirects=True)
         self.assertEqual(response.request.path, "/")
 
+    def test_deleted_user_stays_on_login_page(self):
+        user = User(id="1", username="username", name="Test User", password=generate_password_hash("password123"),
+                    deleted_at=datetime.now())
+        db.session.add(user)
+        db.session.commit()
+        response = self.client.post('/login', data=dict(
+            username="username",
+            password="password123"
+        ), follow_redirects=True)
+        self.assertEqual(response.request.path, "/login")
+
     def test_empty_login_stays_on_login_page(self):
         response = self.client.post('/login', follow_redirects=True)
         self.assertEqual(response.request.path, "/login")
@@ -445,6 +681,44 @@ class ApplicationTestLoginPOST(TestCase):
         self.assertEqual(response.request.path, "/login")
 
 
+class ApplicationTestSettings(TestCase):
+
+    def setUp(self) -> None:
+        self.client = set_up_flask_app_test_client()
+        self.test_user = create_test_user()
+
+    def tearDown(self) -> None:
+        tear_down_flask_test()
+
+    @mock.patch('flask_login.utils._get_user')
+    def test_get_renders_settings_page(self, current_user):
+        current_user.return_value = self.test_user
+        response = self.client.get("/settings")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Test User', response.data)
+
+    @mock.patch('flask_login.utils._get_user')
+    def test_successful_update_redirects_to_home(self, current_user):
+        current_user.return_value = self.test_user
+        response = self.client.post('/settings', data=dict(
+            full_name="New Name",
+            timezone="Europe/Paris"
+        ), follow_redirects=True)
+        self.assertEqual(response.request.path, "/")
+        self.assertEqual(User.query.get("1").timezone, "Europe/Paris")
+
+    @mock.patch('flask_login.utils._get_user')
+    def test_unknown_timezone_stays_on_settings_page(self, current_user):
+        current_user.return_value = self.test_user
+        response = self.client.post('/settings', data=dict(
+            full_name="New Name",
+            timezone="Not/A_Timezone"
+        ), follow_redirects=True)
+        self.assertEqual(response.request.path, "/settings")
+        self.assertIn(b'Unknown timezone', response.data)
+        self.assertIsNone(User.query.get("1").timezone)
+
+
 class ApplicationTestDeleteUserGET(TestCase):
 
     def setUp(self) -> None:
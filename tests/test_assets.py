@@ -0,0 +1,116 @@
+import os
+import tempfile
+import unittest
+from flask import Flask, url_for
+from personal_diary import assets
+from personal_diary.assets import StaticAssets, BUILD_FOLDER
+
+
+def create_static_folder(directory: str) -> str:
+    static_folder = os.path.join(directory, "static")
+    os.makedirs(os.path.join(static_folder, "editor", "plugins"))
+    with open(os.path.join(static_folder, "style.css"), "w") as file:
+        file.write("body { margin: 0; }\n" * 100)
+    with open(os.path.join(static_folder, "editor", "editor.js"), "w") as file:
+        file.write("var editor = {};\n" * 100)
+    with open(os.path.join(static_folder, "editor", "plugins", "plugin.js"), "w") as file:
+        file.write("editor.plugin = 1;\n" * 100)
+    with open(os.path.join(static_folder, "editor", "icon.png"), "wb") as file:
+        file.write(b"\x89PNG" + bytes(range(256)))
+    return static_folder
+
+
+class StaticAssetsTestBuild(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.static_folder = create_static_folder(self.directory.name)
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_build_fingerprints_files_and_folders(self):
+        manifest = StaticAssets.build(self.static_folder)
+        self.assertRegex(manifest["style.css"], r"^build/style\.[0-9a-f]{12}\.css$")
+        editor_folder = manifest["editor/editor.js"].rsplit("/", 1)[0]
+        self.assertRegex(editor_folder, r"^build/editor\.[0-9a-f]{12}$")
+        self.assertEqual(manifest["editor/plugins/plugin.js"], editor_folder + "/plugins/plugin.js")
+        for built_path in manifest.values():
+            self.assertTrue(os.path.isfile(os.path.join(self.static_folder, built_path)))
+
+    def test_build_precompresses_only_text_files(self):
+        manifest = StaticAssets.build(self.static_folder)
+        built_script = os.path.join(self.static_folder, manifest["editor/editor.js"])
+        self.assertTrue(os.path.isfile(built_script + ".gz"))
+        self.assertEqual(os.path.isfile(built_script + ".br"), assets.brotli is not None)
+        self.assertFalse(os.path.exists(os.path.join(self.static_folder, manifest["editor/icon.png"]) + ".gz"))
+
+    def test_changing_a_file_changes_its_folder_hash(self):
+        first_manifest = StaticAssets.build(self.static_folder)
+        with open(os.path.join(self.static_folder, "editor", "plugins", "plugin.js"), "a") as file:
+            file.write("editor.plugin = 2;\n")
+        second_manifest = StaticAssets.build(self.static_folder)
+        self.assertNotEqual(first_manifest["editor/editor.js"], second_manifest["editor/editor.js"])
+        self.assertEqual(first_manifest["style.css"], second_manifest["style.css"])
+        self.assertFalse(os.path.exists(os.path.join(self.static_folder, first_manifest["editor/editor.js"])))
+
+
+class StaticAssetsTestServe(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        static_folder = create_static_folder(self.directory.name)
+        self.manifest = StaticAssets.build(static_folder)
+        self.app = Flask(__name__, static_folder=static_folder)
+        StaticAssets.init_app(self.app)
+        self.client = self.app.test_client()
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_url_for_returns_fingerprinted_path(self):
+        with self.app.test_request_context():
+            self.assertEqual(url_for("static", filename="editor/editor.js"),
+                             "/static/" + self.manifest["editor/editor.js"])
+            self.assertEqual(url_for("static", filename="missing.js"), "/static/missing.js")
+
+    def test_version_changes_with_the_build(self):
+        version = StaticAssets.version(self.app)
+        with open(os.path.join(self.app.static_folder, "style.css"), "a") as file:
+            file.write("p { margin: 0; }\n")
+        StaticAssets.build(self.app.static_folder)
+        rebuilt_app = Flask(__name__, static_folder=self.app.static_folder)
+        StaticAssets.init_app(rebuilt_app)
+        self.assertNotEqual(StaticAssets.version(rebuilt_app), version)
+
+    def test_serves_gzip_variant_with_immutable_headers(self):
+        response = self.client.get("/static/" + self.manifest["style.css"], headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content_encoding, "gzip")
+        self.assertEqual(response.mimetype, "text/css")
+        self.assertIn("Accept-Encoding", response.vary)
+        self.assertTrue(response.cache_control.immutable)
+        self.assertEqual(response.cache_control.max_age, assets.IMMUTABLE_MAX_AGE)
+
+    @unittest.skipIf(assets.brotli is None, "brotli is not installed")
+    def test_serves_brotli_variant_when_accepted(self):
+        response = self.client.get("/static/" + self.manifest["style.css"], headers={"Accept-Encoding": "gzip, br"})
+        self.assertEqual(response.content_encoding, "br")
+
+    def test_serves_uncompressed_file_without_accept_encoding(self):
+        response = self.client.get("/static/" + self.manifest["style.css"])
+        self.assertIsNone(response.content_encoding)
+        self.assertEqual(response.get_data(as_text=True), "body { margin: 0; }\n" * 100)
+
+    def test_unbuilt_path_is_served_without_immutable_caching(self):
+        response = self.client.get("/static/style.css")
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.cache_control.immutable)
+        response.close()
+
+    def test_path_outside_static_folder_returns_404(self):
+        self.assertEqual(self.client.get(f"/static/{BUILD_FOLDER}/../../secret").status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
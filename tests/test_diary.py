@@ -1,9 +1,11 @@
 import unittest
 import os
+from contextlib import contextmanager
 from datetime import datetime, timedelta
-from personal_diary.diary import Diary
+from sqlalchemy import event, text
+from personal_diary.diary import Diary, EntrySummary, LATEST_ENTRY_CACHE, TAG_ID_CACHE
 from personal_diary.app import flask_app
-from personal_diary.models import Entry, Tag
+from personal_diary.models import Entry, Tag, TagUsage
 from personal_diary import db
 
 basedir = os.path.abspath(os.path.dirname(__file__))
@@ -12,11 +14,28 @@ flask_app.app_context().push()
 db.create_all()
 
 
+@contextmanager
+def capture_statements():
+    """
+    Collects the SQL statements sent to the database within the block.
+    """
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+
+
 class DiaryTestCreateEntry(unittest.TestCase):
 
     def setUp(self) -> None:
         self.valid_request = {"title": "Title", "body": "Body", "user_id": "1", "tags": ["tag1", "tag2", "tag3"],
-                              "mood": "128512"}
+                              "mood": "&#128512"}
 
     def tearDown(self) -> None:
         db.drop_all()
@@ -60,6 +79,7 @@ class DiaryTestCreateEntry(unittest.TestCase):
 class DiaryTestAddTagsToEntry(unittest.TestCase):
 
     def tearDown(self) -> None:
+        db.session.rollback()
         db.drop_all()
         db.create_all()
         db.session.commit()
@@ -96,6 +116,68 @@ class DiaryTestAddTagsToEntry(unittest.TestCase):
         db.session.commit()
         self.assertEqual(len(Tag.query.all()), 1)
 
+    def test_duplicate_tag_names_are_attached_once(self):
+        entry = Entry(id="1", title="Title", body="Body", created=datetime.now(), user_id="1", mood="&#128512")
+        Diary.add_tags_to_entry(entry, ["tag1", "tag2", "tag1"])
+        db.session.add(entry)
+        db.session.commit()
+        self.assertEqual([tag.name for tag in Entry.query.get("1").tags], ["tag1", "tag2"])
+
+    def test_existing_tags_are_resolved_with_one_query(self):
+        Diary.resolve_tag_ids(["tag1", "tag2", "tag3"])
+        db.session.commit()
+        TAG_ID_CACHE.clear()
+        with capture_statements() as statements:
+            Diary.resolve_tag_ids(["tag1", "tag2", "tag3"])
+        self.assertEqual(len(statements), 1)
+        self.assertIn("IN", statements[0])
+
+    def test_cached_tags_are_checked_with_one_query(self):
+        tag_ids = Diary.resolve_tag_ids(["tag1", "tag2"])
+        db.session.commit()
+        with capture_statements() as statements:
+            self.assertEqual(Diary.resolve_tag_ids(["tag2", "tag1"]), {"tag2": tag_ids["tag2"], "tag1": tag_ids["tag1"]})
+        self.assertEqual(len(statements), 1)
+        self.assertNotIn("INSERT", statements[0])
+
+    def test_deleted_cached_tag_is_created_again(self):
+        tag_ids = Diary.resolve_tag_ids(["tag1", "tag2"])
+        db.session.commit()
+        Tag.query.filter_by(name="tag1").delete()
+        db.session.commit()
+        resolved = Diary.resolve_tag_ids(["tag1", "tag2"])
+        db.session.commit()
+        self.assertEqual(resolved["tag2"], tag_ids["tag2"])
+        self.assertEqual(resolved["tag1"], Tag.query.filter_by(name="tag1").one().id)
+        self.assertEqual(TAG_ID_CACHE.get("tag1"), resolved["tag1"])
+
+    def test_tags_are_cached_only_once_committed(self):
+        Diary.resolve_tag_ids(["tag1"])
+        self.assertIsNone(TAG_ID_CACHE.get("tag1"))
+        db.session.commit()
+        self.assertIsNotNone(TAG_ID_CACHE.get("tag1"))
+
+    def test_tag_of_rolled_back_transaction_is_not_cached(self):
+        Diary.resolve_tag_ids(["tag1"])
+        db.session.rollback()
+        self.assertIsNone(TAG_ID_CACHE.get("tag1"))
+        entry_id = Diary.create_entry({"title": "Title", "body": "Body", "user_id": "1", "tags": ["tag1"],
+                                       "mood": "&#128512"})["entry_id"]
+        self.assertEqual([tag.name for tag in Entry.query.get(entry_id).tags], ["tag1"])
+
+    def test_tag_inserted_by_another_writer_is_not_duplicated(self):
+        db.session.add(Tag(name="tag1"))
+        db.session.commit()
+        Diary.insert_missing_tags(["tag1", "tag2"])
+        db.session.commit()
+        self.assertEqual(sorted(tag.name for tag in Tag.query.all()), ["tag1", "tag2"])
+
+    def test_dropping_tag_table_clears_cache(self):
+        Diary.resolve_tag_ids(["tag1"])
+        db.session.commit()
+        db.drop_all()
+        self.assertEqual(len(TAG_ID_CACHE), 0)
+
 
 class DiaryTestReadSingleEntry(unittest.TestCase):
 
@@ -380,8 +462,102 @@ class DiaryTestSortEntries(unittest.TestCase):
             entry_id = entry_id + 1
 
 
+class DiaryTestReadEntriesPage(unittest.TestCase):
+
+    def setUp(self) -> None:
+        for entry_id in range(7):
+            test_entry = Entry(id=str(entry_id), title="Title", body="Body", created=datetime(2022, 1, 1 + entry_id),
+                               modified=datetime(2022, 2, 7 - entry_id), user_id="1", mood="&#128512")
+            db.session.add(test_entry)
+        db.session.commit()
+
+    def tearDown(self) -> None:
+        db.session.query(Entry).delete()
+        db.session.commit()
+
+    @staticmethod
+    def read_all_pages(sort_type, page_size):
+        pages = []
+        page = Diary.read_entries_page("1", "", None, sort_type, None, page_size)
+        pages.append(list(page["entries"].keys()))
+        while page["next_cursor"]:
+            page = Diary.read_entries_page("1", "", None, sort_type, page["next_cursor"], page_size)
+            pages.append(list(page["entries"].keys()))
+        return pages, page
+
+    def test_first_page_returns_page_size_entries_and_total_count(self):
+        page = Diary.read_entries_page("1", "", None, "created_desc", None, 3)
+        self.assertEqual(list(page["entries"].keys()), ["6", "5", "4"])
+        self.assertEqual(page["count"], 7)
+        self.assertIsNone(page["prev_cursor"])
+        self.assertIsNotNone(page["next_cursor"])
+
+    def test_next_cursors_walk_every_sort_type_in_order(self):
+        for sort_type in ["created_desc", "created_asc", "modified_desc", "modified_asc"]:
+            pages, last_page = DiaryTestReadEntriesPage.read_all_pages(sort_type, 3)
+            expected = [entry.id for entry in Diary.search_entries("", "1", None, sort_type).values()]
+            self.assertEqual([len(page) for page in pages], [3, 3, 1])
+            self.assertEqual(sum(pages, []), expected)
+            self.assertIsNone(last_page["next_cursor"])
+
+    def test_mood_filter_reads_mood_index(self):
+        Entry.query.get("3").mood = "&#128532"
+        db.session.commit()
+        page = Diary.read_entries_page("1", "", None, "created_desc", None, 3, mood="&#128532")
+        self.assertEqual(list(page["entries"].keys()), ["3"])
+        self.assertEqual(page["count"], 1)
+
+        query = Diary.sort_entries(Diary.filter_entries("1", "", None, "&#128532"), "created_desc").statement
+        plan = db.session.execute(text("EXPLAIN QUERY PLAN " + str(query.compile(
+            db.engine, compile_kwargs={"literal_binds": True})))).all()
+        self.assertIn("ix_DiaryEntries_user_id_mood_created", " ".join(row[-1] for row in plan))
+
+    def test_prev_cursor_returns_previous_page(self):
+        first_page = Diary.read_entries_page("1", "", None, "created_asc", None, 3)
+        second_page = Diary.read_entries_page("1", "", None, "created_asc", first_page["next_cursor"], 3)
+        self.assertEqual(list(second_page["entries"].keys()), ["3", "4", "5"])
+
+        previous_page = Diary.read_entries_page("1", "", None, "created_asc", second_page["prev_cursor"], 3)
+        self.assertEqual(list(previous_page["entries"].keys()), ["0", "1", "2"])
+        self.assertIsNone(previous_page["prev_cursor"])
+        self.assertEqual(previous_page["next_cursor"], first_page["next_cursor"])
+
+    def test_entries_with_same_date_are_not_skipped(self):
+        db.session.query(Entry).update({Entry.created: datetime(2022, 1, 1)})
+        db.session.commit()
+        pages, _ = DiaryTestReadEntriesPage.read_all_pages("created_desc", 2)
+        self.assertEqual(sorted(sum(pages, [])), [str(entry_id) for entry_id in range(7)])
+
+    def test_search_query_filters_page_and_count(self):
+        Diary.update_entry({"entry_id": "2", "title": "Special", "body": "Body", "tags": [], "mood": "&#128512"})
+        page = Diary.read_entries_page("1", "special", None, "created_desc", None, 3)
+        self.assertEqual(list(page["entries"].keys()), ["2"])
+        self.assertEqual(page["count"], 1)
+        self.assertIsNone(page["next_cursor"])
+
+    def test_malformed_cursor_returns_first_page(self):
+        page = Diary.read_entries_page("1", "", None, "created_desc", "not-a-cursor", 3)
+        self.assertEqual(list(page["entries"].keys()), ["6", "5", "4"])
+
+    def test_page_entries_are_summaries_with_tag_names_and_no_body(self):
+        Diary.add_tags_to_entry(Entry.query.get("6"), ["school", "fun"])
+        db.session.commit()
+        db.session.expunge_all()
+        entry = Diary.read_entries_page("1", "", None, "created_desc", None, 3)["entries"]["6"]
+        self.assertIsInstance(entry, EntrySummary)
+        self.assertEqual(entry.title, "Title")
+        self.assertEqual(entry.created, datetime(2022, 1, 7))
+        self.assertEqual(sorted(entry.tags), ["fun", "school"])
+        self.assertFalse(hasattr(entry, "body"))
+        self.assertEqual(len(db.session.identity_map), 0)
+
+
 class DiaryTestCheckEntryForToday(unittest.TestCase):
 
+    def setUp(self) -> None:
+        # other tests delete entries directly through the session, which the cache cannot see
+        LATEST_ENTRY_CACHE.clear()
+
     def tearDown(self) -> None:
         db.session.query(Entry).delete()
         db.session.commit()
@@ -417,6 +593,89 @@ class DiaryTestCheckEntryForToday(unittest.TestCase):
         DiaryTestCheckEntryForToday.add_entry_for_today()
         self.assertEqual(Diary.check_entry_for_today(user_id="1"), True)
 
+    def test_entry_for_other_user_returns_false(self):
+        DiaryTestCheckEntryForToday.add_entry_for_today()
+        self.assertEqual(Diary.check_entry_for_today(user_id="2"), False)
+
+    def test_entry_before_start_of_day_in_timezone_returns_false(self):
+        start_of_day, _ = Diary.day_bounds("Pacific/Kiritimati")
+        db.session.add(Entry(id="5", title="Title", body="Body", created=start_of_day - timedelta(minutes=1),
+                             user_id="1", mood="&#128512"))
+        db.session.commit()
+        self.assertEqual(Diary.check_entry_for_today(user_id="1", timezone="Pacific/Kiritimati"), False)
+
+    def test_entry_at_start_of_day_in_timezone_returns_true(self):
+        start_of_day, _ = Diary.day_bounds("Etc/GMT+12")
+        db.session.add(Entry(id="5", title="Title", body="Body", created=start_of_day, user_id="1", mood="&#128512"))
+        db.session.commit()
+        self.assertEqual(Diary.check_entry_for_today(user_id="1", timezone="Etc/GMT+12"), True)
+
+    def test_day_bounds_contain_now_and_span_one_day(self):
+        for timezone in [None, "UTC", "America/New_York", "Asia/Kolkata", "Not/A_Timezone"]:
+            start_of_day, start_of_next_day = Diary.day_bounds(timezone)
+            self.assertTrue(start_of_day <= datetime.now() < start_of_next_day)
+            self.assertTrue(timedelta(hours=23) <= start_of_next_day - start_of_day <= timedelta(hours=25))
+
+    def test_check_after_create_entry_does_not_query_database(self):
+        Diary.create_entry({"title": "Title", "body": "Body", "user_id": "1", "tags": [], "mood": "&#128512"})
+        with capture_statements() as statements:
+            self.assertEqual(Diary.check_entry_for_today(user_id="1"), True)
+        self.assertEqual(statements, [])
+
+    def test_check_after_delete_entry_returns_false(self):
+        entry_id = Diary.create_entry({"title": "Title", "body": "Body", "user_id": "1", "tags": [],
+                                       "mood": "&#128512"})["entry_id"]
+        self.assertEqual(Diary.check_entry_for_today(user_id="1"), True)
+        Diary.delete_entry({"entry_id": entry_id})
+        self.assertEqual(Diary.check_entry_for_today(user_id="1"), False)
+
+
+class DiaryTestTagUsage(unittest.TestCase):
+
+    def tearDown(self) -> None:
+        db.drop_all()
+        db.create_all()
+        db.session.commit()
+
+    @staticmethod
+    def read_counts(user_id: str = "1") -> dict:
+        return {tag.name: tag.entry_count for tag in Diary.read_tag_usage(user_id)}
+
+    @staticmethod
+    def create_entry(tags: list, user_id: str = "1") -> str:
+        return Diary.create_entry({"title": "Title", "body": "Body", "user_id": user_id, "tags": tags,
+                                   "mood": "&#128512"})["entry_id"]
+
+    def test_create_entry_counts_tags(self):
+        self.create_entry(["tag1", "tag2"])
+        self.create_entry(["tag1"])
+        self.create_entry(["tag1"], user_id="2")
+        self.assertEqual(self.read_counts(), {"tag1": 2, "tag2": 1})
+        self.assertEqual([tag.name for tag in Diary.read_tag_usage("1", limit=1)], ["tag1"])
+
+    def test_update_entry_moves_counts_between_tags(self):
+        entry_id = self.create_entry(["tag1", "tag2"])
+        Diary.update_entry({"entry_id": entry_id, "title": "Title", "body": "Body", "tags": ["tag2", "tag3"],
+                            "mood": "&#128512"})
+        self.assertEqual(self.read_counts(), {"tag2": 1, "tag3": 1})
+
+    def test_delete_entry_removes_unused_tags(self):
+        first_id = self.create_entry(["tag1", "tag2"])
+        self.create_entry(["tag1"])
+        Diary.delete_entry({"entry_id": first_id})
+        self.assertEqual(self.read_counts(), {"tag1": 1})
+
+    def test_rebuild_matches_maintained_counts(self):
+        self.create_entry(["tag1", "tag2"])
+        self.create_entry(["tag1"], user_id="2")
+        maintained = {(row.user_id, row.tag_id): (row.entry_count, row.last_used) for row in TagUsage.query}
+        TagUsage.query.delete()
+        db.session.commit()
+
+        self.assertEqual(Diary.rebuild_tag_usage(), 3)
+        rebuilt = {(row.user_id, row.tag_id): (row.entry_count, row.last_used) for row in TagUsage.query}
+        self.assertEqual(rebuilt, maintained)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,10 +1,17 @@
 import unittest
 import os
-from personal_diary.diary_user import DiaryUser
+from datetime import datetime, timedelta
+from unittest import mock
+from flask import session
+from personal_diary.diary import Diary, TAG_ID_CACHE
+from personal_diary.diary_user import DiaryUser, DELETED_USER_IDS_CACHE, USER_CACHE, USER_CACHE_TTL, \
+    SESSION_IDENTITY_KEY
 from personal_diary.app import flask_app
-from personal_diary.models import User
+from personal_diary.jobs import BACKGROUND_JOBS
+from personal_diary.models import Entry, MoodRollup, Tag, TagUsage, User, tags
 from personal_diary import db
 from werkzeug.security import generate_password_hash
+from tests.test_diary import capture_statements
 
 basedir = os.path.abspath(os.path.dirname(__file__))
 flask_app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(basedir, "test_database.db")
@@ -56,6 +63,29 @@ class DiaryUserTestCreateUser(unittest.TestCase):
             self.assertEqual(db_entry.password, self.valid_request["password"])
             
             
+class DiaryUserTestUpdateUser(unittest.TestCase):
+
+    def setUp(self) -> None:
+        db.session.add(User(id="1", username="username", name="User", password=generate_password_hash("1")))
+        db.session.commit()
+
+    def tearDown(self) -> None:
+        db.session.query(User).delete()
+        db.session.commit()
+
+    def test_update_sets_name_and_timezone(self):
+        response = DiaryUser.update_user({"user_id": "1", "full_name": " New Name ", "timezone": "Asia/Tokyo"})
+        self.assertDictEqual(response, {"user_id": "1"})
+        user = User.query.get("1")
+        self.assertEqual(user.name, "New Name")
+        self.assertEqual(user.timezone, "Asia/Tokyo")
+
+    def test_update_with_empty_timezone_clears_timezone(self):
+        DiaryUser.update_user({"user_id": "1", "full_name": "User", "timezone": "Asia/Tokyo"})
+        DiaryUser.update_user({"user_id": "1", "full_name": "User", "timezone": ""})
+        self.assertIsNone(User.query.get("1").timezone)
+
+
 class DiaryUserTestDeleteUser(unittest.TestCase):
 
     def tearDown(self) -> None:
@@ -80,14 +110,198 @@ class DiaryUserTestDeleteUser(unittest.TestCase):
     def test_delete_empties_users_when_only_one_user(self):
         test_user = self.populate_single_user()
         self.assertDictEqual(DiaryUser.delete_user({"user": test_user}), {"user_id": "1"})
-        self.assertIsNone(User.query.get("1"))
+        BACKGROUND_JOBS.join()
+        db.session.remove()
+        self.assertIsNone(User.query.get("1").username)
+        self.assertIsNone(DiaryUser.load_user("1"))
 
     def test_delete_with_two_existing_users_only_deletes_specified_user(self):
         self.populate_multiple_users()
         for user_id in range(5):
             test_user = User.query.get(str(user_id))
             self.assertDictEqual(DiaryUser.delete_user({"user": test_user}), {"user_id": str(user_id)})
-        self.assertEqual(User.query.all(), [])
+        BACKGROUND_JOBS.join()
+        db.session.remove()
+        self.assertEqual([user.username for user in User.query], [None] * 5)
+
+    def test_delete_marks_user_deleted_before_purging(self):
+        test_user = self.populate_single_user()
+        with mock.patch.object(BACKGROUND_JOBS, "submit") as submit:
+            DiaryUser.delete_user({"user": test_user})
+        db.session.remove()
+        self.assertIsNotNone(User.query.get("1").deleted_at)
+        self.assertIsNone(DiaryUser.load_user("1"))
+        submit.assert_called_once_with(DiaryUser.purge_user, "1")
+
+
+class DiaryUserTestPurgeUser(unittest.TestCase):
+
+    def setUp(self) -> None:
+        for user_id in ("1", "2"):
+            db.session.add(User(id=user_id, username=f"username{user_id}", name="User", password="password"))
+        db.session.commit()
+        for number in range(5):
+            Diary.create_entry({"title": "Title", "body": "Body", "user_id": "1", "tags": ["shared", "own"],
+                                "mood": "&#128512"})
+        Diary.create_entry({"title": "Title", "body": "Body", "user_id": "2", "tags": ["shared"], "mood": "&#128512"})
+
+    def tearDown(self) -> None:
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+        db.session.commit()
+
+    def test_purge_removes_entries_and_counts(self):
+        entry_ids = [entry.id for entry in Entry.query.filter_by(user_id="1")]
+        User.query.filter_by(id="1").update({"deleted_at": datetime.now()})
+        db.session.commit()
+        self.assertEqual(DiaryUser.purge_user("1", chunk_size=2), 5)
+        db.session.remove()
+
+        self.assertIsNone(User.query.get("1").username)
+        self.assertEqual(Entry.query.filter_by(user_id="1").count(), 0)
+        self.assertEqual(db.session.query(tags).filter(tags.c.entry_id.in_(entry_ids)).count(), 0)
+        self.assertEqual(TagUsage.query.filter_by(user_id="1").count(), 0)
+        self.assertEqual(MoodRollup.query.filter_by(user_id="1").count(), 0)
+        self.assertEqual(Entry.query.filter_by(user_id="2").count(), 1)
+
+    def test_purge_removes_tombstones_once_cached_identities_expired(self):
+        deleted_at = datetime.now() - timedelta(seconds=USER_CACHE_TTL + 1)
+        User.query.filter_by(id="1").update({"deleted_at": deleted_at})
+        db.session.add(User(id="3", deleted_at=deleted_at))
+        db.session.commit()
+        DiaryUser.purge_user("1")
+        db.session.remove()
+        self.assertEqual([user.id for user in User.query], ["2"])
+
+    def test_purge_leaves_users_not_marked_deleted(self):
+        self.assertEqual(DiaryUser.purge_user("1"), 0)
+        self.assertEqual(Entry.query.filter_by(user_id="1").count(), 5)
+
+    def test_purge_deleted_users_purges_every_marked_user(self):
+        User.query.update({"deleted_at": datetime.now()})
+        db.session.commit()
+        self.assertEqual(sorted(DiaryUser.purge_deleted_users()), ["1", "2"])
+        db.session.remove()
+        self.assertEqual(Entry.query.count(), 0)
+
+    def test_purge_removes_orphaned_tags(self):
+        User.query.filter_by(id="1").update({"deleted_at": datetime.now()})
+        db.session.commit()
+        DiaryUser.purge_user("1")
+        db.session.remove()
+        self.assertEqual([tag.name for tag in Tag.query], ["shared"])
+        self.assertIsNone(TAG_ID_CACHE.get("own"))
+
+    def test_tag_removed_while_cached_by_another_process_is_created_again(self):
+        tag_id = TAG_ID_CACHE.get("own")
+        User.query.filter_by(id="1").update({"deleted_at": datetime.now()})
+        db.session.commit()
+        DiaryUser.purge_user("1")
+        db.session.remove()
+        TAG_ID_CACHE.set("own", tag_id)
+        entry_id = Diary.create_entry({"title": "Title", "body": "Body", "user_id": "2", "tags": ["own"],
+                                       "mood": "&#128512"})["entry_id"]
+        tag = Entry.query.get(entry_id).tags[0]
+        self.assertEqual(tag.name, "own")
+        self.assertEqual(Tag.query.get(tag.id).name, "own")
+
+    def test_purge_schedules_removal_of_the_tombstone(self):
+        User.query.filter_by(id="1").update({"deleted_at": datetime.now()})
+        db.session.commit()
+        with mock.patch.object(BACKGROUND_JOBS, "submit_later") as submit_later:
+            DiaryUser.purge_user("1")
+        submit_later.assert_called_once_with(USER_CACHE_TTL, DiaryUser.remove_tombstones)
+        db.session.remove()
+        self.assertEqual(DiaryUser.remove_tombstones(), 0)
+        User.query.filter_by(id="1").update({"deleted_at": datetime.now() - timedelta(seconds=USER_CACHE_TTL + 1)})
+        db.session.commit()
+        self.assertEqual(DiaryUser.remove_tombstones(), 1)
+        db.session.remove()
+        self.assertEqual([user.id for user in User.query], ["2"])
+
+
+class DiaryUserTestLoadUser(unittest.TestCase):
+
+    def setUp(self) -> None:
+        USER_CACHE.clear()
+        DELETED_USER_IDS_CACHE.clear()
+        db.session.add(User(id="1", username="username", name="User", password=generate_password_hash("1")))
+        db.session.commit()
+        db.session.remove()
+
+    def tearDown(self) -> None:
+        BACKGROUND_JOBS.join()
+        db.session.remove()
+        db.session.query(User).delete()
+        db.session.commit()
+        USER_CACHE.clear()
+        DELETED_USER_IDS_CACHE.clear()
+
+    @staticmethod
+    def delete_in_another_process(user_id: str) -> None:
+        User.query.filter_by(id=user_id).update({"deleted_at": datetime.now()})
+        db.session.commit()
+        db.session.remove()
+        # the ids of the deleted users are read again once REVOCATION_CHECK_INTERVAL has passed
+        DELETED_USER_IDS_CACHE.clear()
+
+    def test_load_missing_user_returns_none(self):
+        self.assertIsNone(DiaryUser.load_user("2"))
+
+    def test_second_load_does_not_query_database(self):
+        DiaryUser.load_user("1")
+        DiaryUser.read_deleted_user_ids()
+        db.session.remove()
+        with capture_statements() as statements:
+            user = DiaryUser.load_user("1")
+            self.assertEqual(user.name, "User")
+        self.assertEqual(statements, [])
+
+    def test_cached_user_still_loads_password(self):
+        DiaryUser.load_user("1")
+        db.session.remove()
+        self.assertTrue(DiaryUser.load_user("1").password)
+
+    def test_update_user_invalidates_cache(self):
+        DiaryUser.load_user("1")
+        DiaryUser.update_user({"user_id": "1", "full_name": "New Name", "timezone": ""})
+        db.session.remove()
+        self.assertEqual(DiaryUser.load_user("1").name, "New Name")
+
+    def test_delete_user_invalidates_cache(self):
+        DiaryUser.delete_user({"user": DiaryUser.load_user("1")})
+        db.session.remove()
+        self.assertIsNone(DiaryUser.load_user("1"))
+
+    def test_identity_in_session_needs_no_query(self):
+        with flask_app.test_request_context():
+            DiaryUser.load_user("1", use_session=True)
+            DiaryUser.read_deleted_user_ids()
+            USER_CACHE.clear()
+            db.session.remove()
+            with capture_statements() as statements:
+                self.assertEqual(DiaryUser.load_user("1", use_session=True).username, "username")
+            self.assertEqual(statements, [])
+
+    def test_delete_user_removes_identity_from_session(self):
+        with flask_app.test_request_context():
+            DiaryUser.delete_user({"user": DiaryUser.load_user("1", use_session=True)})
+            self.assertNotIn(SESSION_IDENTITY_KEY, session)
+            self.assertIsNone(DiaryUser.load_user("1", use_session=True))
+
+    def test_cached_user_deleted_by_another_process_is_not_loaded(self):
+        DiaryUser.load_user("1")
+        self.delete_in_another_process("1")
+        self.assertIsNone(DiaryUser.load_user("1"))
+        self.assertIsNone(USER_CACHE.get("1"))
+
+    def test_identity_in_session_of_user_deleted_by_another_process_is_not_loaded(self):
+        with flask_app.test_request_context():
+            DiaryUser.load_user("1", use_session=True)
+            self.delete_in_another_process("1")
+            self.assertIsNone(DiaryUser.load_user("1", use_session=True))
+            self.assertNotIn(SESSION_IDENTITY_KEY, session)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,55 @@
+import unittest
+import os
+import tempfile
+from sqlalchemy import create_engine
+from sqlalchemy.pool import QueuePool
+from personal_diary.engine import EngineProfile, SQLITE_PROFILE_PLUGIN
+
+
+class EngineProfileTestOptions(unittest.TestCase):
+
+    def test_sqlite_file_uses_pragma_plugin_and_queue_pool(self):
+        options = EngineProfile.engine_options("sqlite:///diary.db", {})
+        self.assertEqual(options["plugins"], [SQLITE_PROFILE_PLUGIN])
+        self.assertIs(options["poolclass"], QueuePool)
+        self.assertEqual(options["pool_size"], 5)
+        self.assertEqual(options["sqlite_pragmas"]["journal_mode"], "WAL")
+
+    def test_sqlite_in_memory_keeps_default_options(self):
+        self.assertEqual(EngineProfile.engine_options("sqlite://", {}), {})
+
+    def test_postgresql_uses_queue_pool_sized_from_environment(self):
+        options = EngineProfile.engine_options("postgresql://diary@localhost/diary",
+                                               {"DIARY_DB_POOL_SIZE": "20", "DIARY_DB_MAX_OVERFLOW": "0"})
+        self.assertIs(options["poolclass"], QueuePool)
+        self.assertTrue(options["pool_pre_ping"])
+        self.assertEqual(options["pool_size"], 20)
+        self.assertEqual(options["max_overflow"], 0)
+        self.assertNotIn("plugins", options)
+
+    def test_pragmas_can_be_overridden_from_environment(self):
+        options = EngineProfile.engine_options("sqlite:///diary.db", {"DIARY_SQLITE_SYNCHRONOUS": "FULL"})
+        self.assertEqual(options["sqlite_pragmas"]["synchronous"], "FULL")
+
+    def test_database_uri_is_read_from_environment(self):
+        self.assertEqual(EngineProfile.database_uri("sqlite:///diary.db", {}), "sqlite:///diary.db")
+        self.assertEqual(EngineProfile.database_uri("sqlite:///diary.db", {"DIARY_DATABASE_URI": "postgresql://db"}),
+                         "postgresql://db")
+
+
+class EngineProfileTestPragmas(unittest.TestCase):
+
+    def test_new_connections_have_pragmas_set(self):
+        with tempfile.TemporaryDirectory() as directory:
+            uri = "sqlite:///" + os.path.join(directory, "diary.db")
+            engine = create_engine(uri, **EngineProfile.engine_options(uri, {}))
+            with engine.connect() as connection:
+                self.assertEqual(connection.exec_driver_sql("PRAGMA journal_mode").scalar(), "wal")
+                self.assertEqual(connection.exec_driver_sql("PRAGMA synchronous").scalar(), 1)
+                self.assertEqual(connection.exec_driver_sql("PRAGMA busy_timeout").scalar(), 5000)
+                self.assertEqual(connection.exec_driver_sql("PRAGMA cache_size").scalar(), -65536)
+            engine.dispose()
+
+
+if __name__ == '__main__':
+    unittest.main()
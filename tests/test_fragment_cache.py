@@ -0,0 +1,77 @@
+import unittest
+from unittest import mock
+from personal_diary.diary import Diary
+from personal_diary.fragment_cache import FragmentCache, SharedCacheBackend, LocalCacheClient, ENTRY_CARD_CACHE
+from tests.test_app import set_up_flask_app_test_client, create_test_user, tear_down_flask_test
+
+
+class FragmentCacheTestGetOrRender(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.render = mock.Mock(side_effect=["<p>first</p>", "<p>second</p>"])
+
+    def check_backend(self, cache: FragmentCache) -> None:
+        self.assertEqual(cache.get_or_render("e1", ["v1"], self.render), "<p>first</p>")
+        self.assertEqual(cache.get_or_render("e1", ["v1"], self.render), "<p>first</p>")
+        self.assertEqual(self.render.call_count, 1)
+        self.assertEqual(cache.get_or_render("e1", ["v2"], self.render), "<p>second</p>")
+        self.assertEqual(self.render.call_count, 2)
+        self.assertEqual((cache.stats()["hits"], cache.stats()["misses"]), (1, 2))
+
+    def test_in_process_backend_reuses_fragment_until_version_changes(self):
+        self.check_backend(FragmentCache())
+
+    def test_shared_backend_reuses_fragment_until_version_changes(self):
+        cache = FragmentCache()
+        client = LocalCacheClient()
+        cache.use_backend(SharedCacheBackend(client))
+        self.check_backend(cache)
+        self.assertEqual(list(client.values.keys()), ["diary:fragment:e1"])
+
+    def test_deleted_fragment_is_rendered_again(self):
+        cache = FragmentCache()
+        cache.get_or_render("e1", ["v1"], self.render)
+        cache.delete("e1")
+        self.assertEqual(cache.get_or_render("e1", ["v1"], self.render), "<p>second</p>")
+
+    def test_in_process_backend_is_bounded(self):
+        cache = FragmentCache(max_size=2)
+        for key in ("e1", "e2", "e3"):
+            cache.get_or_render(key, ["v1"], lambda: "<p></p>")
+        self.assertEqual(cache.stats()["size"], 2)
+
+
+class FragmentCacheTestEntryCards(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.client = set_up_flask_app_test_client()
+        self.test_user = create_test_user()
+        ENTRY_CARD_CACHE.clear()
+        self.entry_id = Diary.create_entry({"title": "Title", "body": "Body", "user_id": "1", "tags": ["tag1"],
+                                            "mood": "&#128512"})["entry_id"]
+
+    def tearDown(self) -> None:
+        tear_down_flask_test()
+
+    @mock.patch('flask_login.utils._get_user')
+    def test_second_render_reuses_card(self, current_user):
+        current_user.return_value = self.test_user
+        first = self.client.get("/").data
+        second = self.client.get("/").data
+        self.assertEqual(first, second)
+        self.assertEqual((ENTRY_CARD_CACHE.stats()["hits"], ENTRY_CARD_CACHE.stats()["misses"]), (1, 1))
+
+    @mock.patch('flask_login.utils._get_user')
+    def test_updated_entry_card_is_rendered_again(self, current_user):
+        current_user.return_value = self.test_user
+        self.client.get("/")
+        Diary.update_entry({"entry_id": self.entry_id, "title": "New title", "body": "Body", "tags": ["tag2"],
+                            "mood": "&#128512"})
+        response = self.client.get("/")
+        self.assertIn(b"New title", response.data)
+        self.assertIn(b"#tag2", response.data)
+        self.assertEqual(ENTRY_CARD_CACHE.stats()["misses"], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,149 @@
+import unittest
+import os
+from sqlalchemy import select, text
+from personal_diary.app import flask_app
+from personal_diary.diary import Diary
+from personal_diary.fuzzy_index import FuzzyIndex
+from personal_diary.models import Entry, EntryWord, WordTrigram
+from personal_diary.transfer import DiaryTransfer
+from personal_diary import db
+
+basedir = os.path.abspath(os.path.dirname(__file__))
+flask_app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(basedir, "test_database.db")
+flask_app.app_context().push()
+db.create_all()
+
+
+def create_entry(title: str, tags: list, user_id: str = "1") -> str:
+    return Diary.create_entry({"title": title, "body": "Body", "user_id": user_id, "tags": tags,
+                               "mood": "&#128512"})["entry_id"]
+
+
+def match(user_id: str, search_query: str) -> list:
+    return sorted(entry.id for entry in Entry.query.filter(FuzzyIndex.match_entries(user_id, search_query)))
+
+
+def read_rows() -> set:
+    return {(row.user_id, row.word, row.entry_id) for row in EntryWord.query}
+
+
+def query_plan(query) -> str:
+    return " ".join(row[-1] for row in db.session.execute(text("EXPLAIN QUERY PLAN " + str(query.compile(
+        db.engine, compile_kwargs={"literal_binds": True})))).all())
+
+
+class FuzzyIndexTestTrigrams(unittest.TestCase):
+
+    def test_words_are_padded_like_pg_trgm(self):
+        self.assertEqual(FuzzyIndex.trigrams("cat"), {"  c", " ca", "cat", "at "})
+
+    def test_misspelled_word_is_similar(self):
+        self.assertGreaterEqual(FuzzyIndex.similarity("mondy", "A long Monday", []), 0.3)
+        self.assertGreaterEqual(FuzzyIndex.similarity("schol", "Title", ["school"]), 0.3)
+        self.assertLess(FuzzyIndex.similarity("holiday", "A long Monday", ["school"]), 0.3)
+
+    def test_contained_keyword_is_fully_similar(self):
+        self.assertEqual(FuzzyIndex.similarity("mon", "A long Monday", []), 1.0)
+
+
+class FuzzyIndexTestMatch(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.monday_id = create_entry("A long Monday", ["school"])
+        self.tuesday_id = create_entry("Tuesday at the beach", ["holiday"])
+        self.other_user_id = create_entry("Another Monday", [], user_id="2")
+
+    def tearDown(self) -> None:
+        db.drop_all()
+        db.create_all()
+        db.session.commit()
+
+    def test_misspelled_keyword_matches_title(self):
+        self.assertEqual(match("1", "mondy"), [self.monday_id])
+
+    def test_misspelled_keyword_matches_tag(self):
+        self.assertEqual(match("1", "holliday"), [self.tuesday_id])
+
+    def test_every_keyword_must_match(self):
+        self.assertEqual(match("1", "mondy beech"), [])
+        self.assertEqual(match("1", "tusday beech"), [self.tuesday_id])
+
+    def test_similar_words_match_the_keyword_like_similarity(self):
+        create_entry("Bench", ["beachside"])
+        words = db.session.execute(FuzzyIndex.similar_words("1", "beach")).scalars().all()
+        self.assertEqual(sorted(words), ["beach", "beachside", "bench"])
+        self.assertEqual(db.session.execute(FuzzyIndex.similar_words("2", "beach")).scalars().all(), [])
+
+    def test_query_without_words_returns_none(self):
+        self.assertIsNone(FuzzyIndex.match_entries("1", "!? "))
+
+    def test_lookup_searches_the_words_of_the_user_and_trigram(self):
+        self.assertIn("SEARCH WordTrigrams USING", query_plan(FuzzyIndex.similar_words("1", "mondy")))
+        plan = query_plan(select(Entry.id).where(FuzzyIndex.match_entries("1", "mondy")))
+        self.assertIn("SEARCH EntryWords USING", plan)
+        self.assertNotIn("SCAN EntryWords", plan)
+
+    def test_read_entries_page_with_fuzzy_search(self):
+        page = Diary.read_entries_page("1", "mondy", None, fuzzy=True)
+        self.assertEqual(list(page["entries"]), [self.monday_id])
+        self.assertEqual(Diary.read_entries_page("1", "mondy", None)["count"], 0)
+
+    def test_fuzzy_search_finds_every_entry_the_exact_search_finds(self):
+        for number in range(500):
+            create_entry(f"Monday notes {number}", [])
+        exact_count = Diary.read_entries_page("1", "monday", None)["count"]
+        self.assertEqual(exact_count, 501)
+        self.assertEqual(Diary.read_entries_page("1", "monday", None, fuzzy=True)["count"], exact_count)
+        self.assertEqual(Diary.read_entries_page("1", "mondy", None, fuzzy=True)["count"], 501)
+
+    def test_query_parameters_do_not_grow_with_the_matches(self):
+        parameters = len(Diary.filter_entries("1", "mondy", None, fuzzy=True).statement.compile().params)
+        for number in range(50):
+            create_entry(f"Monday notes {number}", [])
+        self.assertEqual(len(Diary.filter_entries("1", "mondy", None, fuzzy=True).statement.compile().params),
+                         parameters)
+
+    def test_fuzzy_search_keeps_entries_matched_by_body_text(self):
+        body_id = Diary.create_entry({"title": "Title", "body": "A mondy walk", "user_id": "1", "tags": [],
+                                      "mood": "&#128512"})["entry_id"]
+        page = Diary.read_entries_page("1", "mondy", None, fuzzy=True)
+        self.assertEqual(sorted(page["entries"]), sorted([self.monday_id, body_id]))
+
+
+class FuzzyIndexTestChange(unittest.TestCase):
+
+    def tearDown(self) -> None:
+        db.drop_all()
+        db.create_all()
+        db.session.commit()
+
+    def test_update_replaces_words(self):
+        entry_id = create_entry("A long Monday", ["school"])
+        Diary.update_entry({"entry_id": entry_id, "title": "Beach", "body": "Body", "tags": [], "mood": "&#128512"})
+        self.assertEqual(read_rows(), {("1", "beach", entry_id)})
+        self.assertEqual(match("1", "mondy"), [])
+
+    def test_words_are_added_to_the_vocabulary_once(self):
+        create_entry("A long Monday", ["school"])
+        create_entry("Monday again", [])
+        self.assertEqual(WordTrigram.query.filter_by(word="monday").count(), len(FuzzyIndex.trigrams("monday")))
+        self.assertEqual({row.trigram_count for row in WordTrigram.query.filter_by(word="monday")}, {7})
+
+    def test_delete_removes_words(self):
+        entry_id = create_entry("A long Monday", ["school"])
+        Diary.delete_entry({"entry_id": entry_id})
+        self.assertEqual(read_rows(), set())
+
+    def test_rebuild_matches_maintained_words(self):
+        create_entry("A long Monday", ["school"])
+        DiaryTransfer.insert_entries("2", [DiaryTransfer.validate_row(
+            {"title": f"Imported {number}", "body": "Body", "tags": ["fun"]}) for number in range(5)])
+        maintained = read_rows()
+        vocabulary = {(row.user_id, row.trigram, row.word) for row in WordTrigram.query}
+        self.assertEqual(FuzzyIndex.rebuild(chunk_size=2), 6)
+        self.assertEqual(read_rows(), maintained)
+        self.assertEqual({(row.user_id, row.trigram, row.word) for row in WordTrigram.query}, vocabulary)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import unittest
+import os
+import uuid
+from unittest import mock
+from sqlalchemy import text
+from personal_diary.app import flask_app
+from personal_diary.diary import Diary
+from personal_diary.ids import TimeOrderedIds
+from personal_diary.models import Entry
+from personal_diary import db
+
+basedir = os.path.abspath(os.path.dirname(__file__))
+flask_app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(basedir, "test_database.db")
+flask_app.app_context().push()
+db.create_all()
+
+
+class TimeOrderedIdsTestNew(unittest.TestCase):
+
+    def test_ids_are_version_7_uuids(self):
+        parsed = uuid.UUID(TimeOrderedIds.new())
+        self.assertEqual(parsed.version, 7)
+        self.assertEqual(parsed.variant, uuid.RFC_4122)
+
+    def test_ids_hold_the_time_they_were_made(self):
+        with mock.patch("personal_diary.ids.time.time_ns", return_value=1_700_000_000_123_456_789), \
+                mock.patch.object(TimeOrderedIds, "_last_millis", 0):
+            parsed = TimeOrderedIds.new_uuid()
+        self.assertEqual(parsed.int >> 80, 1_700_000_000_123)
+
+    def test_ids_made_later_sort_after_earlier_ids(self):
+        ids = [TimeOrderedIds.new() for _ in range(5000)]
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual(len(set(ids)), len(ids))
+        self.assertEqual([TimeOrderedIds.to_bytes(value) for value in ids],
+                         sorted(TimeOrderedIds.to_bytes(value) for value in ids))
+
+    def test_ids_within_one_millisecond_keep_their_order_when_the_counter_runs_out(self):
+        with mock.patch("personal_diary.ids.time.time_ns", return_value=1_700_000_000_000_000_000), \
+                mock.patch.object(TimeOrderedIds, "_last_millis", 0):
+            ids = [TimeOrderedIds.new() for _ in range(5000)]
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual(len(set(ids)), len(ids))
+
+
+class TimeOrderedIdsTestToBytes(unittest.TestCase):
+
+    def test_canonical_uuid_returns_its_bytes(self):
+        value = TimeOrderedIds.new()
+        self.assertEqual(TimeOrderedIds.to_bytes(value), uuid.UUID(value).bytes)
+
+    def test_other_strings_return_none(self):
+        value = TimeOrderedIds.new()
+        for other in ("1", "e1", value.upper(), value.replace("-", ""), "{" + value[1:-1] + "}", None):
+            self.assertIsNone(TimeOrderedIds.to_bytes(other))
+
+
+class TimeOrderedIdsTestStorage(unittest.TestCase):
+
+    def tearDown(self) -> None:
+        db.drop_all()
+        db.create_all()
+        db.session.commit()
+
+    def test_new_entry_id_is_stored_as_16_bytes_and_read_as_string(self):
+        entry_id = Diary.create_entry({"title": "Title", "body": "Body", "user_id": "1", "tags": [],
+                                       "mood": "&#128512"})["entry_id"]
+        row = db.session.execute(text("SELECT typeof(id), length(id), typeof(user_id) FROM DiaryEntries")).one()
+        self.assertEqual(tuple(row), ("blob", 16, "text"))
+        self.assertEqual(Entry.query.get(entry_id).id, entry_id)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import unittest
+import os
+from flask import Flask, render_template_string
+from sqlalchemy import text
+from personal_diary.instrumentation import Instrumentation, Histogram
+from personal_diary import db
+
+basedir = os.path.abspath(os.path.dirname(__file__))
+
+
+def create_instrumented_app() -> Flask:
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(basedir, "test_database.db")
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+
+    @app.route("/entries/<entry_id>")
+    def entry(entry_id: str) -> str:
+        db.session.execute(text("SELECT 1"))
+        db.session.execute(text("SELECT 2"))
+        return render_template_string("<p>{{ entry_id }}</p>", entry_id=entry_id)
+
+    Instrumentation.init_app(app)
+    return app
+
+
+class InstrumentationTestRequests(unittest.TestCase):
+
+    def setUp(self) -> None:
+        Instrumentation.reset()
+        self.client = create_instrumented_app().test_client()
+
+    def tearDown(self) -> None:
+        Instrumentation.reset()
+
+    def test_response_has_server_timing_header(self):
+        response = self.client.get("/entries/1")
+        server_timing = response.headers["Server-Timing"]
+        self.assertIn('sql;desc="2 statements";dur=', server_timing)
+        self.assertIn("template;dur=", server_timing)
+        self.assertIn("total;dur=", server_timing)
+
+    def test_metrics_are_recorded_per_route(self):
+        self.client.get("/entries/1")
+        self.client.get("/entries/2")
+        metrics = self.client.get("/metrics").get_data(as_text=True)
+        labels = 'route="/entries/<entry_id>",method="GET"'
+        self.assertIn(f"diary_request_duration_seconds_count{{{labels}}} 2", metrics)
+        self.assertIn(f"diary_request_sql_statements_sum{{{labels}}} 4", metrics)
+        self.assertIn(f'diary_request_sql_statements_bucket{{{labels},le="1"}} 0', metrics)
+        self.assertIn(f'diary_request_sql_statements_bucket{{{labels},le="2"}} 2', metrics)
+        self.assertIn("# TYPE diary_request_template_duration_seconds histogram", metrics)
+
+    def test_metrics_include_cache_statistics(self):
+        metrics = self.client.get("/metrics").get_data(as_text=True)
+        self.assertIn('diary_cache_hits_total{cache="entry_card"}', metrics)
+        self.assertIn('diary_cache_misses_total{cache="tag_id"}', metrics)
+
+    def test_metrics_endpoint_is_not_recorded(self):
+        self.client.get("/metrics")
+        self.assertNotIn('route="/metrics"', self.client.get("/metrics").get_data(as_text=True))
+
+
+class InstrumentationTestHistogram(unittest.TestCase):
+
+    def test_buckets_are_cumulative_and_include_infinity(self):
+        histogram = Histogram("test_metric", "A test metric.", (1, 5))
+        for value in (0.5, 1, 3, 10):
+            histogram.observe(("/", "GET"), value)
+        lines = histogram.render()
+        self.assertIn('test_metric_bucket{route="/",method="GET",le="1"} 2', lines)
+        self.assertIn('test_metric_bucket{route="/",method="GET",le="5"} 3', lines)
+        self.assertIn('test_metric_bucket{route="/",method="GET",le="+Inf"} 4', lines)
+        self.assertIn('test_metric_sum{route="/",method="GET"} 14.5', lines)
+
+
+if __name__ == '__main__':
+    unittest.main()
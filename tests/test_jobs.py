@@ -0,0 +1,44 @@
+import time
+import unittest
+from flask import current_app
+from personal_diary.app import flask_app
+from personal_diary.jobs import BackgroundJobs
+
+
+class BackgroundJobsTestSubmit(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.jobs = BackgroundJobs()
+        self.results = []
+
+    def test_jobs_run_in_order_within_app_context(self):
+        with flask_app.app_context():
+            for number in range(3):
+                self.jobs.submit(lambda value: self.results.append((value, current_app.name)), number)
+        self.jobs.join()
+        self.assertEqual(self.results, [(number, flask_app.name) for number in range(3)])
+
+    def test_failing_job_does_not_stop_later_jobs(self):
+        def fail():
+            raise RuntimeError("failed")
+
+        with flask_app.app_context():
+            with self.assertLogs(flask_app.logger, "ERROR"):
+                self.jobs.submit(fail)
+                self.jobs.submit(self.results.append, "done")
+                self.jobs.join()
+        self.assertEqual(self.results, ["done"])
+
+    def test_job_submitted_later_runs_after_the_delay(self):
+        with flask_app.app_context():
+            self.jobs.submit_later(0.2, self.results.append, "later")
+            self.jobs.submit(self.results.append, "now")
+        self.jobs.join()
+        self.assertEqual(self.results, ["now"])
+        time.sleep(0.4)
+        self.jobs.join()
+        self.assertEqual(self.results, ["now", "later"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,183 @@
+import unittest
+import os
+from unittest import mock
+from sqlalchemy import inspect, text
+from personal_diary.app import flask_app
+from personal_diary.diary import Diary
+from personal_diary.migrations import Migrations, MIGRATIONS, UnsupportedDatabaseError
+from personal_diary.models import Entry, Tag
+from personal_diary import db
+
+basedir = os.path.abspath(os.path.dirname(__file__))
+flask_app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(basedir, "test_database.db")
+flask_app.app_context().push()
+db.create_all()
+
+"""
+The schema of databases created before any migrations existed
+"""
+LEGACY_SCHEMA = [
+    'CREATE TABLE "Users" (id VARCHAR NOT NULL, username VARCHAR(15), name VARCHAR(30), password VARCHAR(15), '
+    'PRIMARY KEY (id), UNIQUE (username))',
+    'CREATE TABLE "EntryTags" (id INTEGER NOT NULL, name VARCHAR, PRIMARY KEY (id))',
+    'CREATE TABLE "DiaryEntries" (id VARCHAR NOT NULL, title VARCHAR NOT NULL, body TEXT NOT NULL, '
+    'created DATETIME NOT NULL, modified DATETIME, user_id VARCHAR NOT NULL, mood TEXT NOT NULL, PRIMARY KEY (id), '
+    'FOREIGN KEY(user_id) REFERENCES "Users" (id))',
+    'CREATE TABLE tags (tag_id INTEGER NOT NULL, entry_id VARCHAR NOT NULL, PRIMARY KEY (tag_id, entry_id), '
+    'FOREIGN KEY(tag_id) REFERENCES "EntryTags" (id), FOREIGN KEY(entry_id) REFERENCES "DiaryEntries" (id))'
+]
+
+LEGACY_DATA = [
+    "INSERT INTO Users VALUES ('1', 'username', 'Test User', 'password')",
+    "INSERT INTO DiaryEntries VALUES ('e1', 'A long Day', 'Today was monday', '2022-05-01 10:00:00.000000', "
+    "'2022-05-01 10:00:00.000000', '1', '&#128512')",
+    "INSERT INTO DiaryEntries VALUES ('e2', 'A new day', 'class was so good', '2022-05-02 10:00:00.000000', "
+    "'2022-05-02 10:00:00.000000', '1', '&#128525')",
+    "INSERT INTO EntryTags VALUES (1, 'school')",
+    "INSERT INTO EntryTags VALUES (2, 'school')",
+    "INSERT INTO EntryTags VALUES (3, 'fun')",
+    "INSERT INTO EntryTags VALUES (4, 'fun')",
+    "INSERT INTO tags VALUES (1, 'e1')",
+    "INSERT INTO tags VALUES (2, 'e2')",
+    "INSERT INTO tags VALUES (3, 'e2')",
+    "INSERT INTO tags VALUES (4, 'e2')"
+]
+
+
+def create_legacy_database():
+    db.session.remove()
+    db.drop_all()
+    with db.engine.begin() as connection:
+        for statement in LEGACY_SCHEMA + LEGACY_DATA:
+            connection.execute(text(statement))
+        Migrations.stamp(connection, 0)
+
+
+def index_names():
+    rows = db.session.execute(text("SELECT name FROM sqlite_master WHERE type = 'index'"))
+    return {row[0] for row in rows}
+
+
+class MigrationsTestUpgrade(unittest.TestCase):
+
+    def setUp(self) -> None:
+        create_legacy_database()
+
+    def tearDown(self) -> None:
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+        db.session.commit()
+
+    def test_upgrade_applies_every_migration_and_sets_latest_version(self):
+        applied = Migrations.upgrade()
+        self.assertEqual(applied, [migration.__name__ for migration in MIGRATIONS])
+        with db.engine.connect() as connection:
+            self.assertEqual(Migrations.schema_version(connection), len(MIGRATIONS))
+
+    def test_upgrade_twice_applies_nothing_the_second_time(self):
+        Migrations.upgrade()
+        self.assertEqual(Migrations.upgrade(), [])
+
+    def test_upgrade_creates_query_indexes(self):
+        Migrations.upgrade()
+        self.assertTrue({"ix_DiaryEntries_user_id_created", "ix_DiaryEntries_user_id_modified",
+                         "ix_EntryTags_name", "ix_tags_entry_id"} <= index_names())
+
+    def test_upgrade_merges_duplicate_tags(self):
+        Migrations.upgrade()
+        self.assertEqual(sorted(tag.name for tag in Tag.query.all()), ["fun", "school"])
+        entries = Diary.read_all_entries("1", "school")
+        self.assertEqual(set(entries.keys()), {"e1", "e2"})
+        self.assertEqual(sorted(tag.name for tag in entries["e2"].tags), ["fun", "school"])
+
+    def test_upgrade_indexes_existing_entries_for_search(self):
+        Migrations.upgrade()
+        self.assertEqual(list(Diary.search_entries("monday", "1", None).keys()), ["e1"])
+
+    def test_upgrade_stores_moods_as_codes(self):
+        Migrations.upgrade()
+        rows = db.session.execute(text("SELECT typeof(mood), mood FROM DiaryEntries ORDER BY id")).all()
+        self.assertEqual([tuple(row) for row in rows], [("integer", 2), ("integer", 3)])
+        self.assertEqual(Entry.query.get("e1").mood, "&#128512")
+        self.assertIn("ix_DiaryEntries_user_id_mood_created", index_names())
+
+    def test_upgrade_keeps_search_index_in_sync(self):
+        Migrations.upgrade()
+        Diary.update_entry({"entry_id": "e1", "title": "A long Day", "body": "Today was tuesday", "tags": [],
+                            "mood": "&#128512"})
+        self.assertEqual(list(Diary.search_entries("tuesday", "1", None).keys()), ["e1"])
+        self.assertEqual(list(Diary.search_entries("monday", "1", None).keys()), [])
+
+    def test_upgrade_adds_user_timezone_column(self):
+        Migrations.upgrade()
+        columns = [row[1] for row in db.session.execute(text('PRAGMA table_info("Users")'))]
+        self.assertIn("timezone", columns)
+
+    def test_upgrade_adds_user_deleted_at_column(self):
+        Migrations.upgrade()
+        columns = [row[1] for row in db.session.execute(text('PRAGMA table_info("Users")'))]
+        self.assertIn("deleted_at", columns)
+
+    def test_upgrade_stores_uuid_ids_as_bytes(self):
+        legacy_id = "5b0c6a1e-3f2d-4c8b-9a7e-1d2c3b4a5f60"
+        with db.engine.begin() as connection:
+            connection.execute(text("INSERT INTO DiaryEntries VALUES (:id, 'Title', 'Body', "
+                                    "'2022-05-03 10:00:00.000000', NULL, '1', '&#128512')"), {"id": legacy_id})
+            connection.execute(text("INSERT INTO tags VALUES (3, :id)"), {"id": legacy_id})
+        Migrations.upgrade()
+        rows = db.session.execute(text("SELECT id, typeof(id) FROM DiaryEntries ORDER BY created")).all()
+        self.assertEqual([row[1] for row in rows], ["text", "text", "blob"])
+        self.assertEqual(Entry.query.get(legacy_id).id, legacy_id)
+        self.assertEqual([tag.name for tag in Entry.query.get(legacy_id).tags], ["fun"])
+        self.assertEqual(set(Diary.read_all_entries("1", "fun").keys()), {"e2", legacy_id})
+
+    def test_upgrade_indexes_existing_entries_for_fuzzy_search(self):
+        Migrations.upgrade()
+        self.assertEqual(list(Diary.read_entries_page("1", "neww", None, fuzzy=True)["entries"]), ["e2"])
+        self.assertEqual(set(Diary.read_entries_page("1", "schol", None, fuzzy=True)["entries"]), {"e1", "e2"})
+
+    def test_upgrade_replaces_the_trigram_index_of_entries(self):
+        Migrations.upgrade()
+        with db.engine.begin() as connection:
+            connection.execute(text('CREATE TABLE "EntryTrigrams" (user_id VARCHAR, trigram VARCHAR(3), '
+                                    'entry_id VARCHAR)'))
+            Migrations.stamp(connection, len(MIGRATIONS) - 1)
+        self.assertEqual(Migrations.upgrade(), ["index_fuzzy_words"])
+        self.assertNotIn("EntryTrigrams", inspect(db.engine).get_table_names())
+        self.assertEqual(list(Diary.read_entries_page("1", "neww", None, fuzzy=True)["entries"]), ["e2"])
+
+    def test_upgrade_of_other_databases_raises(self):
+        connection = mock.Mock()
+        connection.dialect.name = "postgresql"
+        with self.assertRaises(UnsupportedDatabaseError):
+            Migrations.upgrade(connection)
+        connection.execute.assert_not_called()
+
+    def test_upgrade_command_reports_other_databases_without_traceback(self):
+        with mock.patch.object(db.engine.dialect, "name", "postgresql"):
+            result = flask_app.test_cli_runner().invoke(args=["upgrade-db"])
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn("Error: Schema migrations are only supported for SQLite databases, not postgresql",
+                      result.output)
+
+    def test_upgrade_command_reports_applied_migrations(self):
+        result = flask_app.test_cli_runner().invoke(args=["upgrade-db"])
+        self.assertIn("Applied migrations: create_search_index, add_query_indexes", result.output)
+
+
+class MigrationsTestNewDatabase(unittest.TestCase):
+
+    def setUp(self) -> None:
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+
+    def test_new_database_has_latest_version(self):
+        with db.engine.connect() as connection:
+            self.assertEqual(Migrations.schema_version(connection), len(MIGRATIONS))
+        self.assertEqual(Migrations.upgrade(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
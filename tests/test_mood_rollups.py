@@ -0,0 +1,104 @@
+import unittest
+import os
+from datetime import date, datetime, timedelta
+from personal_diary.app import flask_app
+from personal_diary.diary import Diary
+from personal_diary.mood_rollups import MoodRollups, MAX_SERIES_POINTS
+from personal_diary.models import Entry, MoodRollup
+from personal_diary.transfer import DiaryTransfer
+from personal_diary import db
+
+basedir = os.path.abspath(os.path.dirname(__file__))
+flask_app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(basedir, "test_database.db")
+flask_app.app_context().push()
+db.create_all()
+
+HAPPY = "&#128512"
+SAD = "&#128532"
+
+
+def import_entries(user_id: str, moods_by_created: list) -> list:
+    return DiaryTransfer.insert_entries(user_id, [
+        {"title": "Title", "body": "Body", "mood": mood, "tags": [], "created": created, "modified": created}
+        for created, mood in moods_by_created])
+
+
+def read_counts() -> dict:
+    return {(row.user_id, row.period, row.period_start, row.mood): row.entry_count for row in MoodRollup.query}
+
+
+class MoodRollupsTestChange(unittest.TestCase):
+
+    def tearDown(self) -> None:
+        db.drop_all()
+        db.create_all()
+        db.session.commit()
+
+    def test_import_counts_each_period(self):
+        # 2022-05-01 is a Sunday, so the two days fall in different weeks of the same month
+        import_entries("1", [(datetime(2022, 5, 1, 10), HAPPY), (datetime(2022, 5, 2, 10), HAPPY)])
+        counts = read_counts()
+        self.assertEqual(counts[("1", "day", date(2022, 5, 1), HAPPY)], 1)
+        self.assertEqual(counts[("1", "week", date(2022, 4, 25), HAPPY)], 1)
+        self.assertEqual(counts[("1", "week", date(2022, 5, 2), HAPPY)], 1)
+        self.assertEqual(counts[("1", "month", date(2022, 5, 1), HAPPY)], 2)
+
+    def test_create_update_and_delete_keep_counts(self):
+        entry_id = Diary.create_entry({"title": "Title", "body": "Body", "user_id": "1", "tags": [], "mood": HAPPY})[
+            "entry_id"]
+        created = Entry.query.get(entry_id).created
+        Diary.update_entry({"entry_id": entry_id, "title": "Title", "body": "Body", "tags": [], "mood": SAD})
+        self.assertEqual(read_counts(), {("1", period, period_start, SAD): 1
+                                         for period, period_start in MoodRollups.period_starts(created).items()})
+
+        Diary.delete_entry({"entry_id": entry_id})
+        self.assertEqual(read_counts(), {})
+
+    def test_rebuild_in_chunks_matches_maintained_counts(self):
+        import_entries("1", [(datetime(2022, month, day), HAPPY if day % 2 else SAD)
+                             for month in range(1, 4) for day in range(1, 20)])
+        import_entries("2", [(datetime(2022, 1, 5), HAPPY)])
+        maintained = read_counts()
+
+        self.assertEqual(MoodRollups.rebuild(chunk_size=7), 58)
+        self.assertEqual(read_counts(), maintained)
+
+
+class MoodRollupsTestReadSeries(unittest.TestCase):
+
+    def setUp(self) -> None:
+        import_entries("1", [(datetime(2021, 12, 31), HAPPY), (datetime(2022, 1, 3), HAPPY),
+                             (datetime(2022, 2, 14), SAD), (datetime(2022, 5, 1), HAPPY)])
+
+    def tearDown(self) -> None:
+        db.drop_all()
+        db.create_all()
+        db.session.commit()
+
+    def test_daily_series_is_dense(self):
+        series = MoodRollups.read_series("1", date(2022, 1, 1), date(2022, 1, 5), "day")
+        self.assertEqual(series["periods"], [date(2022, 1, day) for day in range(1, 6)])
+        self.assertEqual(series["moods"], {HAPPY: [0, 0, 1, 0, 0]})
+
+    def test_quarters_are_added_up_from_months(self):
+        series = MoodRollups.read_series("1", date(2022, 1, 1), date(2022, 12, 31), "quarter")
+        self.assertEqual(series["periods"], [date(2022, month, 1) for month in (1, 4, 7, 10)])
+        self.assertEqual(series["moods"], {HAPPY: [1, 1, 0, 0], SAD: [1, 0, 0, 0]})
+
+    def test_bucket_is_chosen_to_fit_the_range(self):
+        self.assertEqual(MoodRollups.read_series("1", date(2022, 1, 1), date(2022, 12, 31))["bucket"], "day")
+        self.assertEqual(MoodRollups.read_series("1", date(2021, 1, 1), date(2022, 12, 31))["bucket"], "week")
+        self.assertEqual(MoodRollups.read_series("1", date(2000, 1, 1), date(2022, 12, 31))["bucket"], "month")
+
+    def test_invalid_ranges_raise_value_error(self):
+        with self.assertRaises(ValueError):
+            MoodRollups.read_series("1", date(2022, 2, 1), date(2022, 1, 1))
+        with self.assertRaises(ValueError):
+            MoodRollups.read_series("1", date(2022, 1, 1), date(2022, 2, 1), "hour")
+        with self.assertRaises(ValueError):
+            MoodRollups.read_series("1", date(2022, 1, 1), date(2022, 1, 1) + timedelta(days=MAX_SERIES_POINTS),
+                                    "day")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+import unittest
+import os
+import tempfile
+import time
+from unittest import mock
+from personal_diary.app import create_app
+from personal_diary.diary import Diary
+from personal_diary.diary_user import DiaryUser, USER_CACHE
+from personal_diary.models import Entry, User
+from personal_diary.replicas import ReplicaRouter, STICKY_SESSION_KEY
+from personal_diary import db
+
+
+class ReplicaTestCase(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        db.session.remove()
+        self.app = create_app({
+            "SQLALCHEMY_DATABASE_URI": "sqlite:///" + os.path.join(self.directory.name, "primary.db"),
+            "REPLICA_DATABASE_URI": "sqlite:///" + os.path.join(self.directory.name, "replica.db"),
+            "TESTING": True,
+            "WTF_CSRF_ENABLED": False
+        })
+        self.context = self.app.app_context()
+        self.context.push()
+        self.runner = self.app.test_cli_runner()
+        self.runner.invoke(args=["init-db"])
+        self.user_id = DiaryUser.create_user({"username": "first", "full_name": "Test User",
+                                              "password": "password"})["user_id"]
+        self.replicate()
+        USER_CACHE.clear()
+
+    def tearDown(self) -> None:
+        db.session.remove()
+        db.engine.dispose()
+        ReplicaRouter.engine().dispose()
+        USER_CACHE.clear()
+        self.context.pop()
+        self.directory.cleanup()
+
+    def replicate(self) -> None:
+        db.session.remove()
+        self.assertIn("Copied", self.runner.invoke(args=["replicate-db"]).output)
+
+    def create_entry(self, title: str) -> str:
+        entry_id = Diary.create_entry({"title": title, "body": "Body", "user_id": self.user_id, "tags": [],
+                                       "mood": "&#128512"})["entry_id"]
+        db.session.remove()
+        return entry_id
+
+    def read_titles(self) -> list:
+        return [entry.title for entry in Diary.read_entries_page(self.user_id, None, None)["entries"].values()]
+
+
+class ReplicaRouterTestRouting(ReplicaTestCase):
+
+    def test_read_only_methods_read_the_replica(self):
+        entry_id = self.create_entry("A long Monday")
+        self.assertEqual(self.read_titles(), [])
+        self.assertIsNone(Diary.read_entry_version(entry_id))
+        self.replicate()
+        self.assertEqual(self.read_titles(), ["A long Monday"])
+
+    def test_other_reads_use_the_primary(self):
+        entry_id = self.create_entry("A long Monday")
+        self.assertEqual(Entry.query.get(entry_id).title, "A long Monday")
+
+    def test_reads_after_a_write_in_the_same_transaction_use_the_primary(self):
+        self.create_entry("A long Monday")
+        User.query.get(self.user_id).name = "Renamed"
+        db.session.flush()
+        self.assertEqual(self.read_titles(), ["A long Monday"])
+        db.session.rollback()
+        self.assertEqual(self.read_titles(), [])
+
+    def test_new_user_is_loaded_from_the_replica(self):
+        user_id = DiaryUser.create_user({"username": "second", "full_name": "Test User",
+                                         "password": "password"})["user_id"]
+        USER_CACHE.clear()
+        db.session.remove()
+        self.assertIsNone(DiaryUser.load_user(user_id))
+        self.assertEqual(DiaryUser.load_user(self.user_id).username, "first")
+
+    def test_replicate_without_a_replica_fails(self):
+        self.app.config["REPLICA_DATABASE_URI"] = None
+        result = self.runner.invoke(args=["replicate-db"])
+        self.assertIn("DIARY_REPLICA_DATABASE_URI is not set", result.output)
+
+
+class ReplicaRouterTestStickiness(ReplicaTestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.client = self.app.test_client()
+        patcher = mock.patch('flask_login.utils._get_user')
+        self.addCleanup(patcher.stop)
+        patcher.start().return_value = User(id=self.user_id, username="first", name="Test User")
+
+    def test_browser_reads_its_own_write_after_the_redirect(self):
+        response = self.client.post("/create", data={"title": "A long Monday", "body": "Body"},
+                                    follow_redirects=True)
+        self.assertEqual(response.request.path, "/")
+        self.assertIn(b"A long Monday", response.data)
+
+    def test_reads_return_to_the_replica_after_the_sticky_period(self):
+        self.client.post("/create", data={"title": "A long Monday", "body": "Body"})
+        with self.client.session_transaction() as client_session:
+            self.assertGreater(client_session[STICKY_SESSION_KEY], time.time())
+            client_session[STICKY_SESSION_KEY] = time.time() - 1
+        self.assertNotIn(b"A long Monday", self.client.get("/").data)
+        self.replicate()
+        self.assertIn(b"A long Monday", self.client.get("/").data)
+
+    def test_other_browsers_read_the_replica(self):
+        self.client.post("/create", data={"title": "A long Monday", "body": "Body"})
+        self.assertNotIn(b"A long Monday", self.app.test_client().get("/").data)
+
+    def test_reads_do_not_make_the_browser_sticky(self):
+        self.client.get("/")
+        with self.client.session_transaction() as client_session:
+            self.assertNotIn(STICKY_SESSION_KEY, client_session)
+
+
+if __name__ == '__main__':
+    unittest.main()
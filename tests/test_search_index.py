@@ -0,0 +1,110 @@
+import unittest
+import os
+from datetime import datetime
+from unittest import mock
+from sqlalchemy import text
+from personal_diary.diary import Diary
+from personal_diary.app import flask_app
+from personal_diary.models import Entry
+from personal_diary.search_index import SearchIndex, SEARCH_TABLE
+from personal_diary import db
+
+basedir = os.path.abspath(os.path.dirname(__file__))
+flask_app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(basedir, "test_database.db")
+flask_app.app_context().push()
+db.create_all()
+
+
+class SearchIndexTestSync(unittest.TestCase):
+
+    def setUp(self) -> None:
+        db.drop_all()
+        db.create_all()
+        self.entry_id = Diary.create_entry({"title": "A long Day", "body": "Today was monday", "user_id": "1",
+                                            "tags": [], "mood": "&#128512"})["entry_id"]
+
+    def tearDown(self) -> None:
+        db.drop_all()
+        db.create_all()
+        db.session.commit()
+
+    def test_search_index_is_available_after_create_all(self):
+        self.assertTrue(SearchIndex.is_available())
+
+    def test_created_entry_is_found_through_index(self):
+        self.assertEqual(list(Diary.search_entries("monday long", "1", None).keys()), [self.entry_id])
+
+    def test_updated_entry_is_reindexed(self):
+        Diary.update_entry({"entry_id": self.entry_id, "title": "Sunny", "body": "Beach trip", "tags": [],
+                            "mood": "&#128512"})
+        self.assertEqual(Diary.search_entries("monday", "1", None), {})
+        self.assertEqual(list(Diary.search_entries("beach", "1", None).keys()), [self.entry_id])
+
+    def test_deleted_entry_is_removed_from_index(self):
+        Diary.delete_entry({"entry_id": self.entry_id})
+        count = db.session.execute(text(f"SELECT count(*) FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH 'monday'"))
+        self.assertEqual(count.scalar(), 0)
+
+    def test_deferred_indexing_indexes_entries_and_restores_trigger(self):
+        with SearchIndex.deferred_indexing(db.session.connection()):
+            db.session.execute(Entry.__table__.insert(), [{"id": "e2", "title": "Sunny", "body": "Beach trip",
+                                                           "created": datetime.now(), "user_id": "1",
+                                                           "mood": "&#128512"}])
+        db.session.commit()
+        self.assertEqual(list(Diary.search_entries("beach", "1", None).keys()), ["e2"])
+        self.assertEqual(list(Diary.search_entries("monday", "1", None).keys()), [self.entry_id])
+
+        entry_id = Diary.create_entry({"title": "Rainy", "body": "Museum trip", "user_id": "1", "tags": [],
+                                       "mood": "&#128512"})["entry_id"]
+        self.assertEqual(list(Diary.search_entries("museum", "1", None).keys()), [entry_id])
+
+
+class SearchIndexTestMatching(unittest.TestCase):
+
+    def setUp(self) -> None:
+        db.drop_all()
+        db.create_all()
+        entry_list = [
+            Entry(id="1", title="New Title", body="Hello World", created=datetime.now(), user_id="1", mood="&#128512"),
+            Entry(id="2", title="A new day", body="class was so good", created=datetime.now(), user_id="1",
+                  mood="&#128512"),
+            Entry(id="3", title="A long Day", body="Today was monday", created=datetime.now(), user_id="1",
+                  mood="&#128512"),
+            Entry(id="4", title="A long Day", body="Today was monday", created=datetime.now(), user_id="2",
+                  mood="&#128512")
+        ]
+        for test_entry in entry_list:
+            db.session.add(test_entry)
+        db.session.commit()
+        self.queries = ["day", "new class", "long monday was", "DAY", "ay", "to da", "hello  world", "", "food"]
+
+    def tearDown(self) -> None:
+        db.drop_all()
+        db.create_all()
+        db.session.commit()
+
+    def test_index_matches_same_entries_as_like_fallback(self):
+        for search_query in self.queries:
+            indexed_result = set(Diary.search_entries(search_query, "1", None).keys())
+            with mock.patch.object(SearchIndex, "is_available", return_value=False):
+                like_result = set(Diary.search_entries(search_query, "1", None).keys())
+            self.assertEqual(indexed_result, like_result, search_query)
+
+    def test_keyword_with_quotes_does_not_raise(self):
+        self.assertEqual(Diary.search_entries('"day', "1", None), {})
+
+    def test_rebuild_backfills_existing_entries(self):
+        db.session.execute(text(f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('delete-all')"))
+        db.session.commit()
+        self.assertEqual(Diary.search_entries("monday", "1", None), {})
+
+        self.assertTrue(SearchIndex.rebuild())
+        self.assertEqual(list(Diary.search_entries("monday", "1", None).keys()), ["3"])
+
+    def test_rebuild_command_reports_success(self):
+        result = flask_app.test_cli_runner().invoke(args=["rebuild-search-index"])
+        self.assertIn("Search index rebuilt.", result.output)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,196 @@
+import unittest
+import os
+import tempfile
+import threading
+from unittest import mock
+from personal_diary.app import create_app
+from personal_diary.diary import Diary, TAG_ID_CACHE
+from personal_diary.diary_user import DiaryUser
+from personal_diary.jobs import BACKGROUND_JOBS
+from personal_diary.models import Entry, User
+from personal_diary.shards import ShardEngines, ShardRouter, SHARD_ENGINES
+from personal_diary import db
+
+
+def create_entry(user_id: str, title: str, tags: list) -> str:
+    with ShardRouter.routed(user_id):
+        entry_id = Diary.create_entry({"title": title, "body": "Body", "user_id": user_id, "tags": tags,
+                                       "mood": "&#128512"})["entry_id"]
+    db.session.remove()
+    return entry_id
+
+
+class ShardTestCase(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.shard_directory = os.path.join(self.directory.name, "shards")
+        self.database_path = os.path.join(self.directory.name, "directory.db")
+        db.session.remove()
+        self.app = self.create_app(self.shard_directory)
+        self.context = self.app.app_context()
+        self.context.push()
+        self.app.test_cli_runner().invoke(args=["init-db"])
+
+    def tearDown(self) -> None:
+        BACKGROUND_JOBS.join()
+        db.session.remove()
+        db.engine.dispose()
+        SHARD_ENGINES.clear()
+        TAG_ID_CACHE.clear()
+        self.context.pop()
+        self.directory.cleanup()
+
+    def create_app(self, shard_directory):
+        return create_app({"SQLALCHEMY_DATABASE_URI": "sqlite:///" + self.database_path,
+                           "SHARD_DIRECTORY": shard_directory, "TESTING": True})
+
+    def create_user(self, username: str) -> str:
+        return DiaryUser.create_user({"username": username, "full_name": "Test User", "password": "password"})[
+            "user_id"]
+
+
+class ShardRouterTestRouting(ShardTestCase):
+
+    def test_entries_are_stored_in_the_shard_of_their_user(self):
+        first_id, second_id = self.create_user("first"), self.create_user("second")
+        entry_id = create_entry(first_id, "A long Monday", ["school"])
+        create_entry(second_id, "A new day", ["school"])
+
+        self.assertEqual(ShardRouter.shard_user_ids(), sorted([first_id, second_id]))
+        with ShardRouter.routed(first_id):
+            self.assertEqual([entry.id for entry in Entry.query], [entry_id])
+            self.assertEqual(list(Diary.read_entries_page(first_id, "monday", None)["entries"]), [entry_id])
+            self.assertEqual(list(Diary.read_entries_page(first_id, "mondy", None, fuzzy=True)["entries"]),
+                             [entry_id])
+        db.session.remove()
+        with ShardRouter.routed(second_id):
+            self.assertIsNone(Entry.query.get(entry_id))
+            self.assertEqual([(usage.name, usage.entry_count) for usage in Diary.read_tag_usage(second_id)],
+                             [("school", 1)])
+
+    def test_users_stay_in_the_directory_database(self):
+        user_id = self.create_user("first")
+        create_entry(user_id, "Title", [])
+        self.assertEqual(User.query.get(user_id).username, "first")
+        with ShardRouter.engine(user_id).connect() as connection:
+            self.assertEqual(connection.execute(User.__table__.select()).all(), [])
+
+    def test_using_entries_without_a_user_raises(self):
+        with self.assertRaises(RuntimeError):
+            Entry.query.count()
+        db.session.rollback()
+
+    def test_user_id_that_cannot_name_a_file_raises(self):
+        with self.assertRaises(ValueError):
+            ShardRouter.shard_path("../directory")
+
+    @mock.patch('flask_login.utils._get_user')
+    def test_requests_are_routed_to_the_logged_in_user(self, current_user):
+        user_id = self.create_user("first")
+        create_entry(user_id, "A long Monday", [])
+        current_user.return_value = User.query.get(user_id)
+        client = self.app.test_client()
+        self.assertIn(b"A long Monday", client.get("/").data)
+        self.assertEqual(client.get("/api/v1/entries").json["count"], 1)
+
+    def test_rebuild_commands_run_on_every_shard(self):
+        for username in ("first", "second"):
+            create_entry(self.create_user(username), "Title", ["tag"])
+        result = self.app.test_cli_runner().invoke(args=["rebuild-mood-rollups"])
+        self.assertIn("Counted the moods of 2 entries.", result.output)
+
+    def test_purge_deletes_the_shard(self):
+        user_id = self.create_user("first")
+        create_entry(user_id, "Title", [])
+        DiaryUser.delete_user({"user": User.query.get(user_id)})
+        BACKGROUND_JOBS.join()
+        self.assertEqual(os.listdir(self.shard_directory), [])
+        self.assertIsNone(User.query.get(user_id).username)
+
+
+class ShardRouterTestSplitDatabase(ShardTestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.context.pop()
+        db.session.remove()
+        self.source_app = self.create_app(None)
+        self.context = self.source_app.app_context()
+        self.context.push()
+
+    def test_split_copies_each_user_into_their_shard(self):
+        first_id, second_id = self.create_user("first"), self.create_user("second")
+        first_entry = Diary.create_entry({"title": "A long Monday", "body": "Body", "user_id": first_id,
+                                          "tags": ["school", "fun"], "mood": "&#128512"})["entry_id"]
+        Diary.create_entry({"title": "A new day", "body": "Body", "user_id": second_id, "tags": ["school"],
+                            "mood": "&#128532"})
+
+        runner = self.source_app.test_cli_runner()
+        result = runner.invoke(args=["split-database", self.shard_directory])
+        self.assertIn("Split the entries of 2 users", result.output)
+        self.assertEqual(runner.invoke(args=["split-database", self.shard_directory]).output,
+                         f"Split the entries of 0 users into {self.shard_directory}.\n")
+
+        self.context.pop()
+        db.session.remove()
+        TAG_ID_CACHE.clear()
+        self.context = self.app.app_context()
+        self.context.push()
+        with ShardRouter.routed(first_id):
+            self.assertEqual(list(Diary.read_entries_page(first_id, "monday", None)["entries"]), [first_entry])
+            self.assertEqual(list(Diary.read_entries_page(first_id, "mondy", None, fuzzy=True)["entries"]),
+                             [first_entry])
+            self.assertEqual(sorted(tag.name for tag in Entry.query.get(first_entry).tags), ["fun", "school"])
+            self.assertEqual(Entry.query.count(), 1)
+            Diary.create_entry({"title": "Later", "body": "Body", "user_id": first_id, "tags": ["school"],
+                                "mood": "&#128512"})
+            self.assertEqual(Diary.read_tag_usage(first_id)[0].entry_count, 2)
+
+
+class ShardEnginesTestLru(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.engines = ShardEngines(max_open=2)
+
+    def tearDown(self) -> None:
+        self.engines.clear()
+        self.directory.cleanup()
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.directory.name, name + ".db")
+
+    def test_least_recently_used_engine_is_closed(self):
+        first = self.engines.get(self.path("first"))
+        self.engines.get(self.path("second"))
+        self.assertIs(self.engines.get(self.path("first")), first)
+        self.engines.get(self.path("third"))
+        self.assertEqual(self.engines.stats(), {"open": 2, "max_open": 2, "opened": 3, "closed": 1})
+        self.assertIsNot(self.engines.get(self.path("second")), None)
+        self.assertEqual(self.engines.stats()["opened"], 4)
+
+    def test_open_engines_fit_the_file_descriptor_limit(self):
+        with mock.patch("personal_diary.shards.resource.getrlimit", return_value=(300, 300)):
+            self.assertEqual(ShardEngines(max_open=128).max_open, 10)
+
+    def test_shard_created_at_once_by_several_threads_is_created_once(self):
+        errors = []
+
+        def create():
+            try:
+                ShardEngines.create_shard(self.path("shared"))
+            except Exception as error:
+                errors.append(error)
+
+        threads = [threading.Thread(target=create) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(os.listdir(self.directory.name), ["shared.db"])
+
+
+if __name__ == '__main__':
+    unittest.main()
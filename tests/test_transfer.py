@@ -0,0 +1,132 @@
+import unittest
+import os
+import json
+from datetime import datetime, timezone
+from personal_diary.app import flask_app
+from personal_diary.diary import Diary, TAG_ID_CACHE
+from personal_diary.transfer import DiaryTransfer
+from personal_diary.models import Entry, Tag, User
+from personal_diary import db
+
+basedir = os.path.abspath(os.path.dirname(__file__))
+flask_app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(basedir, "test_database.db")
+flask_app.app_context().push()
+db.create_all()
+
+
+def valid_row(number: int = 0) -> dict:
+    return {"title": f"Title {number}", "body": f"<p>Body {number}</p>", "mood": "&#128512",
+            "tags": ["school", "fun"], "created": f"2022-05-01T10:{number % 60:02d}:00"}
+
+
+class DiaryTransferTestValidateRow(unittest.TestCase):
+
+    def test_valid_row_fills_in_defaults(self):
+        entry = DiaryTransfer.validate_row({"title": "A long Day", "body": "Today was monday"})
+        self.assertEqual(entry["mood"], "&#128528")
+        self.assertEqual(entry["tags"], [])
+        self.assertEqual(entry["modified"], entry["created"])
+
+    def test_datetimes_with_offset_are_converted_to_local_time(self):
+        entry = DiaryTransfer.validate_row({"title": "Title", "body": "Body", "created": "2024-01-01T00:00:00+02:00",
+                                            "modified": "2024-01-01T12:00:00+00:00"})
+        self.assertEqual(entry["created"], datetime(2023, 12, 31, 22, 0, tzinfo=timezone.utc).astimezone()
+                         .replace(tzinfo=None))
+        self.assertEqual(entry["modified"], datetime(2024, 1, 1, 12, 0, tzinfo=timezone.utc).astimezone()
+                         .replace(tzinfo=None))
+        self.assertIsNone(entry["created"].tzinfo)
+
+    def test_empty_and_duplicate_tags_are_dropped(self):
+        entry = DiaryTransfer.validate_row({"title": "t", "body": "b", "tags": ["school", "", None, "school"]})
+        self.assertEqual(entry["tags"], ["school"])
+
+    def test_invalid_rows_raise_value_error(self):
+        invalid_rows = [
+            None,
+            {"body": "b"},
+            {"title": "t" * 81, "body": "b"},
+            {"title": "t", "body": " "},
+            {"title": "t", "body": "b" * 301},
+            {"title": "t", "body": "b", "mood": "happy"},
+            {"title": "t", "body": "b", "tags": ["a", "b", "c", "d"]},
+            {"title": "t", "body": "b", "tags": ["t" * 21]},
+            {"title": "t", "body": "b", "tags": "school"},
+            {"title": "t", "body": "b", "created": "yesterday"}
+        ]
+        for row in invalid_rows:
+            with self.subTest(row=row):
+                with self.assertRaises(ValueError):
+                    DiaryTransfer.validate_row(row)
+
+
+class DiaryTransferTestImportExport(unittest.TestCase):
+
+    def setUp(self) -> None:
+        TAG_ID_CACHE.clear()
+        db.session.add(User(id="1", username="username", name="Test User", password="password"))
+        db.session.commit()
+
+    def tearDown(self) -> None:
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+        db.session.commit()
+
+    def test_import_inserts_entries_with_tags_in_chunks(self):
+        result = DiaryTransfer.import_entries("1", (valid_row(number) for number in range(25)), chunk_size=10)
+        self.assertEqual(result, {"imported": 25, "skipped": 0, "errors": []})
+        self.assertEqual(Entry.query.filter_by(user_id="1").count(), 25)
+        self.assertEqual(sorted(tag.name for tag in Tag.query.all()), ["fun", "school"])
+        self.assertEqual(len(Diary.read_all_entries("1", "school")), 25)
+
+    def test_import_skips_invalid_rows_and_reports_row_numbers(self):
+        rows = DiaryTransfer.read_jsonl([json.dumps(valid_row(1)) + "\n", "not json\n", "\n",
+                                         json.dumps({"title": "t"}) + "\n", json.dumps(valid_row(2)) + "\n"])
+        result = DiaryTransfer.import_entries("1", rows)
+        self.assertEqual(result["imported"], 2)
+        self.assertEqual(result["skipped"], 2)
+        self.assertEqual([row_number for row_number, _ in result["errors"]], [2, 3])
+
+    def test_import_reuses_existing_tags(self):
+        Diary.create_entry({"title": "t", "body": "b", "tags": ["school"], "user_id": "1", "mood": "&#128512"})
+        DiaryTransfer.import_entries("1", [valid_row()])
+        self.assertEqual(Tag.query.filter_by(name="school").count(), 1)
+
+    def test_jsonl_export_round_trips_through_import(self):
+        DiaryTransfer.import_entries("1", (valid_row(number) for number in range(5)))
+        lines = list(DiaryTransfer.write_jsonl(DiaryTransfer.read_entries("1", chunk_size=2)))
+        self.assertEqual(len(lines), 5)
+        exported = [json.loads(line) for line in lines]
+        self.assertEqual([entry["title"] for entry in exported], [f"Title {number}" for number in range(5)])
+        self.assertEqual(exported[0]["tags"], ["school", "fun"])
+        self.assertEqual(exported[0]["created"], "2022-05-01T10:00:00")
+
+    def test_csv_export_round_trips_through_import(self):
+        DiaryTransfer.import_entries("1", (valid_row(number) for number in range(3)))
+        lines = "".join(DiaryTransfer.write_csv(DiaryTransfer.read_entries("1"))).splitlines(keepends=True)
+        self.assertEqual(lines[0].strip(), "title,body,mood,created,modified,tag1,tag2,tag3")
+
+        db.session.add(User(id="2", username="username2", name="Test User", password="password"))
+        db.session.commit()
+        self.assertEqual(DiaryTransfer.import_entries("2", DiaryTransfer.read_csv(lines))["imported"], 3)
+        self.assertEqual(list(DiaryTransfer.read_entries("2")), list(DiaryTransfer.read_entries("1")))
+
+    def test_import_command_reads_file_and_reports_counts(self):
+        path = os.path.join(basedir, "import_test.jsonl")
+        with open(path, "w") as import_file:
+            import_file.write(json.dumps(valid_row()) + "\n{}\n")
+        try:
+            result = flask_app.test_cli_runner().invoke(args=["import-entries", "username", path])
+        finally:
+            os.remove(path)
+        self.assertIn("Imported 1 entries, skipped 1 rows.", result.output)
+        self.assertEqual(Entry.query.filter_by(user_id="1").count(), 1)
+
+    def test_export_command_writes_to_standard_output(self):
+        DiaryTransfer.import_entries("1", [valid_row()])
+        result = flask_app.test_cli_runner().invoke(args=["export-entries", "username"])
+        self.assertEqual(json.loads(result.output)["title"], "Title 0")
+
+
+if __name__ == '__main__':
+    unittest.main()